@@ -1,73 +1,238 @@
 #!/usr/bin/env python3
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 import re
 import argparse
+import requests
 from pathlib import Path
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from constants import stGeorgeCoursesRe, allProgramsRe
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, recordRequest, progressLine
 
 # Set up argument parsing
 parser = argparse.ArgumentParser(description='Scrapes course and program IDs from https://artsci.calendar.utoronto.ca/listing-program-subject-areas.')
-parser.add_argument('chromedriver_path', type=Path, help="path to a valid chromedriver executable")
-parser.add_argument('--c_ids_file', type=argparse.FileType('w'), help="path to ASCII file to store scraped course IDs. default: ./course-ids.txt", default="./course-ids.txt", metavar='file')
-parser.add_argument('--p_ids_file', type=argparse.FileType('w'), help="path to ASCII file to store scraped program IDs. default: ./program-ids.txt", default="./program-ids.txt", metavar='file')
+parser.add_argument('chromedriver_path', type=Path, nargs='?', help="path to a valid chromedriver executable. Not needed with --http", default=None)
+parser.add_argument('--c_ids_file', type=str, help="path to ASCII file to store scraped course IDs. default: ./course-ids.txt", default="./course-ids.txt", metavar='file')
+parser.add_argument('--p_ids_file', type=str, help="path to ASCII file to store scraped program IDs. default: ./program-ids.txt", default="./program-ids.txt", metavar='file')
+parser.add_argument('--http', action='store_true', help="fetch the pages with plain HTTP requests and parse them directly, instead of rendering them in Chrome. No chromedriver is needed in this mode")
+parser.add_argument('--drivers', type=int, help="number of headless Chrome instances to load subject area pages in concurrently. default: 1", default=1, metavar='num')
+parser.add_argument('--workers', type=int, help="max number of subject area pages to fetch concurrently with --http. default: 8", default=8, metavar='num')
+addMetricsArguments(parser)
 
-# Chromedriver options
-options = Options()
-options.add_argument('--headless')
-options.add_argument('--window-size=1920x1080')
+listingURL = "https://artsci.calendar.utoronto.ca/listing-program-subject-areas"
 
-if __name__ == "__main__":
-    args = parser.parse_args()
+def uniqueLinks(links):
+    # Drops repeated links, keeping the first of each in order.
+    return list(dict.fromkeys(links))
+
+def parseHeaders(headerTexts, onCourseID, onProgramID):
+    # Pick the course or program ID out of the text of each collapsible header.
+    numCourses = 0
+    numPrograms = 0
+    for text in headerTexts:
+        c = stGeorgeCoursesRe.search(text)
+        p = allProgramsRe.search(text)
+        if c:
+            numCourses += 1
+            onCourseID(c.group(0))
+        if p:
+            numPrograms += 1
+            onProgramID(p.group(0))
+    return (numCourses, numPrograms)
+
+def scrapeIDs(chromedriverPath, onCourseID, onProgramID, drivers=1):
+    # Only imported here, so that --http doesn't need selenium installed at all.
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    # Chromedriver options
+    options = Options()
+    options.add_argument('--headless')
+    options.add_argument('--window-size=1920x1080')
+
+    with ThreadPoolExecutor(max_workers=drivers) as executor:
+        # Set up the drivers. Each one takes a couple of seconds to start, so start them all at once.
+        startedDrivers = list(executor.map(lambda _: webdriver.Chrome(executable_path=chromedriverPath, options=options), range(drivers)))
+        try:
+            driver = startedDrivers[0]
+            start = time.perf_counter()
+            driver.get(listingURL)
+            # The browser doesn't report a status or size, only how long the page took to load.
+            recordRequest("listing page", time.perf_counter() - start, "loaded")
+
+            # Get all links in all the tables of the div containing them first. The <a>s themselves will expire if we go to each link and then come back, but the links will remain constant. The first link in each alphabet's table is the one that scrolls the table to the top when that alphabet is clicked i.e. clicking 'B' at the top brings the #B <a> to the top.
+            # Every link is read in this one script instead of one WebDriver round trip per <a>.
+            tableLinks = driver.execute_script("""
+                const tables = document.querySelector("#block-fas-content > div > article > div > div").getElementsByTagName("table");
+                return Array.from(tables, table => Array.from(table.getElementsByTagName("a"), a => a.href).slice(1));
+            """)
+
+            # A few subject areas all link to the same page. Notably, these include those offered by colleges such as Trinity, University, etc. which all link to the respective college's page. Visit each page only once, so their courses aren't scraped multiple times.
+            subjectAreaLinks = uniqueLinks(link for links in tableLinks for link in links)
+            progressLine.start("subject areas", len(subjectAreaLinks))
+
+            # Each page is loaded by whichever driver is free. As with the cells in de_course_downloader.py, a driver is claimed for the whole load -> read.
+            freeDrivers = queue.Queue()
+            for startedDriver in startedDrivers:
+                freeDrivers.put(startedDriver)
+
+            def readSubjectAreaPage(link):
+                pageDriver = freeDrivers.get()
+                try:
+                    start = time.perf_counter()
+                    pageDriver.get(link)
+                    recordRequest("subject area page", time.perf_counter() - start, "loaded")
+                    # Likewise, every header's text in one call instead of one per element.
+                    return pageDriver.execute_script("""
+                        return Array.from(document.querySelectorAll(".js-views-accordion-group-header"), header => header.innerText);
+                    """)
+                finally:
+                    freeDrivers.put(pageDriver)
+
+            numCourses = 0
+            numPrograms = 0
+
+            # Pages are handled in listing order, whichever driver finishes first.
+            for (link, headerTexts) in zip(subjectAreaLinks, executor.map(readSubjectAreaPage, subjectAreaLinks)):
+                (pageCourses, pagePrograms) = parseHeaders(headerTexts, onCourseID, onProgramID)
+                numCourses += pageCourses
+                numPrograms += pagePrograms
+                progressLine.advance("subject areas")
+                print(f"{link}: {len(headerTexts)}")
+        finally:
+            # Close stuff
+            for startedDriver in startedDrivers:
+                startedDriver.close()
+                startedDriver.quit()
 
-    # Set up the driver
-    driver = webdriver.Chrome(executable_path=args.chromedriver_path, options=options)
-    driver.get("https://artsci.calendar.utoronto.ca/listing-program-subject-areas")
+    return (len(subjectAreaLinks), numCourses, numPrograms)
 
-    # Get the div containing all the tables.
-    alphabetProgramTables = driver.find_element_by_css_selector("#block-fas-content > div > article > div > div").find_elements_by_tag_name('table')
 
-    # Get all links in all the tables first. The <a>s themselves will expire if we go to each link and then come back, but the links will remain constant.
-    subjectAreaLinks = []
+# Tags that never have a closing tag, so they must not count towards nesting depth.
+voidTags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
 
-    for table in alphabetProgramTables:
-        # The first link in each alphabet's table is the one that scrolls the table to the top when that alphabet is clicked i.e. clicking 'B' at the top brings the #B <a> to the top.
-        for a in table.find_elements_by_tag_name('a')[1:]:
-            subjectAreaLinks.append(a.get_attribute('href'))
+class ListingPageParser(HTMLParser):
+    # Collects the links in every table of the page's content block, the same ones the Chrome mode reads.
+    def __init__(self):
+        super().__init__()
+        self.contentDepth = 0
+        self.tables = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.contentDepth == 0:
+            if attrs.get("id") == "block-fas-content" and tag not in voidTags:
+                self.contentDepth = 1
+            return
+        if tag not in voidTags:
+            self.contentDepth += 1
+        if tag == "table":
+            self.tables.append([])
+        elif tag == "a" and self.tables and attrs.get("href") is not None:
+            self.tables[-1].append(attrs["href"])
+
+    def handle_endtag(self, tag):
+        if self.contentDepth > 0 and tag not in voidTags:
+            self.contentDepth -= 1
+
+class SubjectAreaPageParser(HTMLParser):
+    # Collects the text of every collapsible header on a subject area page.
+    def __init__(self):
+        super().__init__()
+        self.headerDepth = 0
+        self.headerTexts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in voidTags:
+            return
+        if self.headerDepth > 0:
+            self.headerDepth += 1
+        elif "js-views-accordion-group-header" in (dict(attrs).get("class") or "").split():
+            self.headerDepth = 1
+            self.headerTexts.append("")
+
+    def handle_endtag(self, tag):
+        if self.headerDepth > 0 and tag not in voidTags:
+            self.headerDepth -= 1
+
+    def handle_data(self, data):
+        if self.headerDepth > 0:
+            self.headerTexts[-1] += data
+
+def fetchPage(session, url, endpoint):
+    # Latencies are recorded under endpoint, e.g. every subject area page together.
+    start = time.perf_counter()
+    try:
+        r = session.get(url, timeout=30)
+    except requests.exceptions.RequestException as e:
+        recordRequest(endpoint, time.perf_counter() - start, type(e).__name__)
+        raise
+    recordRequest(endpoint, time.perf_counter() - start, r.status_code, len(r.content))
+    r.raise_for_status()
+    return r.text
+
+def readSubjectAreaPage(session, link):
+    pageParser = SubjectAreaPageParser()
+    pageParser.feed(fetchPage(session, link, "subject area page"))
+    # Collapse whitespace the way the browser's innerText would.
+    return [" ".join(text.split()) for text in pageParser.headerTexts]
+
+def scrapeIDsOverHTTP(onCourseID, onProgramID, workers):
+    # The calendar pages are rendered server-side, so the accordion headers are already in the plain HTML.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    listingParser = ListingPageParser()
+    listingParser.feed(fetchPage(session, listingURL, "listing page"))
+    # As in scrapeIDs, skip the first link of each table, which only scrolls the page. Links are made absolute to match what the browser reports.
+    subjectAreaLinks = uniqueLinks(urljoin(listingURL, href) for table in listingParser.tables for href in table[1:])
+    progressLine.start("subject areas", len(subjectAreaLinks))
 
-    # A few subject areas all link to the same page. Notably, these include those offered by colleges such as Trinity, University, etc. which all link to the respective college's page. Thus, we scrape some courses multiple times. This is to prevent such duplicates.
     numCourses = 0
-    # To weed out duplicate program IDs, just in case they come up somehow.
     numPrograms = 0
 
+    # Pages are fetched concurrently, but handled in the same order as scrapeIDs, so the ID files come out identical.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (link, headerTexts) in zip(subjectAreaLinks, executor.map(lambda link: readSubjectAreaPage(session, link), subjectAreaLinks)):
+            (pageCourses, pagePrograms) = parseHeaders(headerTexts, onCourseID, onProgramID)
+            numCourses += pageCourses
+            numPrograms += pagePrograms
+            progressLine.advance("subject areas")
+            print(f"{link}: {len(headerTexts)}")
+
+    return (len(subjectAreaLinks), numCourses, numPrograms)
 
-    for link in subjectAreaLinks:
-        driver.get(link)
-        # elems = driver.find_elements_by_css_selector(".view-display-id-block_1")
-        collapsiblePs = driver.find_elements_by_css_selector('.js-views-accordion-group-header')
-        for p in collapsiblePs:
-            text = p.get_attribute('innerText')
-            c = stGeorgeCoursesRe.search(text)
-            p = allProgramsRe.search(text)
-            if c:
-                numCourses += 1
-                args.c_ids_file.write(c.group(0) + "\n")
-            if p:
-                numPrograms += 1
-                args.p_ids_file.write(p.group(0) + "\n")
 
-        print(f"{link}: {len(collapsiblePs)}")
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if not args.http and args.chromedriver_path is None:
+        parser.error("chromedriver_path is required unless --http is given")
+    startMetrics(args)
+
+    # Only opened once the arguments are known to be valid, so that a run that never starts doesn't leave empty ID files behind.
+    cIDsFile = open(args.c_ids_file, "w")
+    pIDsFile = open(args.p_ids_file, "w")
+    onCourseID = lambda courseID: cIDsFile.write(courseID + "\n")
+    onProgramID = lambda programID: pIDsFile.write(programID + "\n")
+    with phase("scrape"):
+        if args.http:
+            (numSubjectAreas, numCourses, numPrograms) = scrapeIDsOverHTTP(onCourseID, onProgramID, args.workers)
+        else:
+            (numSubjectAreas, numCourses, numPrograms) = scrapeIDs(args.chromedriver_path, onCourseID, onProgramID, args.drivers)
 
     # Print some diagnostics
     print("Finished.")
-    print(f"Examined {len(subjectAreaLinks)} subject areas and scraped:")
+    print(f"Examined {numSubjectAreas} subject areas and scraped:")
     print(f"\t{numCourses} course(s)")
     print(f"\t{numPrograms} program(s)")
 
     # Close stuff
-    args.c_ids_file.close()
-    args.p_ids_file.close()
-    driver.close()
-    driver.quit()
\ No newline at end of file
+    cIDsFile.close()
+    pIDsFile.close()
+    writeMetricsReport(args)
@@ -0,0 +1,37 @@
+import hashlib
+import json
+import os
+
+from run_metrics import timed
+
+# Shared bookkeeping for the aggregators' --incremental mode. The manifest maps each input file's name to its fingerprint (size, mtime and content hash) and whatever the aggregator needs to reuse the file's cleaned output without reprocessing it.
+
+def addManifestArguments(parser, defaultManifestFile):
+    parser.add_argument("--incremental", help="include to only reprocess input JSONs that were added, changed or deleted since the last incremental run, reusing the rest from the manifest.", action="store_true")
+    parser.add_argument("--manifest_file", type=str, help=f"path to the manifest that --incremental reads and updates. default: {defaultManifestFile}", default=defaultManifestFile, metavar="file")
+
+def loadManifest(manifestFile):
+    # A missing or unreadable manifest just means everything gets reprocessed.
+    try:
+        with open(manifestFile) as f, timed("jsonParseSeconds"):
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveManifest(manifestFile, manifest):
+    # Written to a temporary file first, so an interrupted run can't leave a half-written manifest behind.
+    with open(f"{manifestFile}.tmp", "w") as f, timed("jsonDumpSeconds"):
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(f"{manifestFile}.tmp", manifestFile)
+
+def fingerprintFile(path, entry):
+    # Returns the fingerprint of the file at path, and whether its contents are the same as the ones entry was recorded for. If the size and mtime haven't moved, the file is trusted to be unchanged without hashing it again.
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if entry is not None and entry["size"] == fingerprint["size"] and entry["mtime"] == fingerprint["mtime"]:
+        fingerprint["hash"] = entry["hash"]
+        return (fingerprint, True)
+
+    with open(path, "rb") as f:
+        fingerprint["hash"] = hashlib.sha256(f.read()).hexdigest()
+    return (fingerprint, entry is not None and entry["hash"] == fingerprint["hash"])
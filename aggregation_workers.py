@@ -0,0 +1,39 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+# Shared process pool plumbing for the aggregators' --workers option. Cleaning one input never depends on another, so inputs can be spread across processes as long as the results are merged back in input order.
+
+# Inputs are sent to the workers in batches of this many, so that inter-process overhead doesn't eat up the gains on small inputs.
+chunkSize = 32
+
+def addWorkerArguments(parser):
+    parser.add_argument("--workers", type=int, help="number of processes to clean input JSONs with. 1 cleans everything in this process. default: 1", default=1, metavar="num")
+
+def mapChunk(func, chunk):
+    return [func(item) for item in chunk]
+
+def boundedMap(executor, func, items, workers):
+    # Like executor.map, except that items are read lazily and only a couple of batches per worker are in flight at a time. Memory stays flat however many inputs there are.
+    items = iter(items)
+    inFlight = deque()
+    while True:
+        while len(inFlight) < workers * 2:
+            chunk = list(islice(items, chunkSize))
+            if not chunk:
+                break
+            inFlight.append(executor.submit(mapChunk, func, chunk))
+        if not inFlight:
+            return
+        yield from inFlight.popleft().result()
+
+@contextmanager
+def orderedMap(func, items, workers):
+    # Yields an iterator over func(item) for every item, in the same order as items no matter which process finished first. With one worker, nothing is sent to another process at all.
+    if workers <= 1:
+        yield map(func, items)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield boundedMap(executor, func, items, workers)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+
+import requests
+
+benchmarksDir = Path(__file__).resolve().parent
+sys.path.insert(0, str(benchmarksDir.parent))
+
+from constants import allProgramsRe
+from de_client import addClientArguments, openClient
+from entity_store import openStore, RefreshTracker
+from de_course_downloader import downloadCourses, parseCells
+from de_program_downloader import downloadPrograms
+from de_course_category_downloader import crawlCourseCategories
+import mock_de_server
+from run_benchmarks import gitCommit, loadResults, formatChange
+
+# Set up argument parsing. Every argument not listed here is passed on to mock_de_server.py, e.g. --latency 50 --error_rate 0.01.
+parser = argparse.ArgumentParser(description="Benchmarks the course, program and course category downloaders against benchmarks/mock_de_server.py, reporting requests per second, latency percentiles and total time, and compares the results against the previous run with the same settings. Arguments not listed here are passed on to mock_de_server.py, which is started on a free port unless --base_url points at one already running with the same fixtures.")
+parser.add_argument("--downloaders", nargs="+", choices=["courses", "programs", "course_categories"], help="which downloaders to benchmark. default: all of them", default=["courses", "programs", "course_categories"])
+parser.add_argument("--limit", type=int, help="max number of IDs to download with each downloader. default: all of them", default=None, metavar="n")
+parser.add_argument("--cells", type=str, nargs="+", help="cells of the planner to download courses through, as ROW,COL or ROW1-ROW2,COL1-COL2, like de_course_downloader.py. default: 0-1,0-3", default=["0-1,0-3"], metavar="cell")
+parser.add_argument("--workers", type=int, help="max number of course categories to download concurrently. default: 8", default=8, metavar="num")
+parser.add_argument("--store", help="include to download into a SQLite store instead of JSONs directories.", action="store_true")
+parser.add_argument("--cookie", type=str, help="cookie to send. The mock server accepts any, as long as POSTs come with an XSRF token. default: JSESSIONID=benchmark; XSRF-TOKEN=benchmark", default="JSESSIONID=benchmark; XSRF-TOKEN=benchmark", metavar="cookie")
+parser.add_argument("--results_file", type=str, help="path to file to append the results to, one JSON object per line. default: benchmarks/download_results.jsonl", default=str(benchmarksDir / "download_results.jsonl"), metavar="file")
+addClientArguments(parser)
+# Nothing here should ever reach the real Degree Explorer by accident, and the mock server is only slowed down on purpose.
+parser.set_defaults(base_url=None, max_rate=0)
+
+
+def startMockServer(serverArgs):
+    server = subprocess.Popen([sys.executable, str(benchmarksDir / "mock_de_server.py"), "--port", "0"] + serverArgs, stdout=subprocess.PIPE, text=True)
+    baseURL = server.stdout.readline().strip()
+    if not baseURL:
+        server.wait()
+        raise RuntimeError("mock_de_server.py failed to start")
+    return (server, baseURL)
+
+def serverStats(baseURL):
+    # Only mock_de_server.py has these.
+    url = urllib.parse.urlsplit(baseURL)
+    try:
+        return requests.get(f"{url.scheme}://{url.netloc}/stats", timeout=5).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+def timeRequests(client):
+    # Every HTTP request the client sends, retries included, as (endpoint, seconds). Wraps the session, so that time spent waiting on the rate limiter or backing off isn't counted as latency.
+    timings = []
+    sessionRequest = client.session.request
+    def timedRequest(method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            return sessionRequest(method, url, **kwargs)
+        finally:
+            timings.append((urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1], time.perf_counter() - start))
+    client.session.request = timedRequest
+    return timings
+
+def percentile(sortedValues, fraction):
+    # Nearest rank, so every percentile is a latency that actually happened.
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, max(0, int(fraction * len(sortedValues) + 0.5) - 1))]
+
+def latencySummary(seconds):
+    seconds = sorted(seconds)
+    return {
+        "requests": len(seconds),
+        "p50Ms": percentile(seconds, 0.5) * 1000 if seconds else None,
+        "p90Ms": percentile(seconds, 0.9) * 1000 if seconds else None,
+        "p99Ms": percentile(seconds, 0.99) * 1000 if seconds else None,
+        "maxMs": seconds[-1] * 1000 if seconds else None
+    }
+
+def runDownloader(downloader, args, ids, storeDir):
+    store = openStore(f"{storeDir}/{downloader}", f"{storeDir}/store.sqlite" if args.store else None, downloader)
+    Path(f"{storeDir}/{downloader}").mkdir(exist_ok=True, parents=True)
+    # Everything is downloaded into an empty store, so nothing is ever skipped.
+    refresh = RefreshTracker()
+    categories = set()
+
+    if downloader == "courses":
+        cells = parseCells(args.cells)
+        client = openClient(args, max(args.pool_size, len(cells)))
+        download = lambda: downloadCourses(client, ids, cells, store, refresh, categories.add)
+    elif downloader == "programs":
+        client = openClient(args, args.pool_size)
+        download = lambda: downloadPrograms(client, ids, store, refresh, categories.add)
+    else:
+        client = openClient(args, max(args.pool_size, args.workers), posts=False)
+        download = lambda: crawlCourseCategories(client, ids, store, refresh, args.workers)
+    timings = timeRequests(client)
+
+    # The downloaders print a line per ID. Only the results should come out of this script.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        download()
+        totalTime = time.perf_counter() - start
+
+    endpoints = {}
+    for (endpoint, seconds) in timings:
+        endpoints.setdefault(endpoint, []).append(seconds)
+    return dict(latencySummary([seconds for (_, seconds) in timings]), **{
+        "totalTime": totalTime,
+        "requestsPerSecond": len(timings) / totalTime if totalTime else None,
+        "downloaded": len(refresh.changed),
+        "endpoints": {endpoint: latencySummary(seconds) for (endpoint, seconds) in endpoints.items()}
+    })
+
+
+if __name__ == "__main__":
+    (args, serverArgs) = parser.parse_known_args()
+    # The IDs to download are whatever the server has, so work them out from the same fixtures.
+    fixtureArgs = mock_de_server.parser.parse_args(serverArgs)
+    fixtures = mock_de_server.loadFixtures(fixtureArgs.fixtures_dir, fixtureArgs.store_file) if fixtureArgs.fixtures_dir or fixtureArgs.store_file else mock_de_server.generateFixtures(fixtureArgs.courses, fixtureArgs.seed)
+
+    server = None
+    if args.base_url is None:
+        (server, args.base_url) = startMockServer(serverArgs)
+
+    previousResults = loadResults(args.results_file)
+    commit = gitCommit()
+    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+
+    try:
+        with open(args.results_file, "a") as resultsFile:
+            for downloader in args.downloaders:
+                # Programs of the same study area go together, like they do in the scraped IDs, so that the program downloader can harvest siblings without resetting the planner in between.
+                ids = sorted(fixtures[downloader], key=(lambda code: (allProgramsRe.match(code).group(2), code)) if downloader == "programs" else None)[:args.limit]
+                before = serverStats(args.base_url)
+                with tempfile.TemporaryDirectory() as storeDir:
+                    result = runDownloader(downloader, args, ids, storeDir)
+                after = serverStats(args.base_url)
+                if before is not None and after is not None:
+                    result["serverRequests"] = after["requests"] - before["requests"]
+                    result["cellClobbers"] = after["cellClobbers"] - before["cellClobbers"]
+
+                # Results are only ever compared against earlier ones with exactly the same parameters.
+                params = {"downloader": downloader, "ids": len(ids), "cells": args.cells, "workers": args.workers, "store": args.store, "poolSize": args.pool_size, "maxRate": args.max_rate, "maxRetries": args.max_retries, "server": serverArgs if server is not None else args.base_url}
+                resultsFile.write(json.dumps({"timestamp": timestamp, "commit": commit, "params": params, "result": result}) + "\n")
+                resultsFile.flush()
+
+                previous = next((previous for previous in reversed(previousResults) if previous["params"] == params), None)
+                old = previous["result"] if previous else {}
+                print(f"{downloader}: downloaded {result['downloaded']} of {len(ids)} in {result['totalTime']:.2f}s{formatChange(result['totalTime'], old.get('totalTime'))}")
+                if result["requests"]:
+                    print(f"\t{result['requests']} request(s), {result['requestsPerSecond']:.1f} req/s{formatChange(result['requestsPerSecond'], old.get('requestsPerSecond'))}")
+                    print(f"\tlatency p50 {result['p50Ms']:.1f}ms, p90 {result['p90Ms']:.1f}ms, p99 {result['p99Ms']:.1f}ms{formatChange(result['p99Ms'], old.get('p99Ms'))}, max {result['maxMs']:.1f}ms")
+                for (endpoint, summary) in result["endpoints"].items():
+                    print(f"\t\t{endpoint}: {summary['requests']} request(s), p50 {summary['p50Ms']:.1f}ms, p99 {summary['p99Ms']:.1f}ms")
+                if result.get("cellClobbers"):
+                    print(f"\t{result['cellClobbers']} course(s) were overwritten in their cell before being read back")
+                if previous:
+                    print(f"\tcompared against {previous['commit'] or 'an unknown commit'} at {previous['timestamp']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
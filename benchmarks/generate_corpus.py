@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import string
+import sys
+from pathlib import Path
+
+# The benchmarks live one level down, but import the repo's modules like every other script.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from entity_store import openStore
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Generates a synthetic corpus of course, program and course category JSONs shaped like the ones downloaded from https://degreeexplorer.utoronto.ca/, for benchmarking the aggregators.")
+parser.add_argument("--courses", type=int, help="number of courses to generate. default: 1000", default=1000, metavar="n")
+parser.add_argument("--programs", type=int, help="number of programs to generate. default: a tenth of the courses", default=None, metavar="n")
+parser.add_argument("--categories", type=int, help="number of course categories to generate. default: a fifth of the courses", default=None, metavar="n")
+parser.add_argument("--category_depth", type=int, help="how many levels of course categories including or excluding each other to generate. Categories on the last level only include top-level codes like CSC* or CSC148H1. default: 4", default=4, metavar="n")
+parser.add_argument("--category_sharing", type=float, help="chance, between 0 and 1, of a category including or excluding a category that something else already includes or excludes, instead of one nothing refers to yet. Higher means fewer, more widely shared subgraphs. default: 0.5", default=0.5, metavar="p")
+parser.add_argument("--seed", type=int, help="seed for the random generator. The same seed and sizes always give the same corpus. default: 0", default=0, metavar="n")
+parser.add_argument("--out_dir", type=str, help="path to directory to write the course_data, program_data and course_category_data directories into. default: ./benchmark_corpus", default="./benchmark_corpus", metavar="dir")
+parser.add_argument("--store_file", type=str, help="path to a SQLite store to write the corpus into instead of the JSONs directories. See entity_store.py. default: none", default=None, metavar="file")
+
+# The top-level codes categories include and exclude, i.e. the ones parseTopLevelCategory turns into regexes.
+topLevelTemplates = ["*{level}*", "{dept}*", "{dept}{level}*", "{dept}* (GR)", "*", "* (GR)", "{course}", "{course}", "{course}"]
+
+# countType/type combinations of course prerequisites, covering every branch cleanCourseObj has. The common ones are listed more than once.
+prerequisiteKinds = [
+    ("COURSES", "MINIMUM"), ("COURSES", "MINIMUM"), ("COURSES", "LIST"), ("COURSES", "LIST"),
+    ("FCES", "MINIMUM"), ("FCES", "MINIMUM"), ("FCES", "LIST"), ("FCES", "MAXIMUM"),
+    ("REQUISITES", "MINIMUM"), ("SUBJECT_POSTS", "MINIMUM"),
+    ("GRADE", "MINIMUM"), ("GPA", "MINIMUM"), ("YOS", "MINIMUM"), ("AVERAGE", "MINIMUM"),
+    ("COURSES", "COMPLEX"), ("COURSES", "NOTE"), ("SUBJECT_POSTS", "LIST")
+]
+
+# Types of program requirements, again covering every branch cleanProgramObj has.
+requirementKinds = ["MINIMUM", "MINIMUM", "MINIMUM", "MINIMUM", "LIST", "LIST", "NO_REUSE", "GROUPMINIMUM", "GROUPMAXIMUM", "REUSE", "NOTE", "COMPLEX"]
+
+programKinds = ["MAJ", "MIN", "SPE", "FOC", "CER"]
+
+filler = "This course is a synthetic stand-in for a real one, with about as much text as a real description."
+
+
+def departmentCodes(rng, count):
+    departments = set()
+    while len(departments) < count:
+        departments.add("".join(rng.choice(string.ascii_uppercase) for _ in range(3)))
+    return sorted(departments)
+
+def courseCodes(rng, count):
+    # Up to 800 courses a department, e.g. CSC148H1 and CSC148Y1, like the real calendar.
+    departments = departmentCodes(rng, count // 400 + 1)
+    codes = [f"{dept}{number}{length}1" for dept in departments for number in range(100, 500) for length in "HY"]
+    return sorted(rng.sample(codes, count))
+
+def programCodes(count):
+    # ASMAJ1689 and so on. There are only 9000 four digit numbers to go around, so every 9000 of a kind after the first get the next trailing letter, e.g. ASMAJ1000A. allProgramsRe still matches it.
+    codes = []
+    for i in range(count):
+        (number, kind) = divmod(i, len(programKinds))
+        suffix = string.ascii_uppercase[number // 9000 - 1] if number >= 9000 else ""
+        codes.append(f"AS{programKinds[kind]}{1000 + number % 9000}{suffix}")
+    return codes
+
+def requisiteItem(code):
+    return {"code": code, "display": code, "categoryEntity": False, "extraInfo": None}
+
+
+class CorpusGenerator:
+    def __init__(self, rng, courses, programs, categories, categoryDepth, categorySharing):
+        self.rng = rng
+        self.courses = courseCodes(rng, courses)
+        self.programs = programCodes(programs)
+        self.categories = [f"CAT{i:06d}" for i in range(categories)]
+        self.categoryDepth = max(categoryDepth, 1)
+        self.categorySharing = categorySharing
+
+    def randomCourse(self):
+        return self.rng.choice(self.courses)
+
+    def randomCategory(self):
+        return self.rng.choice(self.categories) if self.categories else self.randomCourse()
+
+    def codeItems(self, count, categoryChance=0.25):
+        return [requisiteItem(self.randomCategory() if self.rng.random() < categoryChance else self.randomCourse()) for _ in range(count)]
+
+    def courseObj(self, code):
+        prerequisites = []
+        for i in range(self.rng.choice([0, 0, 1, 1, 2, 2, 3, 4, 6])):
+            (countType, type_) = self.rng.choice(prerequisiteKinds)
+            prefix = "Completion of at least"
+            suffix = ""
+            items = self.codeItems(self.rng.randint(1, 4))
+            if countType == "REQUISITES":
+                # Needs the earlier prerequisites, e.g. "1 of P1, P2". The first one has none, so make it an ordinary course requisite.
+                if i == 0:
+                    countType = "COURSES"
+                else:
+                    items = [requisiteItem(f"P{j + 1}") for j in range(i)]
+                    prefix = "At least"
+                    suffix = "of the above"
+            elif countType == "SUBJECT_POSTS" and self.programs:
+                items = [requisiteItem(self.rng.choice(self.programs)) for _ in range(self.rng.randint(1, 2))]
+                prefix = "Enrolment in"
+            elif type_ == "NOTE":
+                items = []
+                suffix = "Permission of the instructor."
+            prerequisites.append({
+                "shortIdentifier": f"(P{i + 1})",
+                "displayPrefix": prefix,
+                "subItemConnectorString": self.rng.choice(["or", "and", ","]),
+                "displaySuffix": suffix,
+                "type": type_,
+                "countType": countType,
+                "count": self.rng.choice([1, 1, 2, 0.5, 1.0]),
+                "requisiteItems": items,
+                "orderNumber": i
+            })
+        # Sometimes a GROUPMINIMUM on top, restricting some of the earlier ones.
+        if len(prerequisites) >= 2 and self.rng.random() < 0.2:
+            drivers = self.rng.sample(range(1, len(prerequisites) + 1), 2)
+            prerequisites.append({
+                "shortIdentifier": f"(P{len(prerequisites) + 1})",
+                "displayPrefix": "At least",
+                "subItemConnectorString": "or",
+                "displaySuffix": f"from P{min(drivers)} , P{max(drivers)}",
+                "type": "GROUPMINIMUM",
+                "countType": self.rng.choice(["COURSES", "FCES"]),
+                "count": 1,
+                "requisiteItems": self.codeItems(1, 0),
+                "orderNumber": len(prerequisites)
+            })
+        return {
+            "code": code,
+            "title": f"Synthetic Course {code}",
+            "description": filler,
+            "creditValue": 1.0 if code[6] == "Y" else 0.5,
+            "prerequisites": prerequisites,
+            "corequisites": [],
+            "orderedExclusions": [{"shortIdentifier": "(E1)", "displayPrefix": "", "subItemConnectorString": ",", "displaySuffix": "", "type": "LIST", "countType": "COURSES", "count": 0, "requisiteItems": self.codeItems(self.rng.randint(1, 3), 0)}] if self.rng.random() < 0.4 else []
+        }
+
+    def programObj(self, code):
+        detailAssessments = []
+        count = self.rng.randint(2, 10)
+        for i in range(count):
+            type_ = self.rng.choice(requirementKinds)
+            prefix = ""
+            suffix = ""
+            items = self.codeItems(self.rng.randint(1, 6), 0.4)
+            if type_ == "MINIMUM":
+                kind = self.rng.choice(["Credits", "Courses", "Credits", "Requirements", "Grade"])
+                if kind == "Grade":
+                    prefix = "Grade of at least 70% in"
+                elif kind == "Requirements" and i > 0:
+                    prefix = f"At least {self.rng.randint(1, i)} Requirements from"
+                    items = [requisiteItem(f"Req{j + 1}") for j in range(i)]
+                else:
+                    prefix = f"At least {self.rng.choice(['0.5', '1.0', '2.0', '4.0'])} Credits from" if kind != "Courses" else f"At least {self.rng.randint(1, 4)} Courses from"
+            elif type_ == "LIST":
+                items = self.codeItems(self.rng.randint(1, 4), 0)
+                prefix = "All of"
+            elif type_ == "NO_REUSE":
+                items = [requisiteItem(f"Req{j + 1}") for j in self.rng.sample(range(count), min(count, 2))]
+                prefix = "No course may be used for more than one of"
+            elif type_ in ("GROUPMINIMUM", "GROUPMAXIMUM"):
+                prefix = f"{'At least' if type_ == 'GROUPMINIMUM' else 'No more than'} {self.rng.choice(['1.0 Credit', '2 Course', '0.5 Credit'])} from"
+                suffix = f"in Req{self.rng.randint(1, count)} and Req{self.rng.randint(1, count)}"
+            else:
+                prefix = "Consult the department about this requirement."
+            detailAssessments.append({
+                "credits": {"requiredCredits": self.rng.choice([0.5, 1.0, 2.0, 4.0])},
+                "requirement": {
+                    "shortIdentifier": f"(Req{i + 1})",
+                    "displayPrefix": prefix,
+                    "subItemConnectorString": self.rng.choice(["or", "and"]),
+                    "displaySuffix": suffix,
+                    "type": type_,
+                    "requisiteItems": items
+                }
+            })
+        return {"postCode": code, "title": f"Synthetic Program {code}", "detailAssessments": detailAssessments, "campus": "St. George"}
+
+    def topLevelCode(self):
+        # Now and then one that doesn't match any of them, like the odd code DE does have. It makes every category above it unvalidatable.
+        if self.rng.random() < 0.01:
+            return "ZZZ???"
+        course = self.randomCourse()
+        return self.rng.choice(topLevelTemplates).format(level=course[3], dept=course[:3], course=course)
+
+    def categoryObjs(self):
+        # Split the categories into levels. Categories only include or exclude ones on the next level down, so the graph is exactly as deep as asked, and has no cycles.
+        levels = [self.categories[level::self.categoryDepth] for level in range(self.categoryDepth)]
+        referenced = [[] for _ in levels]
+        unreferenced = [list(level) for level in levels]
+        for level in unreferenced:
+            self.rng.shuffle(level)
+
+        def pickCategory(level):
+            if unreferenced[level] and (not referenced[level] or self.rng.random() >= self.categorySharing):
+                code = unreferenced[level].pop()
+                referenced[level].append(code)
+                return code
+            return self.rng.choice(referenced[level])
+
+        for (level, codes) in enumerate(levels):
+            for code in codes:
+                def items(count):
+                    out = []
+                    for _ in range(count):
+                        if level + 1 < len(levels) and levels[level + 1] and self.rng.random() < 0.6:
+                            out.append({"code": pickCategory(level + 1), "display": "", "categoryEntity": True})
+                        else:
+                            out.append({"code": self.topLevelCode(), "display": "", "categoryEntity": False})
+                    return out
+                yield (code, {"code": code, "display": f"Synthetic category {code}", "includeItems": items(self.rng.randint(1, 4)), "excludeItems": items(self.rng.choice([0, 0, 1, 2]))})
+
+
+def generateCorpus(outDir, storeFile, courses, programs=None, categories=None, categoryDepth=4, categorySharing=0.5, seed=0):
+    programs = courses // 10 if programs is None else programs
+    categories = courses // 5 if categories is None else categories
+    generator = CorpusGenerator(random.Random(seed), courses, programs, categories, categoryDepth, categorySharing)
+
+    stores = {}
+    for (table, dirName) in [("courses", "course_data"), ("programs", "program_data"), ("course_categories", "course_category_data")]:
+        Path(f"{outDir}/{dirName}").mkdir(exist_ok=True, parents=True)
+        stores[table] = openStore(f"{outDir}/{dirName}", storeFile, table)
+        if storeFile:
+            # The corpus can always be generated again, so there's no point in waiting for every row to hit the disk.
+            stores[table].connection.execute("PRAGMA synchronous=OFF")
+
+    for code in generator.courses:
+        stores["courses"].put(code, generator.courseObj(code))
+    for code in generator.programs:
+        stores["programs"].put(code, generator.programObj(code))
+    for (code, categoryObj) in generator.categoryObjs():
+        stores["course_categories"].put(code, categoryObj)
+
+    return {"courses": courses, "programs": programs, "categories": categories}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    print("Starting corpus generation...")
+
+    counts = generateCorpus(args.out_dir, args.store_file, args.courses, args.programs, args.categories, args.category_depth, args.category_sharing, args.seed)
+
+    # Print diagnostics
+    print("Finished.")
+    print(f"Generated {counts['courses']} course(s), {counts['programs']} program(s) and {counts['categories']} course categories into {args.store_file or args.out_dir}")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+# The benchmarks live one level down, but import the repo's modules like every other script.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import run_metrics
+
+# Runs one aggregator's main with the given arguments and prints what it took as a single JSON line. run_benchmarks.py runs this in a fresh process for every measurement, so that peak RSS belongs to that one run alone and the aggregators' module-level state starts out empty.
+#   python benchmarks/measure.py course_aggregator --c_jsons_dir ... --c_aggr_file ...
+
+def peakRSS(who):
+    # ru_maxrss is in KiB on Linux but in bytes on macOS.
+    maxRSS = resource.getrusage(who).ru_maxrss
+    return maxRSS // 1024 if sys.platform == "darwin" else maxRSS
+
+
+if __name__ == "__main__":
+    (moduleName, aggregatorArgs) = (sys.argv[1], sys.argv[2:])
+
+    start = time.perf_counter()
+    module = __import__(moduleName)
+    args = module.parser.parse_args(aggregatorArgs)
+    importTime = time.perf_counter() - start
+
+    # The aggregators print diagnostics as they go. Only the measurement should come out of this script.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        module.main(args)
+        wallTime = time.perf_counter() - start
+
+    print(json.dumps({
+        "wallTime": wallTime,
+        "importTime": importTime,
+        # Worker processes (--workers) are the children. Theirs is the peak of the largest one, not the sum.
+        "peakRSSKiB": peakRSS(resource.RUSAGE_SELF),
+        "peakChildRSSKiB": peakRSS(resource.RUSAGE_CHILDREN),
+        "phases": run_metrics.phaseTimes,
+        "counters": run_metrics.counters
+    }))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# The benchmarks live one level down, but import the repo's modules like every other script.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from entity_store import openStore
+from generate_corpus import CorpusGenerator
+
+# A local stand-in for Degree Explorer's REST API, implementing just the endpoints the downloaders call. Point them at it with --base_url, using any cookie. Courses, programs and course categories come from a corpus on disk (one downloaded earlier, or written by generate_corpus.py), or are generated in memory.
+#   POST dxPlanner/saveCourseEntry?tabIndex=&selRowIndex=&selColIndex=&newCourseCode=   puts a course into a cell of the planner
+#   GET  dxPlanner/getCellDetails?tabIndex=&rowIndex=&colIndex=                          the course currently in that cell
+#   POST dxPlanner/saveProgramEntry?tabIndex=&newPostCode=                               adds a program, answering with every program on the planner
+#   POST dxPlanner/resetPrograms?tabIndex=                                               clears the programs off the planner
+#   GET  dxStudent/getCategoryCourses?categoryCode=                                      a course category, its code URL-encoded twice
+# Like DE, every cookie gets its own planner. GET /stats returns what the server has seen so far.
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Serves a local imitation of the Degree Explorer endpoints the downloaders use, with configurable latency and errors, for benchmarking and testing the downloaders offline.")
+parser.add_argument("--host", type=str, help="address to listen on. default: 127.0.0.1", default="127.0.0.1", metavar="host")
+parser.add_argument("--port", type=int, help="port to listen on. 0 picks a free one. default: 8765", default=8765, metavar="port")
+parser.add_argument("--fixtures_dir", type=str, help="path to directory with course_data, program_data and course_category_data directories of JSONs to serve, e.g. from the downloaders or generate_corpus.py. default: generate a corpus in memory", default=None, metavar="dir")
+parser.add_argument("--store_file", type=str, help="path to a SQLite store to serve the JSONs from instead. See entity_store.py. default: none", default=None, metavar="file")
+parser.add_argument("--courses", type=int, help="without fixtures, the number of courses to generate. Programs and course categories are generated as in generate_corpus.py. default: 1000", default=1000, metavar="n")
+parser.add_argument("--seed", type=int, help="without fixtures, the seed to generate them with. default: 0", default=0, metavar="n")
+parser.add_argument("--latency", type=float, help="milliseconds every request takes at least. default: 0", default=0, metavar="ms")
+parser.add_argument("--latency_jitter", type=float, help="up to this many more milliseconds, at random, every request takes. default: 0", default=0, metavar="ms")
+parser.add_argument("--max_concurrent", type=int, help="max number of requests handled at once. The rest queue up, like they would on a busy server. 0 means no limit. default: 0", default=0, metavar="n")
+parser.add_argument("--error_rate", type=float, help="fraction of requests to answer with a 500. default: 0", default=0, metavar="p")
+parser.add_argument("--throttle_rate", type=float, help="fraction of requests to answer with a 429. default: 0", default=0, metavar="p")
+parser.add_argument("--retry_after", type=int, help="seconds to send in the Retry-After of every 429. Negative sends none. default: 1", default=1, metavar="secs")
+parser.add_argument("--drop_rate", type=float, help="fraction of requests to drop the connection on without answering. default: 0", default=0, metavar="p")
+parser.add_argument("--expire_after", type=int, help="answer every request after this many with a 401, as if the session had expired. default: never", default=None, metavar="n")
+
+
+def loadFixtures(fixturesDir, storeFile):
+    fixtures = {}
+    for (table, dirName) in [("courses", "course_data"), ("programs", "program_data"), ("course_categories", "course_category_data")]:
+        store = openStore(f"{fixturesDir}/{dirName}", storeFile, table)
+        # Everything is held in memory, so that the server answers in about the same time whatever the fixture. A directory store strips some characters from category codes, so those are keyed by the code inside instead.
+        fixtures[table] = {}
+        for key in store.keys():
+            obj = store.get(key)
+            fixtures[table][obj["code"] if table == "course_categories" else key] = obj
+    return fixtures
+
+def generateFixtures(courses, seed):
+    generator = CorpusGenerator(random.Random(seed), courses, courses // 10, courses // 5, 4, 0.5)
+    return {
+        "courses": {code: generator.courseObj(code) for code in generator.courses},
+        "programs": {code: generator.programObj(code) for code in generator.programs},
+        "course_categories": dict(generator.categoryObjs())
+    }
+
+
+class MockDEState:
+    # Everything the handler threads share, behind one lock.
+    def __init__(self, fixtures, args):
+        self.fixtures = fixtures
+        self.args = args
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(args.max_concurrent) if args.max_concurrent else None
+        # Cookie -> {"cells": {(tab, row, col): [courseCode, readBack]}, "programs": [postCode, ...]}
+        self.sessions = {}
+        self.requests = 0
+        # Endpoint -> {status: count}, including the injected errors.
+        self.responses = {}
+        self.dropped = 0
+        # Courses put into a cell before the previous course in that cell was read back, i.e. downloads that got the wrong course or none at all.
+        self.cellClobbers = 0
+
+    def session(self, cookie):
+        return self.sessions.setdefault(cookie, {"cells": {}, "programs": []})
+
+    def record(self, endpoint, status):
+        with self.lock:
+            counts = self.responses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "responses": self.responses, "dropped": self.dropped, "cellClobbers": self.cellClobbers}
+
+
+class MockDEHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, like DE does, so that connection pooling shows up in the numbers.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this every response on a kept-alive connection sits out a delayed ACK.
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, endpoint, status, obj=None, headers={}):
+        if endpoint is not None:
+            self.state.record(endpoint, status)
+        body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if obj is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for (header, value) in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handleRequest("GET")
+
+    def do_POST(self):
+        self.handleRequest("POST")
+
+    def handleRequest(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        query = {key: values[0] for (key, values) in urllib.parse.parse_qs(url.query).items()}
+        endpoint = url.path.rsplit("/", 1)[-1]
+        # POSTs come with a body length, even though it's always empty.
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if url.path == "/stats":
+            return self.send(None, 200, self.state.stats())
+
+        if self.state.slots is not None:
+            self.state.slots.acquire()
+        try:
+            self.respond(method, endpoint, query)
+        finally:
+            if self.state.slots is not None:
+                self.state.slots.release()
+
+    def respond(self, method, endpoint, query):
+        state = self.state
+        args = state.args
+        with state.lock:
+            state.requests += 1
+            requestNumber = state.requests
+
+        time.sleep((args.latency + random.uniform(0, args.latency_jitter)) / 1000)
+
+        # Errors are injected before anything changes on the planner, like a server falling over before it gets to the request.
+        if args.expire_after is not None and requestNumber > args.expire_after:
+            return self.send(endpoint, 401)
+        if not self.headers.get("Cookie"):
+            return self.send(endpoint, 401)
+        if method == "POST" and not self.headers.get("X-XSRF-TOKEN"):
+            return self.send(endpoint, 403)
+        roll = random.random()
+        if roll < args.drop_rate:
+            with state.lock:
+                state.dropped += 1
+            self.close_connection = True
+            return
+        roll -= args.drop_rate
+        if roll < args.error_rate:
+            return self.send(endpoint, 500)
+        roll -= args.error_rate
+        if roll < args.throttle_rate:
+            return self.send(endpoint, 429, headers={"Retry-After": str(args.retry_after)} if args.retry_after >= 0 else {})
+
+        handler = {
+            ("POST", "saveCourseEntry"): self.saveCourseEntry,
+            ("GET", "getCellDetails"): self.getCellDetails,
+            ("POST", "saveProgramEntry"): self.saveProgramEntry,
+            ("POST", "resetPrograms"): self.resetPrograms,
+            ("GET", "getCategoryCourses"): self.getCategoryCourses,
+        }.get((method, endpoint))
+        if handler is None:
+            return self.send(endpoint, 404)
+        try:
+            handler(endpoint, query)
+        except (KeyError, ValueError):
+            # Missing or malformed query parameters.
+            self.send(endpoint, 400)
+
+    def saveCourseEntry(self, endpoint, query):
+        courseCode = query["newCourseCode"]
+        if courseCode not in self.state.fixtures["courses"]:
+            return self.send(endpoint, 404)
+        cell = (query["tabIndex"], int(query["selRowIndex"]), int(query["selColIndex"]))
+        with self.state.lock:
+            cells = self.state.session(self.headers["Cookie"])["cells"]
+            if cell in cells and not cells[cell][1]:
+                self.state.cellClobbers += 1
+            cells[cell] = [courseCode, False]
+        self.send(endpoint, 200, {})
+
+    def getCellDetails(self, endpoint, query):
+        cell = (query["tabIndex"], int(query["rowIndex"]), int(query["colIndex"]))
+        with self.state.lock:
+            entry = self.state.session(self.headers["Cookie"])["cells"].get(cell)
+            if entry is not None:
+                entry[1] = True
+        if entry is None:
+            return self.send(endpoint, 404)
+        self.send(endpoint, 200, self.state.fixtures["courses"][entry[0]])
+
+    def saveProgramEntry(self, endpoint, query):
+        postCode = query["newPostCode"]
+        if postCode not in self.state.fixtures["programs"]:
+            return self.send(endpoint, 404)
+        with self.state.lock:
+            programs = self.state.session(self.headers["Cookie"])["programs"]
+            if postCode not in programs:
+                programs.append(postCode)
+            onPlanner = list(programs)
+        # Like DE, the answer assesses every program on the planner, not just the one added.
+        self.send(endpoint, 200, {"timelineStatus": {"allPostAssessments": [self.state.fixtures["programs"][code] for code in onPlanner]}})
+
+    def resetPrograms(self, endpoint, query):
+        with self.state.lock:
+            self.state.session(self.headers["Cookie"])["programs"].clear()
+        self.send(endpoint, 200, {})
+
+    def getCategoryCourses(self, endpoint, query):
+        # parse_qs only undoes one of the two rounds of encoding.
+        categoryObj = self.state.fixtures["course_categories"].get(urllib.parse.unquote(query["categoryCode"]))
+        if categoryObj is None:
+            return self.send(endpoint, 404)
+        self.send(endpoint, 200, categoryObj)
+
+
+def startServer(args, fixtures):
+    # Returns the running server and the base URL to pass the downloaders. Each server gets its own handler class, so that several can run side by side.
+    handler = type("BoundMockDEHandler", (MockDEHandler,), {"state": MockDEState(fixtures, args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return (server, f"http://{args.host}:{server.server_address[1]}/degreeExplorer/rest")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    fixtures = loadFixtures(args.fixtures_dir, args.store_file) if args.fixtures_dir or args.store_file else generateFixtures(args.courses, args.seed)
+    (server, baseURL) = startServer(args, fixtures)
+
+    # The base URL comes first and on its own line, so that whatever started this can read it.
+    print(baseURL, flush=True)
+    print(f"Serving {len(fixtures['courses'])} course(s), {len(fixtures['programs'])} program(s) and {len(fixtures['course_categories'])} course categories. Press Ctrl+C to stop.", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
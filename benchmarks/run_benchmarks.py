@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+benchmarksDir = Path(__file__).resolve().parent
+sys.path.insert(0, str(benchmarksDir.parent))
+
+from generate_corpus import generateCorpus
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Benchmarks course_aggregator.py, program_aggregator.py and course_category_aggregator.py on synthetic corpora of increasing size, records the results and compares them against the previous run with the same settings.")
+parser.add_argument("--sizes", type=int, nargs="+", help="numbers of courses to benchmark with. Every corpus also gets a tenth as many programs and a fifth as many course categories. default: 1000 10000", default=[1000, 10000], metavar="n")
+parser.add_argument("--repeat", type=int, help="number of times to run each aggregator on each corpus. The fastest run is compared. default: 3", default=3, metavar="n")
+parser.add_argument("--seed", type=int, help="seed for the corpus generator. default: 0", default=0, metavar="n")
+parser.add_argument("--category_depth", type=int, help="levels of course categories including or excluding each other. default: 4", default=4, metavar="n")
+parser.add_argument("--category_sharing", type=float, help="chance of a category reusing one something else already includes or excludes. default: 0.5", default=0.5, metavar="p")
+parser.add_argument("--store", help="include to benchmark reading from a SQLite store instead of the JSONs directories.", action="store_true")
+parser.add_argument("--workers", type=int, help="--workers to run the course and program aggregators with. default: 1", default=1, metavar="n")
+parser.add_argument("--work_dir", type=str, help="path to directory to generate the corpora and write the aggregated JSONs into. Corpora already there are reused. default: ./benchmark_runs", default="./benchmark_runs", metavar="dir")
+parser.add_argument("--results_file", type=str, help="path to file to append the results to, one JSON object per line. default: benchmarks/results.jsonl", default=str(benchmarksDir / "results.jsonl"), metavar="file")
+parser.add_argument("--aggregators", nargs="+", choices=["courses", "programs", "course_categories"], help="which aggregators to benchmark. default: all of them", default=["courses", "programs", "course_categories"])
+
+# How each aggregator is run against a corpus in corpusDir, with output going to outDir.
+def aggregatorCommands(corpusDir, outDir, storeFile, workers):
+    storeArgs = ["--store_file", storeFile] if storeFile else []
+    return {
+        "courses": ["course_aggregator", "--c_jsons_dir", f"{corpusDir}/course_data", "--c_aggr_file", f"{outDir}/aggregated_courses.json", "--workers", str(workers)] + storeArgs,
+        "programs": ["program_aggregator", "--p_jsons_dir", f"{corpusDir}/program_data", "--p_aggr_file", f"{outDir}/aggregated_programs.json", "--workers", str(workers)] + storeArgs,
+        "course_categories": ["course_category_aggregator", "--cc_jsons_dir", f"{corpusDir}/course_category_data", "--cc_ids_file", f"{outDir}/aggregated_course_categories.json", "--c_aggr_file", f"{outDir}/aggregated_courses.json"] + storeArgs,
+    }
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=benchmarksDir.parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(command):
+    result = subprocess.run([sys.executable, str(benchmarksDir / "measure.py")] + command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed:\n{result.stderr}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+def loadResults(resultsFile):
+    try:
+        with open(resultsFile) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def formatChange(new, old):
+    if not old:
+        return ""
+    return f" ({(new - old) / old:+.1%})"
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    previousResults = loadResults(args.results_file)
+    commit = gitCommit()
+    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+
+    with open(args.results_file, "a") as resultsFile:
+        for size in args.sizes:
+            corpusName = f"corpus-{size}-{args.seed}-{args.category_depth}-{args.category_sharing}"
+            corpusDir = f"{args.work_dir}/{corpusName}"
+            storeFile = f"{corpusDir}/store.sqlite" if args.store else None
+            if not Path(f"{corpusDir}/.complete{'-store' if args.store else ''}").exists():
+                print(f"Generating {corpusName}{' into a SQLite store' if args.store else ''}...")
+                generateCorpus(corpusDir, storeFile, size, categoryDepth=args.category_depth, categorySharing=args.category_sharing, seed=args.seed)
+                Path(f"{corpusDir}/.complete{'-store' if args.store else ''}").touch()
+
+            # Every corpus gets its own output, so that nothing one aggregator reads is left over from another corpus.
+            outDir = f"{args.work_dir}/output/{corpusName}{'-store' if args.store else ''}"
+            Path(outDir).mkdir(exist_ok=True, parents=True)
+            commands = aggregatorCommands(corpusDir, outDir, storeFile, args.workers)
+            # The course category optimizer checks its regexes against this corpus's aggregated courses. Without them it would be benchmarked against an empty universe.
+            if "course_categories" in args.aggregators and not Path(f"{outDir}/aggregated_courses.json").exists():
+                measure(commands["courses"])
+
+            for aggregator in args.aggregators:
+                runs = [measure(commands[aggregator]) for _ in range(args.repeat)]
+                best = min(runs, key=lambda run: run["wallTime"])
+
+                # Results are only ever compared against earlier ones with exactly the same parameters.
+                params = {"aggregator": aggregator, "size": size, "seed": args.seed, "categoryDepth": args.category_depth, "categorySharing": args.category_sharing, "store": args.store, "workers": args.workers}
+                record = {"timestamp": timestamp, "commit": commit, "params": params, "best": best, "runs": runs}
+                resultsFile.write(json.dumps(record) + "\n")
+                resultsFile.flush()
+
+                previous = next((result for result in reversed(previousResults) if result["params"] == params), None)
+                old = previous["best"] if previous else {}
+                print(f"{aggregator} @ {size}: {best['wallTime']:.3f}s{formatChange(best['wallTime'], old.get('wallTime'))}, peak RSS {best['peakRSSKiB'] / 1024:.1f} MiB{formatChange(best['peakRSSKiB'], old.get('peakRSSKiB'))}")
+                for (phase, seconds) in best["phases"].items():
+                    print(f"\t{phase}: {seconds:.3f}s{formatChange(seconds, old.get('phases', {}).get(phase))}")
+                if previous:
+                    print(f"\tcompared against {previous['commit'] or 'an unknown commit'} at {previous['timestamp']}")
@@ -0,0 +1,397 @@
+import json
+import re
+from pathlib import Path
+
+
+# Shortens the regexes course_category_aggregator.py builds. As built, they are the include and exclude regexes of every category nested inside each other as they are, so they repeat alternatives, list every single course as its own alternative and keep ".*" pieces next to everything they already cover. The optimizer parses a regex, simplifies it and writes it back out:
+#   - nested groups and groups of one alternative are flattened
+#   - duplicate alternatives are dropped, and so are literal codes another alternative already matches
+#   - alternatives alongside ".*" are dropped altogether
+#   - literal codes are merged into a trie, e.g. (CSC404H1|CSC236H1|CSC324H1) becomes CSC(?:236H1|324H1|404H1), and (CSC404H1|CSC405H1) becomes CSC40[45]H1
+#   - runs of the same character class are counted, e.g. [0-9][0-9][0-9] becomes [0-9]{3}
+# Every step keeps the exact set of strings the regex matches, so an optimized regex can be nested in another category's like the original could. On top of that, each optimized regex is checked against the course universe, and if it accepts a single course differently from the original (or isn't shorter), the original is kept. The output only uses syntax Python and JS agree on.
+
+# A parsed regex is a tree of tuples:
+#   ("char", c)                 a literal character
+#   ("set", text)               a character class as written, e.g. "[A-Z]", or "." for any character
+#   ("repeat", node, min, max)  node repeated min to max times. max is None for no limit
+#   ("seq", (node, ...))        nodes one after another. An empty seq matches the empty string
+#   ("alt", (node, ...))        any one of the nodes
+#   ("notahead", node)          a negative lookahead
+#   ("never",)                  matches nothing at all
+emptyNode = ("seq", ())
+neverNode = ("never",)
+anythingNode = ("repeat", ("set", "."), 0, None)
+
+quantifierRe = re.compile(r"\*|\+|\?|\{([0-9]+)(,([0-9]*))?\}")
+# Characters that have to be escaped outside and inside character classes.
+specialChars = set(".^$*+?{}[]\\|()")
+classSpecialChars = set("]\\^-")
+
+
+def addRegexOptimizerArguments(parser):
+    parser.add_argument("--raw_regexes", help="include to write the category regexes as built, without optimizing them.", action="store_true")
+    parser.add_argument("--c_aggr_file", type=str, help="path to aggregated courses whose codes, along with --c_ids_file, make up the course universe optimized regexes are checked against. Ignored if it doesn't exist. default: ./aggregated_courses.json", default="./aggregated_courses.json", metavar="file")
+    parser.add_argument("--c_ids_file", type=str, help="path to ASCII file of scraped course IDs to add to the course universe. Ignored if it doesn't exist. default: ./course-ids.txt", default="./course-ids.txt", metavar="file")
+
+
+class RegexParser:
+    # Parses the subset of regex syntax the category regexes are written in: literal and escaped characters, character classes, ".", groups, negative lookaheads, alternation and greedy quantifiers. Anything else raises ValueError, and that regex is left as it is.
+    def __init__(self, regex):
+        self.regex = regex
+        self.pos = 0
+
+    def parse(self):
+        node = self.parseAlt()
+        if self.pos != len(self.regex):
+            raise ValueError(f"unexpected {self.regex[self.pos]!r} at {self.pos}")
+        return node
+
+    def peek(self):
+        return self.regex[self.pos] if self.pos < len(self.regex) else None
+
+    def parseAlt(self):
+        alternatives = [self.parseSeq()]
+        while self.peek() == "|":
+            self.pos += 1
+            alternatives.append(self.parseSeq())
+        return ("alt", tuple(alternatives)) if len(alternatives) > 1 else alternatives[0]
+
+    def parseSeq(self):
+        nodes = []
+        while self.peek() not in (None, "|", ")"):
+            nodes.append(self.parseQuantifier(self.parseAtom()))
+        return ("seq", tuple(nodes))
+
+    def parseAtom(self):
+        c = self.regex[self.pos]
+        if c == "(":
+            lookahead = self.regex.startswith("(?!", self.pos)
+            if lookahead or self.regex.startswith("(?:", self.pos):
+                self.pos += 3
+            elif self.regex.startswith("(?", self.pos):
+                raise ValueError(f"unsupported group at {self.pos}")
+            else:
+                self.pos += 1
+            node = self.parseAlt()
+            if self.peek() != ")":
+                raise ValueError(f"missing ) at {self.pos}")
+            self.pos += 1
+            return ("notahead", node) if lookahead else node
+        if c == "[":
+            end = self.pos + 1
+            if self.regex.startswith("^", end):
+                end += 1
+            # A ] straight after the [ is part of the class.
+            if self.regex.startswith("]", end):
+                end += 1
+            while end < len(self.regex) and self.regex[end] != "]":
+                end += 2 if self.regex[end] == "\\" else 1
+            if end >= len(self.regex):
+                raise ValueError(f"unterminated character class at {self.pos}")
+            node = ("set", self.regex[self.pos:end + 1])
+            self.pos = end + 1
+            return node
+        if c == ".":
+            self.pos += 1
+            return ("set", ".")
+        if c == "\\":
+            escaped = self.regex[self.pos + 1:self.pos + 2]
+            # Only escaped punctuation stands for itself. \d, \b, \1 and the like mean something else.
+            if escaped == "" or escaped.isalnum():
+                raise ValueError(f"unsupported escape at {self.pos}")
+            self.pos += 2
+            return ("char", escaped)
+        if c in specialChars:
+            raise ValueError(f"unsupported {c!r} at {self.pos}")
+        self.pos += 1
+        return ("char", c)
+
+    def parseQuantifier(self, node):
+        match = quantifierRe.match(self.regex, self.pos)
+        if match is None:
+            return node
+        if node[0] == "notahead":
+            raise ValueError(f"quantified lookahead at {self.pos}")
+        self.pos = match.end()
+        # Lazy and possessive quantifiers match the same strings, but JS has no possessive ones, so leave those regexes be.
+        if self.peek() in ("?", "+"):
+            raise ValueError(f"unsupported quantifier at {self.pos}")
+        if match.group(0) in ("*", "+", "?"):
+            (low, high) = {"*": (0, None), "+": (1, None), "?": (0, 1)}[match.group(0)]
+        else:
+            low = int(match.group(1))
+            high = low if match.group(2) is None else (int(match.group(3)) if match.group(3) else None)
+        return ("repeat", node, low, high)
+
+
+def emitRegex(node):
+    kind = node[0]
+    if kind == "char":
+        return f"\\{node[1]}" if node[1] in specialChars else node[1]
+    if kind == "set":
+        return node[1]
+    if kind == "never":
+        return "(?!)"
+    if kind == "notahead":
+        return f"(?!{emitRegex(node[1])})"
+    if kind == "alt":
+        return "|".join(emitRegex(alternative) for alternative in node[1])
+    if kind == "seq":
+        return "".join(f"(?:{emitRegex(item)})" if item[0] == "alt" else emitRegex(item) for item in node[1])
+    (_, inner, low, high) = node
+    base = emitRegex(inner)
+    if inner[0] not in ("char", "set"):
+        base = f"(?:{base})"
+    elif low == high and len(base) * low <= len(base) + len(f"{{{low}}}"):
+        # e.g. [0-9][0-9] is as short as [0-9]{2}
+        return base * low
+    if (low, high) in [(0, None), (1, None), (0, 1)]:
+        return base + {(0, None): "*", (1, None): "+", (0, 1): "?"}[(low, high)]
+    if low == high:
+        return f"{base}{{{low}}}"
+    return f"{base}{{{low},{'' if high is None else high}}}"
+
+def nullable(node):
+    # Whether the node always matches the empty string, whatever comes after it. Lookaheads depend on what comes after, so they never count.
+    kind = node[0]
+    if kind == "seq":
+        return all(nullable(item) for item in node[1])
+    if kind == "alt":
+        return any(nullable(alternative) for alternative in node[1])
+    if kind == "repeat":
+        return node[2] == 0 or nullable(node[1])
+    return False
+
+def mayMatchNewline(node):
+    # "." doesn't match newlines, but a negated class or an escaped newline does.
+    kind = node[0]
+    if kind == "char":
+        return node[1] == "\n"
+    if kind == "set":
+        return node[1] != "." and (node[1].startswith("[^") or "\n" in node[1] or "\\" in node[1])
+    if kind in ("seq", "alt"):
+        return any(mayMatchNewline(item) for item in node[1])
+    if kind in ("repeat", "notahead"):
+        return mayMatchNewline(node[1])
+    return False
+
+def hasLookahead(node):
+    kind = node[0]
+    if kind in ("seq", "alt"):
+        return any(hasLookahead(item) for item in node[1])
+    if kind == "repeat":
+        return hasLookahead(node[1])
+    return kind == "notahead"
+
+def literalText(node):
+    # The string a node matches if it only matches that one string, else None.
+    if node[0] == "char":
+        return node[1]
+    if node[0] == "seq" and all(item[0] == "char" for item in node[1]):
+        return "".join(item[1] for item in node[1])
+    return None
+
+def repeatBounds(node):
+    # A character class by itself is the class repeated exactly once.
+    return (node[1], node[2], node[3]) if node[0] == "repeat" else (node, 1, 1)
+
+
+def simplify(node):
+    kind = node[0]
+    if kind == "seq":
+        return simplifySeq([simplify(item) for item in node[1]])
+    if kind == "alt":
+        return simplifyAlt([simplify(alternative) for alternative in node[1]])
+    if kind == "notahead":
+        inner = simplify(node[1])
+        # Nothing to rule out, or it rules out everything.
+        if inner == neverNode:
+            return emptyNode
+        if nullable(inner):
+            return neverNode
+        return ("notahead", inner)
+    if kind == "repeat":
+        (_, inner, low, high) = node
+        inner = simplify(inner)
+        if inner == emptyNode or high == 0:
+            return emptyNode
+        if inner == neverNode:
+            return emptyNode if low == 0 else neverNode
+        if low == high == 1:
+            return inner
+        return ("repeat", inner, low, high)
+    return node
+
+def simplifySeq(items):
+    flattened = []
+    for item in items:
+        if item == neverNode:
+            return neverNode
+        if item[0] == "seq":
+            flattened.extend(item[1])
+        else:
+            flattened.append(item)
+
+    # Runs of the same character class add up, e.g. [0-9][0-9]{2} is [0-9]{3}, and .*.* is .*. Literal characters are left alone so that literal codes stay recognizable.
+    merged = []
+    for item in flattened:
+        (base, low, high) = repeatBounds(item)
+        if merged and base[0] == "set" and repeatBounds(merged[-1])[0] == base:
+            (_, previousLow, previousHigh) = repeatBounds(merged[-1])
+            merged[-1] = ("repeat", base, previousLow + low, None if previousHigh is None or high is None else previousHigh + high)
+        else:
+            merged.append(item)
+    return merged[0] if len(merged) == 1 else ("seq", tuple(merged))
+
+def simplifyAlt(alternatives):
+    flattened = []
+    for alternative in alternatives:
+        if alternative[0] == "alt":
+            flattened.extend(alternative[1])
+        elif alternative != neverNode:
+            flattened.append(alternative)
+    if not flattened:
+        return neverNode
+    # e.g. (|MAT1[0-9]{2}[HY]1) is (MAT1[0-9]{2}[HY]1)?
+    if len(flattened) == 2 and emptyNode in flattened:
+        return simplify(("repeat", next(alternative for alternative in flattened if alternative != emptyNode), 0, 1))
+
+    # ".*" matches everything the other alternatives can, as long as none of them can match a newline.
+    if anythingNode in flattened and not any(mayMatchNewline(alternative) for alternative in flattened):
+        return anythingNode
+
+    unique = {}
+    for alternative in flattened:
+        unique.setdefault(emitRegex(alternative), alternative)
+    patterns = [alternative for alternative in unique.values() if literalText(alternative) is None]
+    literals = [literalText(alternative) for alternative in unique.values() if literalText(alternative) is not None]
+
+    # A literal code is redundant next to a pattern that already matches it, e.g. CSC404H1 next to CSC[0-9]{3}[HY]1. Patterns with lookaheads depend on what comes after them, so those aren't used.
+    if literals:
+        subsumers = [re.compile(emitRegex(pattern)) for pattern in patterns if not hasLookahead(pattern)]
+        literals = [literal for literal in literals if not any(subsumer.fullmatch(literal) for subsumer in subsumers)]
+
+    if literals:
+        trie = {}
+        for literal in literals:
+            branch = trie
+            for c in literal:
+                branch = branch.setdefault(c, {})
+            # "" marks the end of a literal, since it can't be a character.
+            branch[""] = {}
+        literalNode = trieNode(trie)
+        patterns = (list(literalNode[1]) if literalNode[0] == "alt" else [literalNode]) + patterns
+    return patterns[0] if len(patterns) == 1 else ("alt", tuple(patterns))
+
+def trieNode(trie):
+    # Characters whose subtrees are the same share one branch, with a character class instead of the character.
+    branches = {}
+    for c in sorted(key for key in trie if key != ""):
+        subtree = trieNode(trie[c])
+        branches.setdefault(emitRegex(subtree), ([], subtree))[0].append(c)
+    alternatives = [simplifySeq([charSet(chars), subtree]) for (chars, subtree) in branches.values()]
+    if not alternatives:
+        return emptyNode
+    node = alternatives[0] if len(alternatives) == 1 else ("alt", tuple(alternatives))
+    # Some literal ends here, while others go on.
+    return ("repeat", node, 0, 1) if "" in trie else node
+
+def charSet(chars):
+    if len(chars) == 1:
+        return ("char", chars[0])
+    # Runs of three or more consecutive characters become ranges, e.g. [0-3] rather than [0123].
+    parts = []
+    start = 0
+    while start < len(chars):
+        end = start
+        while end + 1 < len(chars) and ord(chars[end + 1]) == ord(chars[end]) + 1:
+            end += 1
+        escape = lambda c: f"\\{c}" if c in classSpecialChars else c
+        if end - start >= 2:
+            parts.append(f"{escape(chars[start])}-{escape(chars[end])}")
+        else:
+            parts.extend(escape(c) for c in chars[start:end + 1])
+        start = end + 1
+    return ("set", f"[{''.join(parts)}]")
+
+
+def optimizeRegex(regex):
+    # Returns the optimized regex, or the original if it couldn't be parsed or wouldn't get any shorter.
+    try:
+        return optimizeParsed(RegexParser(regex).parse(), regex)
+    except (ValueError, RecursionError):
+        return regex
+
+def optimizeParsed(node, regex):
+    node = simplify(node)
+    optimized = emitRegex(node)
+    # A bare alternation would stop being one unit as soon as something is put in front of it, e.g. a ^.
+    if node[0] == "alt":
+        optimized = f"(?:{optimized})"
+    # An empty regex would be mistaken for a category without one.
+    if optimized == "" or len(optimized) >= len(regex):
+        return regex
+    return optimized
+
+
+def loadCourseUniverse(args, extraCourses=()):
+    # Every aggregated course plus every scraped ID, like course_category_membership_aggregator.py, plus extraCourses.
+    courses = set(extraCourses)
+    if Path(args.c_aggr_file).is_file():
+        with open(args.c_aggr_file) as f:
+            courses.update(json.load(f).keys())
+    if Path(args.c_ids_file).is_file():
+        with open(args.c_ids_file) as f:
+            courses.update(line.strip() for line in f if line.strip() != "")
+    return CourseUniverse(sorted(courses))
+
+
+class CourseUniverse:
+    # The courses optimized regexes are checked against. As long as a regex can't match a newline, rather than matching the courses one at a time, they are joined one per line and matched all at once with ^ in multiline mode. A course is accepted if a match starts on its line.
+    def __init__(self, courses):
+        self.courses = courses
+        self.text = "\n".join(courses)
+        self.lineIndices = {}
+        position = 0
+        for (i, course) in enumerate(courses):
+            self.lineIndices[position] = i
+            position += len(course) + 1
+
+    def accepted(self, regex, byLine):
+        # The indices of the courses the regex accepts with re.match, like course_category_membership_aggregator.py.
+        if not byLine:
+            compiled = re.compile(regex)
+            return [i for (i, course) in enumerate(self.courses) if compiled.match(course)]
+        # A regex that can match the empty string may match twice on the same line, once empty and once not.
+        return sorted({self.lineIndices[match.start()] for match in re.finditer(f"^(?:{regex})", self.text, re.MULTILINE)})
+
+
+def optimizeCategoryRegexes(aggregatedCategories, categories, universe, onOptimized=lambda: None):
+    # Optimizes the regexes of the given categories in place. Returns the number of characters before and after, and the categories whose optimized regex was rejected.
+    (before, after) = (0, 0)
+    rejected = []
+    # Different categories often end up with the same regex. Each one is only optimized and checked once, but every category with a rejected regex is still reported.
+    optimizedRegexes = {}
+    rejectedRegexes = set()
+    for category in categories:
+        ccObj = aggregatedCategories[category]
+        regex = ccObj["regex"]
+        if regex not in optimizedRegexes:
+            try:
+                node = RegexParser(regex).parse()
+                optimized = optimizeParsed(node, regex)
+            except (ValueError, RecursionError):
+                optimized = regex
+            # The optimized regex is made of the same character classes as the original, so it can only match a newline if the original can.
+            if optimized != regex and universe.accepted(optimized, not mayMatchNewline(node)) != universe.accepted(regex, not mayMatchNewline(node)):
+                rejectedRegexes.add(regex)
+                optimized = regex
+            optimizedRegexes[regex] = optimized
+        if regex in rejectedRegexes:
+            rejected.append(category)
+        ccObj["regex"] = optimizedRegexes[regex]
+        before += len(regex)
+        after += len(ccObj["regex"])
+        onOptimized()
+    return (before, after, rejected)
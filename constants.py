@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 # For every A&S course across all campuses
 allCoursesRe = re.compile('[A-Z]{3}[A-Z0-9][0-9]{2,3}[HY][0-9]?')
@@ -13,4 +14,51 @@ requirementRe = re.compile('Req[0-9]{1,3}')
 prerequisiteRe = re.compile('P[0-9]{1,3}')
 
 # For all St. George courses only
-stGeorgeCoursesRe = re.compile('[A-Z]{3}[0-9]{3}[HY][01]')
\ No newline at end of file
+stGeorgeCoursesRe = re.compile('[A-Z]{3}[0-9]{3}[HY][01]')
+
+# Sorts requisite codes, and top level course category codes, into kinds with a single combined pattern instead of trying one regex after another. Each alternative has one named group, named after its kind, and they are tried in the order given like the separate regexes used to be. Codes repeat a lot across courses and programs, so each one is only matched once.
+class CodeClassifier:
+    def __init__(self, alternatives, fallback):
+        self.regex = re.compile("|".join(alternatives))
+        self.kinds = list(self.regex.groupindex) + [fallback]
+        self.fallback = fallback
+        # Unbounded, since there are only so many distinct codes in DE.
+        self.classify = lru_cache(maxsize=None)(self.classifyUncached)
+
+    def classifyUncached(self, code):
+        # Returns (kind, what the kind's group matched), or (fallback, code) if nothing did. The kind's group closes last in its alternative, so it is always the lastgroup.
+        match = self.regex.match(code)
+        if match is None:
+            return (self.fallback, code)
+        return (match.lastgroup, match.group(match.lastgroup))
+
+    def classifyItems(self, requisiteItems):
+        # Returns the codes of the requisiteItems in order, and those codes grouped by kind, e.g. {"course": [...], "program": [...], ...}, with every kind present even if empty.
+        codes = [requisiteItem["code"] for requisiteItem in requisiteItems]
+        groups = {kind: [] for kind in self.kinds}
+        for code in codes:
+            groups[self.classify(code)[0]].append(code)
+        return (codes, groups)
+
+# For the requisiteItems of course prerequisites, corequisites and exclusions. Anything else, "" included, is a course category.
+courseRequisiteClassifier = CodeClassifier([f"(?P<course>{allCoursesRe.pattern})", f"(?P<program>{allProgramsRe.pattern})", f"(?P<prerequisite>{prerequisiteRe.pattern})"], "category")
+# For the requisiteItems of program requirements. Anything else, "" included, is a course category.
+programRequisiteClassifier = CodeClassifier([f"(?P<course>{allCoursesRe.pattern})", f"(?P<program>{allProgramsRe.pattern})", f"(?P<requirement>{requirementRe.pattern})"], "category")
+
+# For the codes in a course category's includes/excludes that aren't other categories. What the kind's group matches is what goes into the category's regex.
+topLevelCategoryClassifier = CodeClassifier([
+    # *1*/*A* = undergraduate course level constraint
+    r'^\*(?P<level>[0-9A-Z])\*$',
+    # CSC* = undergraduate department level constraint
+    r'^(?P<department>[A-Z][A-Z][A-Z])\*$',
+    # CSC1* = undergraduate department and course level constraint
+    r'^(?P<departmentLevel>[A-Z][A-Z][A-Z][0-9A-Z])\*$',
+    # PHL* (GR) = graduate department level constraint
+    r'^(?P<graduateDepartment>[A-Z][A-Z][A-Z])\* \(GR\)$',
+    # * = Anything? TODO: figure out what this actually is
+    r'^(?P<anything>\*)$',
+    # * (GR) = any graduate level course
+    r'^(?P<anyGraduate>\* \(GR\))$',
+    # CSC404H1 = specific undergraduate course code e.g. one of CSC404H1 or CSC236H1 or CSC324H1
+    r'^(?P<course>[A-W][A-Z][A-Z][A-Z0-9][0-9][0-9][HY][0-9])$'
+], None)
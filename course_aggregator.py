@@ -1,186 +1,264 @@
 #!/usr/bin/env python3
 
 import json
-import glob
 import argparse
-from pathlib import Path
 
-from constants import allCoursesRe, allProgramsRe, prerequisiteRe
+from aggregation_manifest import addManifestArguments, loadManifest, saveManifest
+from aggregation_workers import addWorkerArguments, orderedMap
+from json_stream import JSONObjectStreamWriter
+from interned_json import addInternedArguments, InternedJSONWriter
+from es_module_shards import addShardArguments, ESModuleShardWriter
+from entity_store import addStoreArguments, openStore
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, timed, progressLine
+from constants import prerequisiteRe, courseRequisiteClassifier
 
 # Set up argument parsing
 parser = argparse.ArgumentParser(description="Aggregates and cleans course JSON objects downloaded from https://degreeexplorer.utoronto.ca/.")
 parser.add_argument("--c_jsons_dir", type=str, help="path to directory to read downloaded course JSONs from. default: ./course_data", default="./course_data", metavar="dir")
 parser.add_argument("--c_aggr_file", type=argparse.FileType("w"), help="path to file to write aggregated courses into. default: ./aggregated_courses.json", default="./aggregated_courses.json", metavar="file")
 parser.add_argument("--debug", help="include to pretty-print JSON. Useful for debugging.", action="store_true")
+parser.add_argument("--stream", help="include to write each course to the output file as soon as it is cleaned, instead of holding all of them in memory until the end. The output is identical either way.", action="store_true")
+addStoreArguments(parser)
+addWorkerArguments(parser)
+addManifestArguments(parser, "./.course_aggregator_manifest.json")
+addShardArguments(parser)
+addInternedArguments(parser, "./aggregated_courses.interned.json")
+addMetricsArguments(parser)
 
 # Dict to hold final aggregated JSON obj
 aggregated_courses = {}
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
+def cleanCourseObj(courseObj):
+    # From the top level, remove everything except these two
+    for key in list(courseObj.keys()):
+        if key not in ["title", "prerequisites"]:
+            del courseObj[key];
 
-    print("Starting course aggregation...")
+    # For each prerequisite, assemble the description and remove unwanted stuff. Assemble into a dict instead of a array, with the key being the shortIdentifer minus the brackets
+    newPrereqs = {}
+    for prereqObj in courseObj["prerequisites"]:
+        prereqID = prereqObj["shortIdentifier"][1:-1]
 
-    attempted = 0
+        displayPrefix = prereqObj["displayPrefix"]
+        connector = prereqObj["subItemConnectorString"]
+        displaySuffix = prereqObj["displaySuffix"]
+        # For ease of use
+        type_ = prereqObj["type"]
+        countType = prereqObj["countType"]
 
-    for courseFile in glob.glob(f"{args.c_jsons_dir}/*.json"):
-        attempted += 1
-
-        # Read file into dict
-        with open(courseFile) as f:
-            courseObj = json.load(f)
-
-        # From the top level, remove everything except these two
-        for key in list(courseObj.keys()):
-            if key not in ["title", "prerequisites"]:
-                del courseObj[key];
-
-        # For each prerequisite, assemble the description and remove unwanted stuff. Assemble into a dict instead of a array, with the key being the shortIdentifer minus the brackets
-        newPrereqs = {}
-        for prereqObj in courseObj["prerequisites"]:
-            prereqID = prereqObj["shortIdentifier"][1:-1]
-
-            displayPrefix = prereqObj["displayPrefix"]
-            connector = prereqObj["subItemConnectorString"]
-            displaySuffix = prereqObj["displaySuffix"]
-            # We need the actual codes to make the display string
-            requisiteCodes = []
-            # For ease of use
-            type_ = prereqObj["type"]
-            countType = prereqObj["countType"]
-
-            # For each requisite item, we only need the code and the type of the code i.e. course, program, or category, or another prereq. We will group them via these labels.
-            courses = []
-            programs = []
-            categories = []
-            dependentPrereqs = []
-            for i in range(len(prereqObj["requisiteItems"])):
-                code = prereqObj["requisiteItems"][i]["code"]
-                requisiteCodes.append(code)
-                if allCoursesRe.match(code):
-                    courses.append(code)
-                elif allProgramsRe.match(code):
-                    programs.append(code)
-                elif prerequisiteRe.match(code):
-                    dependentPrereqs.append(code)
-                else:
-                    categories.append(code)
-            
-            # Now, we proceed differently depending on what types and countTypes and other factors this prerequisite has. Reduction in final file size can be acheived by determining ahead of time which requisites are unverifiable, and reducing their content.
-            # Array of prereq obj keys to keep. Can be modified as necessary to include the bare minimum needed, but these two are mandatory for all.
-            keysToKeep = ["description", "type"]
-            # We will combine all of these subtypes into a single "unverifiable" type to save space.
-            if countType in ["AVERAGE", "YOS", "GPA", "GRADE"] or type_ == "COMPLEX":
-                prereqObj["type"] = "UNVERIFIABLE"
+        # For each requisite item, we only need the code and the type of the code i.e. course, program, or category, or another prereq. We will group them via these labels.
+        # We also need the actual codes to make the display string.
+        (requisiteCodes, groups) = courseRequisiteClassifier.classifyItems(prereqObj["requisiteItems"])
+        courses = groups["course"]
+        programs = groups["program"]
+        categories = groups["category"]
+        dependentPrereqs = groups["prerequisite"]
+        
+        # Now, we proceed differently depending on what types and countTypes and other factors this prerequisite has. Reduction in final file size can be acheived by determining ahead of time which requisites are unverifiable, and reducing their content.
+        # Array of prereq obj keys to keep. Can be modified as necessary to include the bare minimum needed, but these two are mandatory for all.
+        keysToKeep = ["description", "type"]
+        # We will combine all of these subtypes into a single "unverifiable" type to save space.
+        if countType in ["AVERAGE", "YOS", "GPA", "GRADE"] or type_ == "COMPLEX":
+            prereqObj["type"] = "UNVERIFIABLE"
+            listOfReqsStr = f" {connector} ".join(requisiteCodes)
+            prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+        # These types are all verifiable, but we can still do some more preprocessing to save space. This includes removing unwanted stuff and combining countTypes and types into a single field
+        else:
+            if type_ == "NOTE":
+                prereqObj["description"] = displaySuffix.strip()
+
+            # REQUISITES family - only one relevant type
+            elif countType == "REQUISITES" and type_ == "MINIMUM":
+                keysToKeep += ["count", "dependentPrereqs"]
+
+                prereqObj["type"] = "REQUISITES_MIN"
                 listOfReqsStr = f" {connector} ".join(requisiteCodes)
                 prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
-            # These types are all verifiable, but we can still do some more preprocessing to save space. This includes removing unwanted stuff and combining countTypes and types into a single field
+                prereqObj["dependentPrereqs"] = dependentPrereqs
+
+            # COURSES family
+            elif countType == "COURSES":
+                keysToKeep += ["courses", "categories"]
+
+                # Subfamilies
+                if type_ == "MINIMUM":
+                    prereqObj["type"] = "COURSES_MIN"
+                    keysToKeep += ["count"]
+                elif type_ == "LIST":
+                    prereqObj["type"] = "COURSES_LIST"
+                elif type_ == "GROUPMINIMUM":
+                    prereqObj["type"] = "COURSES_GROUPMIN"
+                    # Here, we are relying on the fact that the prereqs mentioned in this one come before it. This allows us to modify them right here vs. doing a second pass later.
+                    for driverPrereqID in prerequisiteRe.findall(prereqObj["displaySuffix"]):
+                        newPrereqs[driverPrereqID]["type"] = newPrereqs[driverPrereqID]["type"].split("-")[0] + "-RECURS"
+                        if ("dependentPrereqs" not in newPrereqs[driverPrereqID]):
+                            newPrereqs[driverPrereqID]["dependentPrereqs"] = [prereqID]
+                        else:
+                            newPrereqs[driverPrereqID]["dependentPrereqs"].append(prereqID)
+                    keysToKeep += ["count"]
+
+                listOfReqsStr = f" {connector} ".join(requisiteCodes)
+                prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+                prereqObj["courses"] = courses
+                prereqObj["categories"] = categories
+
+            # FCES family
+            elif countType == "FCES":
+                keysToKeep += ["courses", "categories"]
+                
+                # Subfamilies
+                if type_ == "MINIMUM":
+                    prereqObj["type"] = "FCES_MIN"
+                    keysToKeep += ["count"]
+                elif type_ == "LIST":
+                    prereqObj["type"] = "FCES_LIST"
+                elif type_ == "MAXIMUM":
+                    prereqObj["type"] = "FCES_MAX"
+                    keysToKeep += ["count"]
+                elif type_ == "GROUPMINIMUM":
+                    prereqObj["type"] = "FCES_GROUPMIN"
+                    # As before, relying on the ordering
+                    for driverPrereqID in prerequisiteRe.findall(prereqObj["displaySuffix"]):
+                        newPrereqs[driverPrereqID]["type"] = newPrereqs[driverPrereqID]["type"].split("-")[0] + "-RECURS"
+                        if ("dependentPrereqs" not in newPrereqs[driverPrereqID]):
+                            newPrereqs[driverPrereqID]["dependentPrereqs"] = [prereqID]
+                        else:
+                            newPrereqs[driverPrereqID]["dependentPrereqs"].append(prereqID)
+                    keysToKeep += ["count"]
+                
+                listOfReqsStr = f" {connector} ".join(requisiteCodes)
+                prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+                prereqObj["courses"] = courses
+                prereqObj["categories"] = categories
+
+            # SUBJECT_POSTS family - only one relevant here
+            elif countType == "SUBJECT_POSTS" and type_ == "MINIMUM":
+                keysToKeep += ["count", "programs"]
+
+                prereqObj["type"] = "PROGRAM_MIN"
+                listOfReqsStr = f" {connector} ".join(requisiteCodes)
+                prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+                prereqObj["programs"] = programs
+
+            # Whatever else
             else:
-                if type_ == "NOTE":
-                    prereqObj["description"] = displaySuffix.strip()
-
-                # REQUISITES family - only one relevant type
-                elif countType == "REQUISITES" and type_ == "MINIMUM":
-                    keysToKeep += ["count", "dependentPrereqs"]
-
-                    prereqObj["type"] = "REQUISITES_MIN"
-                    listOfReqsStr = f" {connector} ".join(requisiteCodes)
-                    prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
-                    prereqObj["dependentPrereqs"] = dependentPrereqs
-
-                # COURSES family
-                elif countType == "COURSES":
-                    keysToKeep += ["courses", "categories"]
-
-                    # Subfamilies
-                    if type_ == "MINIMUM":
-                        prereqObj["type"] = "COURSES_MIN"
-                        keysToKeep += ["count"]
-                    elif type_ == "LIST":
-                        prereqObj["type"] = "COURSES_LIST"
-                    elif type_ == "GROUPMINIMUM":
-                        prereqObj["type"] = "COURSES_GROUPMIN"
-                        # Here, we are relying on the fact that the prereqs mentioned in this one come before it. This allows us to modify them right here vs. doing a second pass later.
-                        for driverPrereqID in prerequisiteRe.findall(prereqObj["displaySuffix"]):
-                            newPrereqs[driverPrereqID]["type"] = newPrereqs[driverPrereqID]["type"].split("-")[0] + "-RECURS"
-                            if ("dependentPrereqs" not in newPrereqs[driverPrereqID]):
-                                newPrereqs[driverPrereqID]["dependentPrereqs"] = [prereqID]
-                            else:
-                                newPrereqs[driverPrereqID]["dependentPrereqs"].append(prereqID)
-                        keysToKeep += ["count"]
-
-                    listOfReqsStr = f" {connector} ".join(requisiteCodes)
-                    prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
-                    prereqObj["courses"] = courses
-                    prereqObj["categories"] = categories
-
-                # FCES family
-                elif countType == "FCES":
-                    keysToKeep += ["courses", "categories"]
-                    
-                    # Subfamilies
-                    if type_ == "MINIMUM":
-                        prereqObj["type"] = "FCES_MIN"
-                        keysToKeep += ["count"]
-                    elif type_ == "LIST":
-                        prereqObj["type"] = "FCES_LIST"
-                    elif type_ == "MAXIMUM":
-                        prereqObj["type"] = "FCES_MAX"
-                        keysToKeep += ["count"]
-                    elif type_ == "GROUPMINIMUM":
-                        prereqObj["type"] = "FCES_GROUPMIN"
-                        # As before, relying on the ordering
-                        for driverPrereqID in prerequisiteRe.findall(prereqObj["displaySuffix"]):
-                            newPrereqs[driverPrereqID]["type"] = newPrereqs[driverPrereqID]["type"].split("-")[0] + "-RECURS"
-                            if ("dependentPrereqs" not in newPrereqs[driverPrereqID]):
-                                newPrereqs[driverPrereqID]["dependentPrereqs"] = [prereqID]
-                            else:
-                                newPrereqs[driverPrereqID]["dependentPrereqs"].append(prereqID)
-                        keysToKeep += ["count"]
-                    
-                    listOfReqsStr = f" {connector} ".join(requisiteCodes)
-                    prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
-                    prereqObj["courses"] = courses
-                    prereqObj["categories"] = categories
-
-                # SUBJECT_POSTS family - only one relevant here
-                elif countType == "SUBJECT_POSTS" and type_ == "MINIMUM":
-                    keysToKeep += ["count", "programs"]
-
-                    prereqObj["type"] = "PROGRAM_MIN"
-                    listOfReqsStr = f" {connector} ".join(requisiteCodes)
-                    prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
-                    prereqObj["programs"] = programs
-
-                # Whatever else
-                else:
-                    listOfReqsStr = f" {connector} ".join(requisiteCodes)
-                    prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+                listOfReqsStr = f" {connector} ".join(requisiteCodes)
+                prereqObj["description"] = f"{displayPrefix} {listOfReqsStr} {displaySuffix}".strip()
+
+        # Delete everything else
+        for key in list(prereqObj.keys()):
+            if key not in keysToKeep:
+                del prereqObj[key]
+
+        # Collapse multiple spaces in description
+        prereqObj["description"] = " ".join(prereqObj["description"].split())
+
+        # Done, add it to the new dict
+        newPrereqs[prereqID] = prereqObj
+
+    # Now that we have finished modifying everything, we add the new prereqs to the courseObj
+    courseObj["prerequisites"] = newPrereqs
+    return courseObj
 
-            # Delete everything else
-            for key in list(prereqObj.keys()):
-                if key not in keysToKeep:
-                    del prereqObj[key]
 
-            # Collapse multiple spaces in description
-            prereqObj["description"] = " ".join(prereqObj["description"].split())
+def cleanCourseEntity(entity):
+    # Parsed here rather than by whoever read it, so that parsing is spread across the worker processes too.
+    (courseKey, raw) = entity
+    with timed("jsonParseSeconds"):
+        courseObj = json.loads(raw)
+    return cleanCourseObj(courseObj)
+
+def main(args):
+    print("Starting course aggregation...")
+
+    store = openStore(args.c_jsons_dir, args.store_file, "courses")
+
+    attempted = 0
+    reused = 0
 
-            # Done, add it to the new dict
-            newPrereqs[prereqID] = prereqObj
+    # In incremental mode, the previous run's manifest holds the cleaned version of every course it saw. Deleted courses simply drop out because the new manifest is rebuilt from the courses present now.
+    manifest = loadManifest(args.manifest_file) if args.incremental else {}
+    newManifest = {}
 
-        # Now that we have finished modifying everything, we add the new prereqs to the courseObj and append this to the final file
-        courseObj["prerequisites"] = newPrereqs
-        aggregated_courses[Path(courseFile).stem] = courseObj
+    # First work out which courses actually need cleaning. Everything else is reused from the manifest.
+    with phase("scan"):
+        courseKeys = store.keys()
+        fingerprints = {}
+        reusedFragments = {}
+        staleKeys = []
+        for courseKey in courseKeys:
+            if args.incremental:
+                entry = manifest.get(courseKey)
+                (fingerprints[courseKey], unchanged) = store.fingerprint(courseKey, entry)
+                if unchanged:
+                    reusedFragments[courseKey] = entry["fragment"]
+                    continue
+            staleKeys.append(courseKey)
 
-    # We have finished modifying all the courses. Write aggregated_courses to file
-    if (args.debug):
-        json.dump(aggregated_courses, args.c_aggr_file, ensure_ascii=False, indent=2)
-    else:
-        json.dump(aggregated_courses, args.c_aggr_file, ensure_ascii=False, separators=(',', ':'))
+    aggregatedWriter = JSONObjectStreamWriter(args.c_aggr_file, args.debug) if args.stream else None
+    internedWriter = InternedJSONWriter(args.interned_file) if args.interned_file else None
+    shardWriter = ESModuleShardWriter(args.shards_dir) if args.shards_dir else None
+
+    # Clean the stale courses, possibly across several processes, then merge everything back in store order so the output doesn't depend on the number of workers. They are read from the store lazily, so only the ones currently being cleaned are ever in memory.
+    progressLine.start("cleaning courses", len(courseKeys))
+    with phase("clean"):
+        staleEntities = ((courseKey, store.readRaw(courseKey)) for courseKey in staleKeys)
+        with orderedMap(cleanCourseEntity, staleEntities, args.workers) as cleanedCourses:
+            for courseKey in courseKeys:
+                if courseKey in reusedFragments:
+                    # Same course as last time, so reuse its cleaned version
+                    reused += 1
+                    courseObj = reusedFragments[courseKey]
+                else:
+                    attempted += 1
+                    courseObj = next(cleanedCourses)
+
+                if args.stream:
+                    aggregatedWriter.write(courseKey, courseObj)
+                else:
+                    aggregated_courses[courseKey] = courseObj
+                if args.incremental:
+                    newManifest[courseKey] = dict(fingerprints[courseKey], fragment=courseObj)
+                if args.interned_file:
+                    internedWriter.write(courseKey, courseObj)
+                if args.shards_dir:
+                    shardWriter.write(courseKey, courseObj)
+                progressLine.advance("cleaning courses")
+
+    # We have finished modifying all the courses. Write aggregated_courses to file. When streaming, only the closing brace is left.
+    with phase("write"):
+        if args.stream:
+            aggregatedWriter.close()
+        elif (args.debug):
+            with timed("jsonDumpSeconds"):
+                json.dump(aggregated_courses, args.c_aggr_file, ensure_ascii=False, indent=2)
+        else:
+            with timed("jsonDumpSeconds"):
+                json.dump(aggregated_courses, args.c_aggr_file, ensure_ascii=False, separators=(',', ':'))
+
+        if args.incremental:
+            saveManifest(args.manifest_file, newManifest)
 
     # Print diagnostics
     print("Finished.")
-    print(f"Cleaned and aggregate {attempted} course(s) from {args.c_jsons_dir}")
+    print(f"Cleaned and aggregate {attempted} course(s) from {args.store_file or args.c_jsons_dir}")
+    if args.incremental:
+        print(f"\tReused {reused} unchanged course(s) and dropped {len(manifest.keys() - newManifest.keys())} deleted course(s) using {args.manifest_file}")
 
     args.c_aggr_file.close()
+    if args.interned_file:
+        with phase("write"):
+            internedWriter.close()
+        args.interned_file.close()
+    if args.shards_dir:
+        with phase("write"):
+            shards = shardWriter.close()
+        print(f"Wrote {len(shards)} ES module shard(s) into {args.shards_dir}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+    main(args)
+    writeMetricsReport(args)
@@ -1,42 +1,78 @@
 import json
-import glob
 import argparse
-import re
 
-topLevelCategoryMap = [
+from aggregation_manifest import addManifestArguments, loadManifest, saveManifest
+from entity_store import addStoreArguments, openStore
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, timed, progressLine
+from constants import topLevelCategoryClassifier
+from category_regex_optimizer import addRegexOptimizerArguments, loadCourseUniverse, optimizeCategoryRegexes
+
+# Kind of top level category, as sorted by topLevelCategoryClassifier -> the regex of the courses it stands for, given what the kind's group matched.
+topLevelCategoryMap = {
     # *1*/*A* = undergraduate course level constraint
-    (re.compile('^\*([0-9A-Z])\*$'), lambda category: "[A-Z][A-Z][A-Z]{0}[0-9][0-9][HY]1".format(re.compile('^\*([0-9A-Z])\*$').match(category).group(1))),
+    "level": "[A-Z][A-Z][A-Z]{0}[0-9][0-9][HY]1",
     # CSC* = undergraduate department level constraint
-    (re.compile('^([A-Z][A-Z][A-Z])\*$'), lambda category: "{0}[0-9][0-9][0-9][HY]1".format(re.compile('^([A-Z][A-Z][A-Z])\*$').match(category).group(1))),
+    "department": "{0}[0-9][0-9][0-9][HY]1",
     # CSC1* = undergraduate department and course level constraint
-    (re.compile('^([A-Z][A-Z][A-Z][0-9A-Z])\*$'), lambda category: "{0}[0-9][0-9][HY]1".format(re.compile('^([A-Z][A-Z][A-Z][0-9A-Z])\*$').match(category).group(1))),
+    "departmentLevel": "{0}[0-9][0-9][HY]1",
     # PHL* (GR) = graduate department level constraint
-    (re.compile('^([A-Z][A-Z][A-Z])\* \(GR\)$'), lambda category: "{0}[0-9][0-9][0-9][0-9][HY]".format(re.compile('^([A-Z][A-Z][A-Z])\* \(GR\)$').match(category).group(1))),
+    "graduateDepartment": "{0}[0-9][0-9][0-9][0-9][HY]",
     # * = Anything? TODO: figure out what this actually is
-    (re.compile('^\*$'), lambda category: ".*"),
+    "anything": ".*",
     # * (GR) = any graduate level course
-    (re.compile('^\* \(GR\)$'), lambda category: "[A-Z][A-Z][A-Z][0-9][0-9][0-9][0-9][HY]"),
+    "anyGraduate": "[A-Z][A-Z][A-Z][0-9][0-9][0-9][0-9][HY]",
     # CSC404H1 = specific undergraduate course code e.g. one of CSC404H1 or CSC236H1 or CSC324H1
-    (re.compile('^[A-W][A-Z][A-Z][A-Z0-9][0-9][0-9][HY][0-9]$'), lambda category: "{0}".format(re.compile('^[A-Z][A-Z][A-Z][A-Z0-9][0-9][0-9][HY][0-9]$').match(category).group(0)))
-]
+    "course": "{0}"
+}
 
 def parseTopLevelCategory(category):
-    for (regex, transform_func) in topLevelCategoryMap:
-        if regex.match(category):
-            return transform_func(category)
-    return ""
-
-def recursiveParseCourseCategory(courseCategory):
-    # Open the file for this category and get the JSON
-    ccFilename = "".join(i for i in courseCategory if i not in "\/:*?<>|")
+    (kind, value) = topLevelCategoryClassifier.classify(category)
+    if kind is None:
+        return ""
+    return topLevelCategoryMap[kind].format(value)
+
+# Every category JSON read so far, keyed by the category's code. Each one is only read from the store once.
+categoryObjCache = {}
+
+def loadCourseCategory(store, courseCategory):
+    if courseCategory not in categoryObjCache:
+        try:
+            categoryObjCache[courseCategory] = store.get(courseCategory)
+        except ValueError:
+            categoryObjCache[courseCategory] = None
+    return categoryObjCache[courseCategory]
+
+def namedCourses(ccObj):
+    # The courses a category names outright, as opposed to through other categories or patterns.
+    return [item["code"] for item in ccObj["includeItems"] + ccObj["excludeItems"] if not item["categoryEntity"] and topLevelCategoryClassifier.classify(item["code"])[0] == "course"]
+
+# Memoized (regex, validatable) of every category resolved so far. A category reachable from many parents is only resolved once.
+resolvedCategories = {}
+# The chain of categories currently being resolved, used to catch include/exclude cycles.
+resolvingChain = []
+
+def recursiveParseCourseCategory(courseCategory, store):
+    if courseCategory in resolvedCategories:
+        return resolvedCategories[courseCategory]
+
+    # If this category is already being resolved further up, the includes/excludes loop back on themselves. There is no finite regex for that, so report it and mark it unvalidatable.
+    if courseCategory in resolvingChain:
+        cycle = resolvingChain[resolvingChain.index(courseCategory):] + [courseCategory]
+        print(f"Cycle detected in course categories: {' -> '.join(cycle)}")
+        return ("", False)
+
+    resolvingChain.append(courseCategory)
+    resolvedCategories[courseCategory] = parseCourseCategory(courseCategory, store)
+    resolvingChain.pop()
+    return resolvedCategories[courseCategory]
+
+def parseCourseCategory(courseCategory, store):
     # complete_status - whether the regex is complete or now
     validatable = True
 
-
-    try:
-        with open(f"{args.cc_jsons_dir}/{ccFilename}.json") as f:
-            categoryObj = json.load(f)
-    except:
+    # Get the JSON for this category
+    categoryObj = loadCourseCategory(store, courseCategory)
+    if categoryObj is None:
         validatable = False
         return ("", validatable)
         
@@ -46,7 +82,7 @@ def recursiveParseCourseCategory(courseCategory):
         categoryID = includeCategory["code"]
         if includeCategory["categoryEntity"]:
             # If it's another non-top-level id, recursively parse it again
-            (regex, dependent_validatable) = recursiveParseCourseCategory(categoryID)
+            (regex, dependent_validatable) = recursiveParseCourseCategory(categoryID, store)
             validatable = validatable and dependent_validatable
             if dependent_validatable:
                 includeRegexes.append(regex)
@@ -63,7 +99,7 @@ def recursiveParseCourseCategory(courseCategory):
     for excludeCategory in categoryObj["excludeItems"]:
         categoryID = excludeCategory["code"]
         if excludeCategory["categoryEntity"]:
-            (regex, dependent_validatable) = recursiveParseCourseCategory(categoryID)
+            (regex, dependent_validatable) = recursiveParseCourseCategory(categoryID, store)
             validatable = validatable and dependent_validatable
             if dependent_validatable:
                 excludeRegexes.append(regex)
@@ -88,38 +124,134 @@ def recursiveParseCourseCategory(courseCategory):
 parser = argparse.ArgumentParser(description='Aggregates and parses course category JSON objects downloaded from https://degreeexplorer.utoronto.ca/.')
 parser.add_argument('--cc_jsons_dir', type=str, help="path to directory to read downloaded course category JSONs from. default: ./course_category_data", default="./course_category_data", metavar='dir')
 parser.add_argument('--cc_ids_file', type=argparse.FileType('w'), help="path to file to write aggregated programs into. default: ./aggregated_course_categories.json", default="./aggregated_course_categories.json", metavar='file')
+addStoreArguments(parser)
+addRegexOptimizerArguments(parser)
+addManifestArguments(parser, "./.course_category_aggregator_manifest.json")
+addMetricsArguments(parser)
 
 # Dict to hold final aggregated course categories obj
 aggregated_course_categories = {}
 
 # Start main
-if __name__ == "__main__":
-    args = parser.parse_args()
-
+def main(args):
     print("Starting course category aggregation...")
 
+    store = openStore(args.cc_jsons_dir, args.store_file, "course_categories")
+
     attempted = 0
+    reused = 0
+    # The categories resolved in this run, as opposed to reused from the manifest. Only their regexes still need optimizing.
+    resolved = []
+
+    # In incremental mode, the previous run's manifest holds the aggregated entry of every category it saw, along with the categories each one includes or excludes, the courses it names and its regex as built, before optimizing.
+    manifest = loadManifest(args.manifest_file) if args.incremental else {}
+    newManifest = {}
+
+    # First read in every category, or with --incremental, only the ones that were added or changed. Keys are the category codes themselves, except in a directory store, where characters that can't be in a filename are stripped. Hence the mapping.
+    with phase("scan"):
+        ccKeys = store.keys()
+        ccCodes = {}
+        changedCategories = set()
+        for ccKey in ccKeys:
+            if args.incremental:
+                entry = manifest.get(ccKey)
+                (fingerprint, unchanged) = store.fingerprint(ccKey, entry)
+                if unchanged:
+                    ccCodes[ccKey] = entry["code"]
+                    # Manifests from before named courses were kept need the category read once more.
+                    named = entry["namedCourses"] if "namedCourses" in entry else namedCourses(store.get(ccKey))
+                    newManifest[ccKey] = dict(fingerprint, code=entry["code"], dependencies=entry["dependencies"], namedCourses=named, fragment=entry["fragment"], builtRegex=entry.get("builtRegex", entry["fragment"]["regex"]))
+                    continue
+
+            # Read into dict. This also caches it for when it comes up as a dependency of another category.
+            ccObj = store.get(ccKey)
+            categoryObjCache[ccObj["code"]] = ccObj
+            ccCodes[ccKey] = ccObj["code"]
+            changedCategories.add(ccObj["code"])
+            if args.incremental:
+                newManifest[ccKey] = dict(fingerprint, code=ccObj["code"], dependencies=[item["code"] for item in ccObj["includeItems"] + ccObj["excludeItems"] if item["categoryEntity"]], namedCourses=namedCourses(ccObj))
+                if entry is not None:
+                    changedCategories.add(entry["code"])
+
+        if args.incremental:
+            for deletedKey in manifest.keys() - newManifest.keys():
+                changedCategories.add(manifest[deletedKey]["code"])
+
+            # A category's regex is built from the regexes of the categories it includes and excludes, so every category depending on a changed one, directly or not, is stale as well.
+            dependents = {}
+            for entry in newManifest.values():
+                for dependency in entry["dependencies"]:
+                    dependents.setdefault(dependency, []).append(entry["code"])
+            staleCategories = set()
+            frontier = list(changedCategories)
+            while frontier:
+                courseCategory = frontier.pop()
+                if courseCategory not in staleCategories:
+                    staleCategories.add(courseCategory)
+                    frontier += dependents.get(courseCategory, [])
+
+            # Everything else is still up to date. Seeding the memo with it means stale categories never have to re-resolve (or even reopen) their fresh dependencies. The memo gets the regexes as built rather than optimized, so that stale categories come out exactly as they would without --incremental.
+            for entry in newManifest.values():
+                if entry["code"] not in staleCategories:
+                    resolvedCategories[entry["code"]] = (entry["builtRegex"], entry["fragment"]["validatable"])
 
-    for ccFile in glob.glob(f"{args.cc_jsons_dir}/*.json"):
-        attempted += 1
+    progressLine.start("resolving course categories", len(ccKeys))
+    with phase("resolve"):
+        for ccKey in ccKeys:
+            progressLine.advance("resolving course categories")
+            courseCategory = ccCodes[ccKey]
+            if args.incremental and courseCategory not in staleCategories:
+                reused += 1
+                aggregated_course_categories[courseCategory] = newManifest[ccKey]["fragment"]
+                continue
 
-        # Read file into dict
-        with open(ccFile) as f:
-            ccObj = json.load(f)
-            courseCategory = ccObj["code"]
+            attempted += 1
+            resolved.append(courseCategory)
 
-        (regex, complete_status) = recursiveParseCourseCategory(courseCategory)
-        aggregated_course_categories[courseCategory] = {
-            "regex": regex,
-            "display": f"{courseCategory}: {ccObj['display']}".strip(),
-            "validatable": complete_status
-        }
+            ccObj = loadCourseCategory(store, courseCategory)
+            (regex, complete_status) = recursiveParseCourseCategory(courseCategory, store)
+            aggregated_course_categories[courseCategory] = {
+                "regex": regex,
+                "display": f"{courseCategory}: {ccObj['display']}".strip(),
+                "validatable": complete_status
+            }
+            if args.incremental:
+                newManifest[ccKey]["fragment"] = aggregated_course_categories[courseCategory]
+                newManifest[ccKey]["builtRegex"] = regex
+
+    # Shorten the regexes before writing them. Entries in the manifest are the same objects, so it gets the optimized regexes too, and so do the categories depending on these in a later --incremental run.
+    if not args.raw_regexes:
+        progressLine.start("optimizing course category regexes", len(resolved))
+        with phase("optimize"):
+            # Every course named in a category goes into the universe, so that those are checked even without any aggregated courses or scraped IDs. With --incremental, that includes the ones named by categories reused from the manifest, so that the universe is the same as without it.
+            named = [code for ccObj in categoryObjCache.values() if ccObj is not None for code in namedCourses(ccObj)]
+            named += [code for entry in newManifest.values() for code in entry["namedCourses"]]
+            universe = loadCourseUniverse(args, named)
+            (regexCharsBefore, regexCharsAfter, rejected) = optimizeCategoryRegexes(aggregated_course_categories, resolved, universe, lambda: progressLine.advance("optimizing course category regexes"))
 
     # We have finished modifying all the courses. Write aggregated_courses to file
-    json.dump(aggregated_course_categories, args.cc_ids_file, ensure_ascii=False, separators=(',', ':'))
+    with phase("write"):
+        with timed("jsonDumpSeconds"):
+            json.dump(aggregated_course_categories, args.cc_ids_file, ensure_ascii=False, separators=(',', ':'))
+
+        if args.incremental:
+            saveManifest(args.manifest_file, newManifest)
 
     # Print diagnostics
     print("Finished.")
-    print(f"Cleaned and aggregated {attempted} course(s) from {args.cc_jsons_dir}")
+    print(f"Cleaned and aggregated {attempted} course(s) from {args.store_file or args.cc_jsons_dir}")
+    if not args.raw_regexes:
+        print(f"\tOptimized their regexes from {regexCharsBefore} to {regexCharsAfter} characters, checked against {len(universe.courses)} course(s)")
+        if rejected:
+            print(f"\tKept {len(rejected)} regex(es) as built, since the optimized ones accepted different courses: {rejected}")
+    if args.incremental:
+        print(f"\tReused {reused} up to date course categories and dropped {len(manifest.keys() - newManifest.keys())} deleted course categories using {args.manifest_file}")
+
+    args.cc_ids_file.close()
 
-    args.cc_ids_file.close()
\ No newline at end of file
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+    main(args)
+    writeMetricsReport(args)
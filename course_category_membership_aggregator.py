@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import re
+from pathlib import Path
+
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, timed
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Precomputes which courses belong to which course categories, using the aggregated course categories and courses.")
+parser.add_argument("--cc_aggr_file", type=argparse.FileType("r"), help="path to aggregated course categories to evaluate. default: ./aggregated_course_categories.json", default="./aggregated_course_categories.json", metavar="file")
+parser.add_argument("--c_aggr_file", type=argparse.FileType("r"), help="path to aggregated courses whose codes make up the course universe. default: ./aggregated_courses.json", default="./aggregated_courses.json", metavar="file")
+parser.add_argument("--c_ids_file", type=str, help="path to ASCII file of scraped course IDs to add to the course universe. Ignored if it doesn't exist. default: ./course-ids.txt", default="./course-ids.txt", metavar="file")
+parser.add_argument("--membership_file", type=argparse.FileType("w"), help="path to file to write the course category membership index into. default: ./course_category_membership.json", default="./course_category_membership.json", metavar="file")
+parser.add_argument("--debug", help="include to pretty-print JSON. Useful for debugging.", action="store_true")
+addMetricsArguments(parser)
+
+
+def buildMembershipIndex(aggregatedCategories, courses):
+    # Only validatable categories get an index. The regex of an unvalidatable one is known to be incomplete, so any membership computed from it would be wrong.
+    categories = sorted(code for code, ccObj in aggregatedCategories.items() if ccObj["validatable"])
+    courseIndices = {course: i for i, course in enumerate(courses)}
+
+    categoryCourses = {}
+    courseCategories = [[] for _ in courses]
+    for categoryIndex, category in enumerate(categories):
+        # The regexes are anchored at the start of the code, same as the other code regexes in this repo. Exclude-only categories are just a lookahead, so they can't be matched in full.
+        regex = re.compile(aggregatedCategories[category]["regex"])
+        members = [courseIndices[course] for course in courses if regex.match(course)]
+        categoryCourses[category] = members
+        for courseIndex in members:
+            courseCategories[courseIndex].append(categoryIndex)
+
+    # Both directions refer to courses and categories by their index in the two lists to keep the file small.
+    return {
+        "courses": courses,
+        "categories": categories,
+        "categoryCourses": categoryCourses,
+        "courseCategories": courseCategories
+    }
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+
+    print("Starting course category membership indexing...")
+
+    with phase("read"), timed("jsonParseSeconds"):
+        aggregatedCategories = json.load(args.cc_aggr_file)
+
+        # The course universe is every aggregated course plus every scraped ID, even those that couldn't be downloaded.
+        courses = set(json.load(args.c_aggr_file).keys())
+    if Path(args.c_ids_file).is_file():
+        with open(args.c_ids_file) as f:
+            courses.update(line.strip() for line in f if line.strip() != "")
+    courses = sorted(courses)
+
+    with phase("index"):
+        membershipIndex = buildMembershipIndex(aggregatedCategories, courses)
+
+    with phase("write"), timed("jsonDumpSeconds"):
+        if (args.debug):
+            json.dump(membershipIndex, args.membership_file, ensure_ascii=False, indent=2)
+        else:
+            json.dump(membershipIndex, args.membership_file, ensure_ascii=False, separators=(",", ":"))
+
+    # Print diagnostics
+    print("Finished.")
+    print(f"Indexed {len(membershipIndex['categories'])} validatable course categories against {len(courses)} course(s)")
+    print(f"\tSkipped {len(aggregatedCategories) - len(membershipIndex['categories'])} unvalidatable course categories")
+
+    args.cc_aggr_file.close()
+    args.c_aggr_file.close()
+    args.membership_file.close()
+    writeMetricsReport(args)
@@ -0,0 +1,165 @@
+import random
+import re
+import sys
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from run_metrics import count, recordRequest, timed
+
+# Root of every REST endpoint the downloaders call.
+deRestURL = "https://degreeexplorer.utoronto.ca/degreeExplorer/rest"
+
+# Headers sent with every request, copied from a Chrome session on the planner page. Host, Connection and Accept-Encoding are left to requests, which keeps connections alive on its own and only advertises encodings it can actually decode.
+browserHeaders = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "DNT": "1",
+    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
+    "sec-ch-ua": '" Not;A Brand";v="99", "Google Chrome";v="91", "Chromium";v="91"',
+    "sec-ch-ua-mobile": "?0",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+}
+
+# Extra headers for the state-changing POSTs. The body is always empty; everything is passed in the query string.
+postHeaders = {
+    "Content-Type": "text/plain",
+    "Origin": "https://degreeexplorer.utoronto.ca",
+}
+
+xsrfCookieRe = re.compile('XSRF-TOKEN=([^;]+)')
+
+# Retried requests wait a random time of up to 2^attempt seconds, capped here.
+maxBackoff = 60
+
+
+def addClientArguments(parser):
+    parser.add_argument('--pool_size', type=int, help="max number of pooled connections kept open to Degree Explorer. default: 10", default=10, metavar='num')
+    parser.add_argument('--timeout', type=float, help="seconds to wait for Degree Explorer to connect or respond before giving up on a request. default: 30", default=30, metavar='secs')
+    parser.add_argument('--max_rate', type=float, help="max number of requests per second to send Degree Explorer. The rate is halved whenever DE pushes back with a 429 or 5xx and recovers as requests succeed. 0 means no limit. default: 20", default=20, metavar='num')
+    parser.add_argument('--max_retries', type=int, help="number of times to retry a request that timed out or got a 429 or 5xx, with exponential backoff in between. default: 5", default=5, metavar='num')
+    parser.add_argument('--retry_rounds', type=int, help="number of extra passes over the IDs that still failed, at the end of a download. default: 2", default=2, metavar='num')
+    parser.add_argument('--xsrf_token', type=str, help="XSRF token to send with the POSTs, for a cookie that doesn't carry its own XSRF-TOKEN. To obtain this, copy the X-XSRF-TOKEN header of any POST from the Network tab of Chrome Devtools. default: the cookie's", default=None, metavar='token')
+    parser.add_argument('--base_url', type=str, help=f"root of Degree Explorer's REST endpoints, e.g. to download from benchmarks/mock_de_server.py instead. default: {deRestURL}", default=deRestURL, metavar='url')
+
+
+def openClient(args, poolSize, posts=True):
+    # posts is whether the client will be used to POST anything. Only then is an XSRF token needed, and DE rejects every POST without the right one, so there's no point starting without it.
+    xsrfToken = xsrfTokenOf(args.cookie, args.xsrf_token)
+    if posts and xsrfToken is None:
+        sys.exit("error: the cookie has no XSRF-TOKEN, so pass the one from your DE session with --xsrf_token")
+    return DEClient(args.cookie, xsrfToken, poolSize=poolSize, timeout=args.timeout, maxRate=args.max_rate, maxRetries=args.max_retries, retryRounds=args.retry_rounds, baseURL=args.base_url)
+
+def xsrfTokenOf(cookie, xsrfToken=None):
+    # The one in the cookie, if it has one, otherwise whichever was given.
+    match = xsrfCookieRe.search(cookie)
+    return match.group(1) if match else xsrfToken
+
+
+class SessionExpiredError(Exception):
+    # Deliberately not a RequestException: every other request failure is worth retrying later, but once the cookie has expired nothing will succeed until it's replaced.
+    pass
+
+
+class RateLimiter:
+    # A token bucket shared by every thread of the run. The refill rate is cut in half whenever DE pushes back, and creeps back up to maxRate as requests succeed again.
+    def __init__(self, maxRate):
+        self.maxRate = maxRate
+        self.rate = maxRate
+        self.tokens = 1
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.maxRate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # At most a second's worth of requests can be saved up.
+            self.tokens = min(max(self.rate, 1), self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+            # Take the token even if it hasn't been refilled yet, and sleep until it would have been. Waiting threads are then served in the order they came in.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        time.sleep(delay)
+
+    def slowDown(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, 0.5)
+
+    def speedUp(self):
+        with self.lock:
+            self.rate = min(self.rate + 0.5, self.maxRate)
+
+
+def isSessionExpired(r, baseURL=deRestURL):
+    # DE answers 401 or 403 once the session is gone, or sends the request off to the UofT login page.
+    return r.status_code in (401, 403) or not r.url.startswith(baseURL)
+
+def retryDelay(r, attempt):
+    # Honour Retry-After when DE sends one, up to maxBackoff, so that one odd header can't stall every worker for hours. Otherwise back off exponentially, with full jitter so that the workers don't all come back at once.
+    retryAfter = r.headers.get("Retry-After", "") if r is not None else ""
+    if retryAfter.isdigit():
+        return min(int(retryAfter), maxBackoff)
+    return random.uniform(0, min(2 ** attempt, maxBackoff))
+
+
+class DEClient:
+    def __init__(self, cookie, xsrfToken=None, poolSize=10, timeout=30, maxRate=20, maxRetries=5, retryRounds=2, baseURL=deRestURL):
+        self.baseURL = baseURL.rstrip("/")
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        # How many extra passes the downloaders make over IDs that still failed after every retry.
+        self.retryRounds = retryRounds
+        self.rateLimiter = RateLimiter(maxRate)
+
+        # One session for the whole run, so every request reuses an already open TLS connection instead of handshaking again.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(browserHeaders)
+        self.session.headers["Cookie"] = cookie
+
+        # DE wants the XSRF token echoed back in a header on POSTs. Without one, POSTs go out without it and DE turns them down.
+        self.postHeaders = dict(postHeaders, **({"X-XSRF-TOKEN": xsrfToken} if xsrfToken else {}))
+
+    def request(self, method, endpoint, headers=None):
+        # Timeouts, dropped connections, 429s and 5xxs are retried up to maxRetries times. After that, the last response is returned or the last exception raised as usual.
+        # Latencies are recorded per endpoint, without the query string, so e.g. every saveCourseEntry lands in the same histogram.
+        endpointName = endpoint.split("?")[0]
+        for attempt in range(self.maxRetries + 1):
+            if attempt > 0:
+                count("retries")
+            with timed("rateLimitSeconds"):
+                self.rateLimiter.acquire()
+            start = time.perf_counter()
+            try:
+                r = self.session.request(method, f"{self.baseURL}/{endpoint}", headers=headers, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                recordRequest(endpointName, time.perf_counter() - start, type(e).__name__)
+                if attempt == self.maxRetries:
+                    raise
+                r = None
+            else:
+                recordRequest(endpointName, time.perf_counter() - start, r.status_code, len(r.content))
+                if isSessionExpired(r, self.baseURL):
+                    raise SessionExpiredError(f"Degree Explorer rejected the cookie with status {r.status_code}. Log in again and pass the new cookie.")
+                if r.status_code != 429 and r.status_code < 500:
+                    self.rateLimiter.speedUp()
+                    return r
+                if attempt == self.maxRetries:
+                    return r
+            self.rateLimiter.slowDown()
+            time.sleep(retryDelay(r, attempt))
+
+    # Both of these raise requests.exceptions.RequestException on connection errors and timeouts that outlast every retry, and SessionExpiredError once the cookie stops working.
+    def get(self, endpoint):
+        return self.request("GET", endpoint)
+
+    def post(self, endpoint):
+        return self.request("POST", endpoint, headers=self.postHeaders)
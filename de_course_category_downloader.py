@@ -2,82 +2,124 @@
 
 import requests
 from pathlib import Path
-import json
 import argparse
 import sys
 import urllib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-getCategoryCourseGETHeader = {
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Connection": "keep-alive",
-    "Cookie": "",
-    "DNT": "1",
-    "Host": "degreeexplorer.utoronto.ca",
-    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
-    "sec-ch-ua": '"Chromium";v="92", " Not A;Brand";v="99", "Google Chrome";v="92"',
-    "sec-ch-ua-mobile": "?0",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "same-origin",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36",
-}
+from de_client import SessionExpiredError, addClientArguments, openClient
+from entity_store import addStoreArguments, openStore, addRefreshArguments, openRefreshTracker, writeChangedIDs
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, progressLine
 
 # Set up argument parsing and parse args
 parser = argparse.ArgumentParser(description='Downloads course category JSON objects from https://degreeexplorer.utoronto.ca/.')
 parser.add_argument('cookie', type=str, help="cookie from a valid Degree Explorer session. To obtain this, log into DE with your UofT credentials, then copy the cookie from the Network tab of Chrome Devtools")
 parser.add_argument('--cc_jsons_dir', type=str, help="path to directory to store downloaded course category JSONs. default: ./course_category_data", default="./course_category_data", metavar='dir')
+parser.add_argument('--workers', type=int, help="max number of course categories to download concurrently. default: 8", default=8, metavar='num')
+addClientArguments(parser)
+addStoreArguments(parser)
+addRefreshArguments(parser)
+addMetricsArguments(parser)
+
+def fetchCourseCategory(client, categoryID, store, refresh):
+    # Check if it's already been downloaded and isn't due for a refresh. If so, get the object. It's still needed to find the dependent categories.
+    if not refresh.needsDownload(store, categoryID):
+        return ("Skipped", store.get(categoryID))
+
+    # Download it if not. Yeah, it needs to be double encoded. Don't ask why.
+    try:
+        r = client.get(f"dxStudent/getCategoryCourses?categoryCode={urllib.parse.quote(urllib.parse.quote(categoryID))}")
+    except requests.exceptions.RequestException:
+        r = None
+    if (r is None or r.status_code != 200):
+        return ("Failed", None)
+    try:
+        categoryObj = r.json()
+    except ValueError:
+        # DE sometimes answers with a 200 and an HTML error page instead. It fails like a bad status would, and gets retried.
+        return ("Failed", None)
+
+    # Save the json to the store
+    refresh.put(store, categoryID, categoryObj)
+    return ("Succeeded", categoryObj)
 
-def recursiveCourseCategoryDownload(categoryID):
+def crawlCourseCategories(client, seedCategoryIDs, store, refresh, workers):
     successes = 0
     skipped = []
     failures = []
-
-    # Check if it's already been downloaded.
-    ccFilename = "".join(i for i in categoryID if i not in "\/:*?<>|")
-    f = Path(f"{args.cc_jsons_dir}/{ccFilename}.json")
-
-    # If it has not, download it
-    if not f.is_file():
-        # Download it if not. Yeah, it needs to be double encoded. Don't ask why.
-        r = requests.get(f"https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxStudent/getCategoryCourses?categoryCode={urllib.parse.quote(urllib.parse.quote(categoryID))}", headers=getCategoryCourseGETHeader)
-        if (r.status_code != 200):
-            # Chalk this up as a failure, and return with 0 successes and skips
-            failures += [categoryID]
-            return (successes, skipped, failures)
-        categoryObj = r.json()
-
-        # Save the json to file
-        with open(f"{args.cc_jsons_dir}/{ccFilename}.json", 'w') as f:
-            json.dump(categoryObj, f, ensure_ascii=False, indent=2)
-        # Getting this succeeded
-        successes += 1
-    # If it has, open it and get the object
-    else:
-        with open(f"{args.cc_jsons_dir}/{ccFilename}.json", 'r') as f:
-            categoryObj = json.load(f)
-        # This was skipped since it's already been downloaded before
-        skipped += [categoryID]
-
-
-    # Check includes for dependent categories
-    for includeCategory in categoryObj["includeItems"]:
-        # If it's marked as a category, try to download it as well. Otherwise, leave it
-        if includeCategory["categoryEntity"]:
-            (sucs, skips, fails) = recursiveCourseCategoryDownload(includeCategory["code"])
-            # Add to here how many of the include categories succeeded, were skipped, or failed
-            successes += sucs
-            skipped += skips
-            failures += fails
-    # Do the same for the exclude categories
-    for excludeCategory in categoryObj["excludeItems"]:
-        # If it's marked as a category, try to download it as well. Otherwise, leave it
-        if excludeCategory["categoryEntity"]:
-            (sucs, skips, fails) = recursiveCourseCategoryDownload(excludeCategory["code"])
-            successes += sucs
-            skipped += skips
-            failures += fails
+    # Categories that failed even after the client's own retries. They get another go once the crawl is done, once whatever went wrong has had time to pass.
+    retryQueue = []
+    sessionExpired = False
+
+    # Every category ever queued this run. Shared subtrees like *1* are reached from many parents, but only fetched the first time.
+    visited = set()
+    inFlight = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(categoryID):
+            inFlight[executor.submit(fetchCourseCategory, client, categoryID, store, refresh)] = categoryID
+
+        def enqueue(categoryID):
+            # Once the cookie has expired, seeds are still taken so whoever is producing them isn't left waiting, but nothing more is fetched.
+            if categoryID not in visited and not sessionExpired:
+                visited.add(categoryID)
+                # The total isn't known up front, since every category can lead to more.
+                progressLine.advance("course categories")
+                submit(categoryID)
+
+        # Tally finished categories and push their dependent categories onto the frontier.
+        def handleFinished(futures):
+            nonlocal successes, sessionExpired
+            for future in futures:
+                categoryID = inFlight.pop(future)
+                try:
+                    (status, categoryObj) = future.result()
+                except SessionExpiredError as e:
+                    if not sessionExpired:
+                        print(e)
+                    sessionExpired = True
+                    failures.append(categoryID)
+                    print(f"{categoryID} - Status: Failed")
+                    continue
+                print(f"{categoryID} - Status: {status}")
+                if status == "Failed":
+                    retryQueue.append(categoryID)
+                    continue
+                if status == "Skipped":
+                    skipped.append(categoryID)
+                else:
+                    successes += 1
+
+                # Check includes and excludes for dependent categories. If it's marked as a category, download it as well. Otherwise, leave it
+                for item in categoryObj["includeItems"] + categoryObj["excludeItems"]:
+                    if item["categoryEntity"]:
+                        enqueue(item["code"])
+
+        def crawl():
+            # Crawl until the frontier is empty.
+            while inFlight:
+                done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+                handleFinished(done)
+
+        for categoryID in seedCategoryIDs:
+            enqueue(categoryID)
+            # Pick up whatever has finished in the meantime, so the frontier keeps growing while seeds are still coming in.
+            handleFinished([future for future in list(inFlight) if future.done()])
+        crawl()
+
+        # Then up to retryRounds passes over the retry queue. Categories that succeed this time still push their dependents onto the frontier.
+        for _ in range(client.retryRounds):
+            if not retryQueue or sessionExpired:
+                break
+            retrying = list(retryQueue)
+            retryQueue.clear()
+            print(f"Retrying {len(retrying)} failed categories...")
+            for categoryID in retrying:
+                submit(categoryID)
+            crawl()
+
+    # Whatever is still waiting for a retry has failed for good.
+    failures += retryQueue
 
     return (successes, skipped, failures)
 
@@ -85,36 +127,37 @@ def recursiveCourseCategoryDownload(categoryID):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    startMetrics(args)
 
     print("Starting course category download...")
 
-    # If a directory is indicated, create it if it doesn't exist.
-    if args.cc_jsons_dir:
+    # If a directory is indicated and there's no store file, create it if it doesn't exist.
+    if args.cc_jsons_dir and not args.store_file:
         Path(args.cc_jsons_dir).mkdir(exist_ok=True, parents=True)
 
-    # Load the cookies into the headers.
-    getCategoryCourseGETHeader["Cookie"] = args.cookie
+    # One pooled session for every request of the run.
+    client = openClient(args, max(args.pool_size, args.workers), posts=False)
 
     # Status vars for the program.
     attempted = 0
-    successes = 0
-    skipped = []
-    failures = []
 
-    for line in sys.stdin:
-        courseCategory = line.strip()
-        attempted += 1
+    def seedCategories():
+        global attempted
+        for line in sys.stdin:
+            attempted += 1
+            yield line.strip()
 
-        (sucs, skips, fails) = recursiveCourseCategoryDownload(courseCategory)
-        successes += sucs
-        skipped += skips
-        failures += fails
+    refresh = openRefreshTracker(args)
 
-        print(f"{courseCategory} - Successes:{sucs}, Skips:{len(skips)}, Fails:{len(fails)}")
+    with phase("crawl course categories"):
+        (successes, skipped, failures) = crawlCourseCategories(client, seedCategories(), openStore(args.cc_jsons_dir, args.store_file, "course_categories"), refresh, args.workers)
 
     # Print status information and exit.
     print("Finished.")
     print(f"Attempted to parse {attempted} course categories from stdin:")
-    print(f"\tSucceeded in parsing {successes} categories, both from stdin and their unlisted dependent categories")
-    print(f"\tSkipped {len(set(skipped))} categories because they have already been parsed. Skipped: {set(skipped)}")
-    print(f"\tFailed to download {len(set(failures))} categories. Failed: {set(failures)}")
\ No newline at end of file
+    print(f"\tSucceeded in parsing {successes} categories, both from stdin and their unlisted dependent categories, {len(refresh.changed)} of which were new or changed")
+    print(f"\tSkipped {len(skipped)} categories because they have already been parsed. Skipped: {skipped}")
+    print(f"\tFailed to download {len(failures)} categories. Failed: {failures}")
+
+    writeChangedIDs(args, refresh)
+    writeMetricsReport(args)
@@ -2,50 +2,17 @@
 
 import requests
 from pathlib import Path
-import json
 import argparse
 import sys
 import re
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from constants import allCoursesRe, allProgramsRe, prerequisiteRe
-
-getCourseInfoGETHeader = {
-    "Host": "degreeexplorer.utoronto.ca",
-    "Connection": "keep-alive",
-    "sec-ch-ua": '" Not;A Brand";v="99", "Google Chrome";v="91", "Chromium";v="91"',
-    "Accept": "application/json, text/plain, */*",
-    "DNT": "1",
-    "sec-ch-ua-mobile": "?0",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-    "Sec-Fetch-Site": "same-origin",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Dest": "empty",
-    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Cookie": ""
-}
-
-addCoursePOSTHeader = {
-    "Host": "degreeexplorer.utoronto.ca",
-    "Connection": "keep-alive",
-    "Content-Length": "0",
-    "sec-ch-ua": '" Not;A Brand";v="99", "Google Chrome";v="91", "Chromium";v="91"',
-    "Accept": "application/json, text/plain, */*",
-    "DNT": "1",
-    "X-XSRF-TOKEN": "eYH6RC3MRwtk1RJfFsMbjTt1KBpsAcDC7wuTvHMJ+Uw=",
-    "sec-ch-ua-mobile": "?0",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-    "Content-Type": "text/plain",
-    "Origin": "https://degreeexplorer.utoronto.ca",
-    "Sec-Fetch-Site": "same-origin",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Dest": "empty",
-    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Cookie": ""
-}
+from constants import courseRequisiteClassifier
+from de_client import SessionExpiredError, addClientArguments, openClient
+from id_files import mergeIDs
+from entity_store import addStoreArguments, openStore, addRefreshArguments, openRefreshTracker, writeChangedIDs
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, progressLine
 
 # Set up argument parsing
 parser = argparse.ArgumentParser(description='Downloads course JSON objects from https://degreeexplorer.utoronto.ca/.')
@@ -53,84 +20,196 @@ parser.add_argument('cookie', type=str, help="cookie from a valid Degree Explore
 parser.add_argument('row_num', type=int, help="row num of DE timetable into which to add courses before download")
 parser.add_argument('col_num', type=int, help="col num of DE timetable into which to add courses before download")
 parser.add_argument('--c_jsons_dir', type=str, help="path to directory to store downloaded course JSONs. default: ./course_data", default="./course_data", metavar='dir')
-parser.add_argument('--c_cc_ids_file', type=argparse.FileType('a'), help="path to ASCII file to store course categories from downloaded course JSONs. default: ./courses-course-category-ids.txt", default="./courses-course-category-ids.txt", metavar='file')
-
-
-
-if __name__ == "__main__":
-    args = parser.parse_args()
-
-    print("Starting course download...")
-
-    # If a directory is indicated, create it if it doesn't exist.
-    if args.c_jsons_dir:
-        Path(args.c_jsons_dir).mkdir(exist_ok=True, parents=True)
+parser.add_argument('--cells', type=str, nargs='+', help="additional free cells of the DE timetable to download courses through concurrently, one course in flight per cell. Each is either ROW,COL or a grid range ROW1-ROW2,COL1-COL2 (inclusive). default: only row_num,col_num", default=[], metavar='cell')
+parser.add_argument('--c_cc_ids_file', type=str, help="path to ASCII file to store course categories from downloaded course JSONs. Categories already in the file are kept, and each category is listed once. default: ./courses-course-category-ids.txt", default="./courses-course-category-ids.txt", metavar='file')
+addClientArguments(parser)
+addStoreArguments(parser)
+addRefreshArguments(parser)
+addMetricsArguments(parser)
+
+def parseCells(cellSpecs):
+    cells = []
+    for spec in cellSpecs:
+        rows, cols = spec.split(",")
+        rowStart, _, rowEnd = rows.partition("-")
+        colStart, _, colEnd = cols.partition("-")
+        for row in range(int(rowStart), int(rowEnd or rowStart) + 1):
+            for col in range(int(colStart), int(colEnd or colStart) + 1):
+                if (row, col) not in cells:
+                    cells.append((row, col))
+    return cells
+
+def downloadCourse(client, courseID, freeCells):
+    # Claim a cell for the whole POST -> GET pair, so that no other course can be added into it before we read it back. There are as many workers as cells, so there is always one free.
+    (row, col) = freeCells.get()
+    try:
+        # Add the course, then get it's info. Equivalent to adding it by hovering+typing, then seeing the information by clicking on the tile.
+        r = client.post(f"dxPlanner/saveCourseEntry?tabIndex=1&selRowIndex={row}&selColIndex={col}&newCourseCode={courseID}")
+        if (r.status_code != 200):
+            return None
+        r = client.get(f"dxPlanner/getCellDetails?tabIndex=1&rowIndex={row}&colIndex={col}")
+        if (r.status_code != 200):
+            return None
+        try:
+            return r.json()
+        except ValueError:
+            # DE sometimes answers with a 200 and an HTML error page instead. It fails like a bad status would, and gets retried.
+            return None
+    finally:
+        freeCells.put((row, col))
 
-    # Load the cookies into the headers.
-    addCoursePOSTHeader["Cookie"] = args.cookie
-    getCourseInfoGETHeader["Cookie"] = args.cookie
 
+def downloadCourses(client, courseIDs, cells, store, refresh, onCategory):
     # Status vars.
     attempted = 0
     successes = 0
     skipped = []
     failures = []
-    # Used to keep track of how many have failed in a row. If it's more than a threshold, the cookie has likely become invalid. Auto-quit at that point to stop hammering the server.
+    # Used to keep track of how many have failed in a row. If it's more than a threshold, something is wrong beyond what retrying can fix. Auto-quit at that point to stop hammering the server.
     consecutive_failures = 0
-
-    # Loop through all courses.
-    for line in sys.stdin:
-        if consecutive_failures >= 20:
-            print(f"Detected {consecutive_failures} consecutive failures. This is likely because the cookie has become invalid. Quitting now to avoid unnecessary API calls.")
-            break
-
-        courseID = line.strip()
-        attempted += 1
-
-        print(f"{courseID} - Status: ", end="")
-
-        # Skip the course if we've already scraped it.
-        f = Path(f"{args.c_jsons_dir}/{courseID}.json")
-        if f.is_file():
-            skipped.append(courseID)
-            print("Skipped")
-            continue
-
-        # Add the course, then get it's info. Equivalent to adding it by hovering+typing, then seeing the information by clicking on the tile.
-        r = requests.post(f"https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxPlanner/saveCourseEntry?tabIndex=1&selRowIndex={args.row_num}&selColIndex={args.col_num}&newCourseCode={courseID}", headers=addCoursePOSTHeader)
-        if (r.status_code != 200):
-            failures.append(courseID)
-            consecutive_failures += 1
-            print("Failed")
-            continue
-        r = requests.get(f"https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxPlanner/getCellDetails?tabIndex=1&rowIndex={args.row_num}&colIndex={args.col_num}", headers=getCourseInfoGETHeader)
-        if (r.status_code != 200):
+    # Courses that failed even after the client's own retries. They get another go at the end of the run, once whatever went wrong has had time to pass.
+    retryQueue = []
+    sessionExpired = False
+
+    # Every cell gets its own worker, so one course is always in flight per cell.
+    freeCells = queue.Queue()
+    for cell in cells:
+        freeCells.put(cell)
+    inFlight = {}
+
+    # Write out a finished course and tally it. Done on the calling thread only, so the status vars and onCategory need no locking.
+    def handleFinished(future):
+        nonlocal consecutive_failures, successes, sessionExpired
+        courseID = inFlight.pop(future)
+        try:
+            thisCourseObj = future.result()
+        except requests.exceptions.RequestException:
+            thisCourseObj = None
+        except SessionExpiredError as e:
+            # No point retrying this one, nothing will succeed until the cookie is replaced.
+            if not sessionExpired:
+                print(e)
+            sessionExpired = True
             failures.append(courseID)
+            print(f"{courseID} - Status: Failed")
+            return
+        if thisCourseObj is None:
+            retryQueue.append(courseID)
             consecutive_failures += 1
-            print("Failed")
-            continue
-        thisCourseObj = r.json()
+            print(f"{courseID} - Status: Failed")
+            return
 
-        # Save the program info to file
-        with open(f"{args.c_jsons_dir}/{courseID}.json", 'w') as f:
-            json.dump(thisCourseObj, f, ensure_ascii=False, indent=2)
+        # Save the course info to the store
+        refresh.put(store, courseID, thisCourseObj)
 
         # Save any course categories from this one's exclusions, corequisites, and prerequisites
         for category in ["prerequisites", "corequisites", "orderedExclusions"]:
             for categoryObj in thisCourseObj[category]:
-                for requisiteItem in categoryObj["requisiteItems"]:
-                    code = requisiteItem["code"]
-                    # If the code isn't a course from any campus or a program or a prerequisite ID or empty, then it must be a course category
-                    if not allCoursesRe.match(code) and not allProgramsRe.match(code) and not prerequisiteRe.match(code) and code != "":
-                        args.c_cc_ids_file.write(code + "\n")
+                # If the code isn't a course from any campus or a program or a prerequisite ID or empty, then it must be a course category
+                for code in courseRequisiteClassifier.classifyItems(categoryObj["requisiteItems"])[1]["category"]:
+                    if code != "":
+                        onCategory(code)
 
-        print("Succeeded")
+        print(f"{courseID} - Status: Succeeded")
         consecutive_failures = 0 # Reset this.
         successes += 1
 
+    def finishInFlight():
+        while inFlight:
+            done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+            for future in done:
+                handleFinished(future)
+
+    # Every requested course, followed by up to retryRounds passes over the retry queue. Each pass only starts once the previous one has completely finished.
+    def pendingCourses():
+        for courseID in courseIDs:
+            yield (courseID, False)
+        for _ in range(client.retryRounds):
+            finishInFlight()
+            if not retryQueue:
+                return
+            retrying = list(retryQueue)
+            retryQueue.clear()
+            print(f"Retrying {len(retrying)} failed course(s)...")
+            for courseID in retrying:
+                yield (courseID, True)
+
+    # Loop through all courses.
+    with ThreadPoolExecutor(max_workers=len(cells)) as executor:
+        for (courseID, retrying) in pendingCourses():
+            if consecutive_failures >= 20 or sessionExpired:
+                break
+
+            # Skip the course if we've already scraped it, unless it's due for a refresh.
+            if not retrying and not refresh.needsDownload(store, courseID):
+                attempted += 1
+                progressLine.advance("courses")
+                skipped.append(courseID)
+                print(f"{courseID} - Status: Skipped")
+                continue
+
+            # Wait for a cell to free up before handing out another course.
+            while len(inFlight) >= len(cells):
+                done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handleFinished(future)
+            if consecutive_failures >= 20 or sessionExpired:
+                break
+            if not retrying:
+                attempted += 1
+                progressLine.advance("courses")
+            inFlight[executor.submit(downloadCourse, client, courseID, freeCells)] = courseID
+
+        # Let the courses still in flight finish.
+        finishInFlight()
+
+    # Whatever is still waiting for a retry has failed for good.
+    failures += retryQueue
+
+    if consecutive_failures >= 20:
+        print(f"Detected {consecutive_failures} consecutive failures. Degree Explorer is likely down or rejecting these requests. Quitting now to avoid unnecessary API calls.")
+
+    return (attempted, successes, skipped, failures)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+
+    print("Starting course download...")
+
+    # If a directory is indicated and there's no store file, create it if it doesn't exist.
+    if args.c_jsons_dir and not args.store_file:
+        Path(args.c_jsons_dir).mkdir(exist_ok=True, parents=True)
+
+    cells = parseCells([f"{args.row_num},{args.col_num}"] + args.cells)
+
+    # Every worker may hold a connection open at once, so the pool needs at least one per cell.
+    client = openClient(args, max(args.pool_size, len(cells)))
+
+    refresh = openRefreshTracker(args)
+
+    # The same few categories come up in thousands of courses, so collect them in a set and only write them out at the end.
+    harvestedCategories = set()
+
+    # The IDs are normally read as they come. The progress line needs to know how many there are, so then they are all read first.
+    courseIDs = (line.strip() for line in sys.stdin)
+    if args.progress:
+        courseIDs = list(courseIDs)
+        progressLine.start("courses", len(courseIDs))
+
+    with phase("download courses"):
+        (attempted, successes, skipped, failures) = downloadCourses(client, courseIDs, cells, openStore(args.c_jsons_dir, args.store_file, "courses"), refresh, harvestedCategories.add)
+
+    numCategories = mergeIDs(args.c_cc_ids_file, harvestedCategories)
+
     # Print status information and exit.
     print("Finished.")
     print(f"Attempted to download {attempted} course(s) from Degree Explorer:")
-    print(f"\tSucceeded in downloading {successes} course(s)")
+    print(f"\tSucceeded in downloading {successes} course(s), {len(refresh.changed)} of which were new or changed")
     print(f"\tSkipped {len(skipped)} course(s) because they have already been scraped. Skipped: {skipped}")
-    print(f"\tFailed to download {len(failures)} course(s). Failures: {failures}")
\ No newline at end of file
+    print(f"\tFailed to download {len(failures)} course(s). Failures: {failures}")
+    print(f"Found {len(harvestedCategories)} course categories. {args.c_cc_ids_file} now lists {numCategories}")
+
+    writeChangedIDs(args, refresh)
+    writeMetricsReport(args)
\ No newline at end of file
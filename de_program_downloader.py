@@ -1,140 +1,193 @@
 import requests
 from pathlib import Path
-import json
 import argparse
 import sys
 
-from constants import allCoursesRe, allProgramsRe, requirementRe
-
-addProgramPOSTHeader = {
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Connection": "keep-alive",
-    "Content-Length": "0",
-    "Content-Type": "text/plain",
-    "DNT": "1",
-    "Host": "degreeexplorer.utoronto.ca",
-    "Origin": "https://degreeexplorer.utoronto.ca",
-    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
-    "sec-ch-ua": '" Not;A Brand";v="99", "Google Chrome";v="91", "Chromium";v="91"',
-    "sec-ch-ua-mobile": "?0",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "same-origin",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    "X-XSRF-TOKEN": "Vcs464vTo6UCHRjbIlLx8rMMBd8V8NIxVkLGnZGA5lU=",
-    "Cookie": ""
-}
-
-resetProgramsPOSTHeader = {
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Connection": "keep-alive",
-    "Content-Length": "0",
-    "Content-Type": "text/plain",
-    "DNT": "1",
-    "Host": "degreeexplorer.utoronto.ca",
-    "Origin": "https://degreeexplorer.utoronto.ca",
-    "Referer": "https://degreeexplorer.utoronto.ca/degreeExplorer/planner",
-    "sec-ch-ua": '" Not;A Brand";v="99", "Google Chrome";v="91", "Chromium";v="91"',
-    "sec-ch-ua-mobile": "?0",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "same-origin",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    "X-XSRF-TOKEN": "vtV17/yE+Sq6deyRxCWe1LFZCvUx1GE2+n00MwPDLcw=",
-    "Cookie": ""
-}
+from constants import allProgramsRe, programRequisiteClassifier
+from de_client import SessionExpiredError, addClientArguments, openClient
+from id_files import mergeIDs
+from entity_store import addStoreArguments, openStore, addRefreshArguments, openRefreshTracker, writeChangedIDs
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, progressLine
 
 # Set up argument parsing
 parser = argparse.ArgumentParser(description='Downloads program JSON objects from https://degreeexplorer.utoronto.ca/.')
 parser.add_argument('cookie', type=str, help="cookie from a valid Degree Explorer session. To obtain this, log into DE with your UofT credentials, then copy the cookie from the Network tab of Chrome Devtools")
 parser.add_argument('--p_jsons_dir', type=str, help="path to directory to store downloaded program JSONs. default: ./program_data", default="./program_data", metavar='dir')
-parser.add_argument('--p_cc_ids_file', type=argparse.FileType('a'), help="path to ASCII file to store course categories from downloaded program JSONs. default: ./program-course-category-ids.txt", default="./program-course-category-ids.txt", metavar='file')
+parser.add_argument('--p_cc_ids_file', type=str, help="path to ASCII file to store course categories from downloaded program JSONs. Categories already in the file are kept, and each category is listed once. default: ./program-course-category-ids.txt", default="./program-course-category-ids.txt", metavar='file')
+addClientArguments(parser)
+addStoreArguments(parser)
+addRefreshArguments(parser)
+addMetricsArguments(parser)
+
+def saveProgramObj(programObj, store, refresh, onCategory):
+    # Save the program info to the store after extracting it from the morass
+    refresh.put(store, programObj['postCode'], programObj)
+    # Now, we need to go through every course this program references, and note down every course category
+    for detailAssessment in programObj["detailAssessments"]:
+        for code in programRequisiteClassifier.classifyItems(detailAssessment["requirement"]["requisiteItems"])[1]["category"]:
+            if code != "":
+                onCategory(code)
+
+
+def downloadPrograms(client, programIDs, store, refresh, onCategory):
+    # Status vars.
+    attempted = 0
+    successes = 0
+    skipped = []
+    failures = []
+    # Programs saved from the response of adding a different program. These never need their own POST. A set, since every program in every response is checked against it.
+    harvested = set()
+    # Programs that failed even after the client's own retries. They get another go at the end of the run, once whatever went wrong has had time to pass.
+    retryQueue = []
+
+    # The current study area being downloaded. Some focuses in DE have strict dependencies on the specialist/major already being present. This ensures that we always try downloading focuses after the dependency is added.
+    currentStudyArea = None
+
+    # Every requested program, followed by up to retryRounds passes over the retry queue.
+    def pendingPrograms():
+        nonlocal currentStudyArea
+        for programID in programIDs:
+            yield (programID, False)
+        for _ in range(client.retryRounds):
+            if not retryQueue:
+                return
+            retrying = list(retryQueue)
+            retryQueue.clear()
+            print(f"Retrying {len(retrying)} failed program(s)...")
+            # Start each pass with a reset, whatever was left on the planner.
+            currentStudyArea = None
+            for programID in retrying:
+                yield (programID, True)
+
+    # Loop through every program.
+    try:
+        for (programID, retrying) in pendingPrograms():
+            studyAreaNum = allProgramsRe.match(programID).group(2)
+            if not retrying:
+                attempted += 1
+                progressLine.advance("programs")
+
+            # Skip the program if it came along with an earlier program's response during this run
+            if programID in harvested:
+                print(f"{programID} - Status: Harvested")
+                continue
+
+            # Skip the program if we've already scraped it, unless it's due for a refresh
+            if not retrying and not refresh.needsDownload(store, programID):
+                skipped.append(programID)
+                print(f"{programID} - Status: Skipped")
+                continue
+
+            # Reset if we've finished all the programs from this subject area
+            if (studyAreaNum != currentStudyArea):
+                try:
+                    r = client.post("dxPlanner/resetPrograms?tabIndex=0")
+                except requests.exceptions.RequestException:
+                    r = None
+                if (r is None or r.status_code != 200):
+                    # The next program tries resetting again, since currentStudyArea is left as it was.
+                    retryQueue.append(programID)
+                    print(f"{programID} - Status: Failed (program reset failed)")
+                    continue
+                # print(f"Reseting programs for number {currentStudyArea}, moving to {studyAreaNum}")
+                currentStudyArea = studyAreaNum
+
+            # Add the program, hopefully it doesn't fail due to an un-added prereq program
+            try:
+                r = client.post(f"dxPlanner/saveProgramEntry?tabIndex=0&newPostCode={programID}")
+            except requests.exceptions.RequestException:
+                r = None
+            if (r is None or r.status_code != 200):
+                retryQueue.append(programID)
+                print(f"{programID} - Status: Failed")
+                continue
+            try:
+                programObjs = r.json()["timelineStatus"]["allPostAssessments"]
+            except ValueError:
+                # DE sometimes answers with a 200 and an HTML error page instead. It fails like a bad status would, and gets retried.
+                retryQueue.append(programID)
+                print(f"{programID} - Status: Failed")
+                continue
+
+            # The response holds the assessment of every program currently on the planner, not just the one we added. Yeah, don't ask why it's this way. Save all of them that we don't have yet, so that siblings in the same study area don't need their own POST later.
+            addedProgram = False
+            for programObj in programObjs:
+                postCode = programObj["postCode"]
+                if postCode == programID:
+                    saveProgramObj(programObj, store, refresh, onCategory)
+                    addedProgram = True
+                elif postCode not in harvested and refresh.needsDownload(store, postCode):
+                    saveProgramObj(programObj, store, refresh, onCategory)
+                    harvested.add(postCode)
+
+            # Shouldn't happen, just in case DE accepted the program but didn't assess it.
+            if not addedProgram:
+                retryQueue.append(programID)
+                print(f"{programID} - Status: Failed")
+                continue
+
+            print(f"{programID} - Status: Succeeded")
+            successes += 1
+    except SessionExpiredError as e:
+        # Nothing will succeed until the cookie is replaced, so don't bother with the rest.
+        print(e)
+        print(f"{programID} - Status: Failed")
+        failures.append(programID)
+        sessionExpired = True
+    else:
+        sessionExpired = False
+
+    # Whatever is still waiting for a retry has failed for good.
+    failures += retryQueue
+
+    # Reset the courses to clean up.
+    if not sessionExpired:
+        try:
+            client.post("dxPlanner/resetPrograms?tabIndex=0")
+        except requests.exceptions.RequestException:
+            pass
 
+    return (attempted, successes, sorted(harvested), skipped, failures)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    startMetrics(args)
 
     print("Starting program download...")
 
-    # If a directory is indicated, create it if it doesn't exist.
-    if args.p_jsons_dir:
+    # If a directory is indicated and there's no store file, create it if it doesn't exist.
+    if args.p_jsons_dir and not args.store_file:
         Path(args.p_jsons_dir).mkdir(exist_ok=True, parents=True)
 
-    # Load the cookies into the headers.
-    addProgramPOSTHeader["Cookie"] = args.cookie
-    resetProgramsPOSTHeader["Cookie"] = args.cookie
+    # One pooled session for every request of the run.
+    client = openClient(args, args.pool_size)
 
-    # Status vars.
-    attempted = 0
-    successes = 0
-    skipped = []
-    failures = []
+    refresh = openRefreshTracker(args)
 
-    # The current study area being downloaded. Some focuses in DE have strict dependencies on the specialist/major already being present. This ensures that we always try downloading focuses after the dependency is added.
-    currentStudyArea = None
+    # The same few categories come up in many programs, so collect them in a set and only write them out at the end.
+    harvestedCategories = set()
 
-    # Loop through every program from stdin.
-    for line in sys.stdin:
-        programID = line.strip()
-        studyAreaNum = allProgramsRe.match(programID).group(2)
-        attempted += 1
-
-        print(f"{programID} - Status: ", end="")
-
-        # Skip the program if we've already scraped it
-        f = Path(f"{args.p_jsons_dir}/{programID}.json")
-        if f.is_file():
-            skipped.append(programID)
-            print("Skipped")
-            continue
-
-        # Reset if we've finished all the programs from this subject area
-        if (studyAreaNum != currentStudyArea):
-            r = requests.post("https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxPlanner/resetPrograms?tabIndex=0", headers=resetProgramsPOSTHeader)
-            if (r.status_code != 200):
-                print("Course reset failed, quitting for now...")
-                sys.exit(1)
-            # print(f"Reseting programs for number {currentStudyArea}, moving to {studyAreaNum}")
-            currentStudyArea = studyAreaNum
-
-        # Add the program, hopefully it doesn't fail due to an un-added prereq program
-        r = requests.post(f"https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxPlanner/saveProgramEntry?tabIndex=0&newPostCode={programID}", headers=addProgramPOSTHeader)
-        if (r.status_code != 200):
-            failures.append(programID)
-            print("Failed")
-            continue
-
-
-        # Go through each program obj to only extract the one we added.
-        # Yeah, don't ask why it's this way.
-        thisProgramObj = list(filter(lambda programDataObj: programDataObj["postCode"] == programID, r.json()["timelineStatus"]["allPostAssessments"]))[0]
-        # Save the program info to file after extracting it from the morass
-        with open(f"{args.p_jsons_dir}/{programID}.json", 'w', encoding='utf-8') as f:
-            json.dump(thisProgramObj, f, ensure_ascii=False, indent=2)
-        # Now, we need to go through every course this program references, and note down every course category
-        for detailAssessment in thisProgramObj["detailAssessments"]:
-            for requisiteItem in detailAssessment["requirement"]["requisiteItems"]:
-                code = requisiteItem["code"]
-                if not allCoursesRe.match(code) and not allProgramsRe.match(code) and not requirementRe.match(code) and code != "":
-                    args.p_cc_ids_file.write(code + "\n")
-        
-        print("Succeeded")
-        successes += 1
+    # As in de_course_downloader.py, the IDs are only all read first for the progress line.
+    programIDs = (line.strip() for line in sys.stdin)
+    if args.progress:
+        programIDs = list(programIDs)
+        progressLine.start("programs", len(programIDs))
 
-    # Reset the courses to clean up.
-    r = requests.post("https://degreeexplorer.utoronto.ca/degreeExplorer/rest/dxPlanner/resetPrograms?tabIndex=0", headers=resetProgramsPOSTHeader)
+    with phase("download programs"):
+        (attempted, successes, harvested, skipped, failures) = downloadPrograms(client, programIDs, openStore(args.p_jsons_dir, args.store_file, "programs"), refresh, harvestedCategories.add)
+
+    numCategories = mergeIDs(args.p_cc_ids_file, harvestedCategories)
 
     # Print status information and exit.
     print("Finished.")
     print(f"Attempted to download {attempted} program(s) from Degree Explorer:")
     print(f"\tSucceeded in downloading {successes} program(s)")
+    print(f"\t{len(refresh.changed)} downloaded or harvested program(s) were new or changed")
+    print(f"\tHarvested {len(harvested)} program(s) from the responses of other programs. Harvested: {harvested}")
     print(f"\tSkipped {len(skipped)} program(s) because they have already been scraped. Skipped: {skipped}")
     print(f"\tFailed to download {len(failures)} program(s). Failed: {failures}")
+    print(f"Found {len(harvestedCategories)} course categories. {args.p_cc_ids_file} now lists {numCategories}")
 
-    # Close stuff.
-    args.p_cc_ids_file.close()
\ No newline at end of file
+    writeChangedIDs(args, refresh)
+    writeMetricsReport(args)
\ No newline at end of file
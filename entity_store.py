@@ -0,0 +1,188 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from aggregation_manifest import fingerprintFile
+from run_metrics import count, timed
+
+# Where the downloaders put the course, program and course category JSONs they download, and where the aggregators read them back from. Both stores key each entity by its code and hand back the same objects.
+
+# Characters that can't be part of a filename, stripped from codes in DirectoryStore.
+illegalFilenameChars = "\\/:*?<>|"
+
+def addStoreArguments(parser):
+    parser.add_argument('--store_file', type=str, help="path to a single SQLite file to keep downloaded JSONs in, instead of one JSON file per entity in the JSONs directory. Courses, programs and course categories each get their own table, so every downloader and aggregator can share one file. default: none", default=None, metavar='file')
+
+def openStore(jsonsDir, storeFile, table):
+    if storeFile:
+        return SQLiteStore(storeFile, table)
+    return DirectoryStore(jsonsDir)
+
+def addRefreshArguments(parser):
+    parser.add_argument('--refresh_age', type=float, help="re-download anything last downloaded more than this many hours ago, instead of skipping everything already downloaded. default: none", default=None, metavar='hours')
+    parser.add_argument('--refresh_ids_file', type=argparse.FileType('r'), help="path to ASCII file of IDs to re-download even if they have already been downloaded, one per line. default: none", default=None, metavar='file')
+    parser.add_argument('--changed_ids_file', type=argparse.FileType('w'), help="path to ASCII file to write the IDs of everything downloaded this run that is new or whose contents changed. default: none", default=None, metavar='file')
+
+def openRefreshTracker(args):
+    refreshIDs = [line.strip() for line in args.refresh_ids_file] if args.refresh_ids_file else []
+    return RefreshTracker(args.refresh_age, refreshIDs)
+
+def writeChangedIDs(args, refresh):
+    if args.changed_ids_file:
+        for key in refresh.changed:
+            args.changed_ids_file.write(key + "\n")
+        args.changed_ids_file.close()
+
+
+class RefreshTracker:
+    # Decides which entities need (re-)downloading, and keeps track of the ones whose contents actually changed when they were. Without a max age or any IDs, only entities missing from the store are downloaded, same as always.
+    def __init__(self, maxAgeHours=None, refreshIDs=()):
+        self.maxAge = maxAgeHours * 3600 if maxAgeHours is not None else None
+        self.refreshIDs = set(refreshIDs)
+        self.startTime = time.time()
+        self.changed = []
+
+    def needsDownload(self, store, key):
+        if key in self.refreshIDs:
+            return True
+        fetched = store.fetchedAt(key)
+        if fetched is None:
+            return True
+        return self.maxAge is not None and self.startTime - fetched > self.maxAge
+
+    def put(self, store, key, obj):
+        # The category crawl saves from several threads at once, but list.append is atomic.
+        if store.put(key, obj):
+            self.changed.append(key)
+
+
+class DirectoryStore:
+    # The original layout: one pretty-printed JSON file per entity, named after its code.
+    def __init__(self, jsonsDir):
+        self.jsonsDir = jsonsDir
+
+    def path(self, key):
+        # Category codes can contain characters that aren't allowed in filenames. Yeah, that means a couple of categories could collide, but none do so far.
+        filename = "".join(i for i in key if i not in illegalFilenameChars)
+        return Path(f"{self.jsonsDir}/{filename}.json")
+
+    def has(self, key):
+        return self.path(key).is_file()
+
+    def fetchedAt(self, key):
+        # Every file is rewritten or touched whenever its entity is downloaded, so its mtime is when that last happened.
+        try:
+            return os.stat(self.path(key)).st_mtime
+        except OSError:
+            return None
+
+    def put(self, key, obj):
+        # Returns whether the contents are new or changed. Unchanged files are only touched, to record that they were downloaded again.
+        with timed("jsonDumpSeconds"):
+            raw = json.dumps(obj, ensure_ascii=False, indent=2)
+        if self.readRaw(key) == raw:
+            os.utime(self.path(key))
+            return False
+        with open(self.path(key), 'w', encoding='utf-8') as f:
+            f.write(raw)
+        count("filesWritten")
+        count("bytesWritten", len(raw))
+        return True
+
+    def readRaw(self, key):
+        try:
+            with open(self.path(key), encoding='utf-8') as f:
+                raw = f.read()
+        except OSError:
+            return None
+        count("filesRead")
+        count("bytesRead", len(raw))
+        return raw
+
+    def get(self, key):
+        raw = self.readRaw(key)
+        if raw is None:
+            return None
+        with timed("jsonParseSeconds"):
+            return json.loads(raw)
+
+    def keys(self):
+        return [Path(jsonFile).stem for jsonFile in glob.glob(f"{self.jsonsDir}/*.json")]
+
+    def fingerprint(self, key, entry):
+        return fingerprintFile(self.path(key), entry)
+
+
+class SQLiteStore:
+    # Every entity as one row of compact, zlib-compressed JSON, indexed by its code. Checking whether something has been downloaded is a primary key lookup instead of a stat, and aggregating reads a single file instead of opening thousands.
+    def __init__(self, storeFile, table):
+        self.table = table
+        # The course category crawl reads and writes from several threads at once. sqlite3 connections can be shared as long as only one thread uses them at a time.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(storeFile, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, data BLOB NOT NULL, hash TEXT NOT NULL, fetched REAL NOT NULL DEFAULT 0)")
+        # Stores created before download times were recorded don't have the column yet. Their rows count as downloaded at the epoch, i.e. stale.
+        if "fetched" not in [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]:
+            self.connection.execute(f"ALTER TABLE {table} ADD COLUMN fetched REAL NOT NULL DEFAULT 0")
+        self.connection.commit()
+
+    def has(self, key):
+        with self.lock:
+            return self.connection.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def fetchedAt(self, key):
+        with self.lock:
+            row = self.connection.execute(f"SELECT fetched FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key, obj):
+        # Returns whether the contents are new or changed. Unchanged rows only get their download time updated.
+        with timed("jsonDumpSeconds"):
+            raw = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        newHash = hashlib.sha256(raw).hexdigest()
+        with self.lock:
+            row = self.connection.execute(f"SELECT hash FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] == newHash:
+                self.connection.execute(f"UPDATE {self.table} SET fetched = ? WHERE key = ?", (time.time(), key))
+            else:
+                data = zlib.compress(raw)
+                self.connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, data, hash, fetched) VALUES (?, ?, ?, ?)", (key, data, newHash, time.time()))
+                count("rowsWritten")
+                count("bytesWritten", len(data))
+            # Committed straight away, so an interrupted download keeps everything fetched so far.
+            self.connection.commit()
+        return row is None or row[0] != newHash
+
+    def readRaw(self, key):
+        with self.lock:
+            row = self.connection.execute(f"SELECT data FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        count("rowsRead")
+        count("bytesRead", len(row[0]))
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def get(self, key):
+        raw = self.readRaw(key)
+        if raw is None:
+            return None
+        with timed("jsonParseSeconds"):
+            return json.loads(raw)
+
+    def keys(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute(f"SELECT key FROM {self.table} ORDER BY key")]
+
+    def fingerprint(self, key, entry):
+        # The hash of every row is worked out when it's written, so there's nothing to re-read here.
+        with self.lock:
+            fingerprint = {"hash": self.connection.execute(f"SELECT hash FROM {self.table} WHERE key = ?", (key,)).fetchone()[0]}
+        return (fingerprint, entry is not None and entry["hash"] == fingerprint["hash"])
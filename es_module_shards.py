@@ -0,0 +1,61 @@
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+# brotli is optional. Without it, shards are only precompressed with gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Writes aggregated courses or programs as ES modules the frontend can import directly, split by the first three letters of their codes (i.e. the department for courses) so that it only ever loads the departments a student actually touches. Every module also gets precompressed .gz and, if brotli is installed, .br variants next to it, ready to be served as they are.
+#   <shards_dir>/CSC.js       export default {"CSC108H1": {...}, ...};
+#   <shards_dir>/manifest.js  export const shards = {"CSC": {"count": ..., "bytes": ..., "hash": ...}, ...};
+#                             export function loadShard(prefix) {...}
+
+def addShardArguments(parser):
+    parser.add_argument("--shards_dir", type=str, help="path to directory to also write the output into as ES modules, one per three-letter code prefix, along with a manifest.js and precompressed .gz (and .br, if brotli is installed) variants of each. default: none", default=None, metavar="dir")
+
+def shardPrefix(key):
+    return key[:3]
+
+def writeModule(path, source):
+    data = source.encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    # mtime=0 so that unchanged shards compress to identical files, and don't look changed to whatever deploys them.
+    with open(f"{path}.gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f"{path}.br", "wb") as f:
+            f.write(brotli.compress(data))
+    return data
+
+
+class ESModuleShardWriter:
+    # Shards can only be written once everything that goes in them is known, and with an arbitrary input order that's only at the end. So unlike JSONObjectStreamWriter, this does hold every object in memory until close.
+    def __init__(self, shardsDir):
+        self.shardsDir = shardsDir
+        self.shards = {}
+
+    def write(self, key, value):
+        self.shards.setdefault(shardPrefix(key), {})[key] = value
+
+    def close(self):
+        Path(self.shardsDir).mkdir(exist_ok=True, parents=True)
+
+        manifest = {}
+        for prefix in sorted(self.shards):
+            data = writeModule(f"{self.shardsDir}/{prefix}.js", f"export default {json.dumps(self.shards[prefix], ensure_ascii=False, separators=(',', ':'))};\n")
+            # The hash lets the frontend (or a service worker) tell whether a cached shard is still current.
+            manifest[prefix] = {"count": len(self.shards[prefix]), "bytes": len(data), "hash": hashlib.sha256(data).hexdigest()[:16]}
+
+        writeModule(f"{self.shardsDir}/manifest.js", f"""export const shards = {json.dumps(manifest, separators=(',', ':'))};
+
+// Resolves to the shard's object of codes to courses or programs. Bundlers split every shard in this directory into its own lazily loaded chunk.
+export function loadShard(prefix) {{
+    return import(`./${{prefix}}.js`).then(module => module.default);
+}}
+""")
+        return manifest
@@ -0,0 +1,20 @@
+import os
+
+# Helpers for the plain ASCII ID files the scripts pass between each other, one ID per line.
+
+def readIDs(idsFile):
+    # A missing file just means there are no IDs yet.
+    try:
+        with open(idsFile) as f:
+            return {line.strip() for line in f if line.strip() != ""}
+    except OSError:
+        return set()
+
+def mergeIDs(idsFile, ids):
+    # Rewrites idsFile with the union of its current IDs and ids, sorted and without duplicates. Returns how many IDs it holds now. Written to a temporary file first, so an interrupted run can't lose the IDs of earlier ones.
+    merged = sorted(readIDs(idsFile) | set(ids))
+    with open(f"{idsFile}.tmp", "w") as f:
+        for id in merged:
+            f.write(id + "\n")
+    os.replace(f"{idsFile}.tmp", idsFile)
+    return len(merged)
@@ -0,0 +1,54 @@
+// Decoder for the compact, interned aggregated JSONs written by course_aggregator.py and program_aggregator.py with --interned_file. See interned_json.py for the format.
+
+const formatName = "interned-1";
+
+function decodeValue(value, lookups) {
+    if (Array.isArray(value)) {
+        return value.map(item => decodeValue(item, lookups));
+    }
+    if (value === null || typeof value !== "object") {
+        return value;
+    }
+    const decoded = {};
+    for (const key in value) {
+        const strings = lookups[key];
+        const item = value[key];
+        if (strings === undefined) {
+            decoded[key] = decodeValue(item, lookups);
+        } else if (Array.isArray(item)) {
+            decoded[key] = item.map(index => strings[index]);
+        } else {
+            decoded[key] = strings[item];
+        }
+    }
+    return decoded;
+}
+
+function getLookups(payload) {
+    if (payload.format !== formatName) {
+        throw new Error(`Not an ${formatName} payload: ${payload.format}`);
+    }
+    const lookups = {};
+    for (const field in payload.fields) {
+        lookups[field] = payload.tables[payload.fields[field]];
+    }
+    return lookups;
+}
+
+// Decodes everything up front, giving exactly the object the aggregator writes as plain JSON.
+export function decodeInterned(payload) {
+    return decodeValue(payload.data, getLookups(payload));
+}
+
+// Decodes each course or program only when it's first asked for. Most sessions only ever look at a small fraction of them.
+export function createInternedLookup(payload) {
+    const lookups = getLookups(payload);
+    const cache = new Map();
+    return code => {
+        if (!cache.has(code)) {
+            const value = payload.data[code];
+            cache.set(code, value === undefined ? undefined : decodeValue(value, lookups));
+        }
+        return cache.get(code);
+    };
+}
@@ -0,0 +1,90 @@
+import argparse
+import json
+
+from json_stream import JSONObjectStreamWriter
+
+# A compact encoding of the aggregated courses and programs for the frontend. The same course codes, category codes, requisite types and descriptions come up thousands of times, so each distinct one is stored once in a string table and referenced by its index everywhere else. The layout is:
+#   {"format": "interned-1", "data": {...}, "fields": {field: table}, "tables": {table: [strings]}}
+# where data is the aggregated object as usual, except that the value of every field listed in fields (or each of its items, for lists) is an index into that table. interned_decoder.js decodes it on the frontend, same as decodeInterned does here.
+
+formatName = "interned-1"
+
+# Which string table the values of each field go into. Every field holding codes shares one table, since the same code shows up as a course in one requisite and as a category in another.
+internedFields = {
+    "type": "types",
+    "description": "descriptions",
+    "courses": "codes",
+    "categories": "codes",
+    "programs": "codes",
+}
+
+def addInternedArguments(parser, exampleFile):
+    parser.add_argument("--interned_file", type=argparse.FileType("w", encoding="utf-8"), help=f"path to file to also write the compact, interned encoding of the output into, e.g. {exampleFile}. See interned_json.py. default: none", default=None, metavar="file")
+
+
+class InternedJSONWriter:
+    # Writes the interned encoding one top-level member at a time, like JSONObjectStreamWriter. Strings are numbered in the order they are first seen, so the tables are only complete at the end and come after the data.
+    def __init__(self, f, fields=internedFields):
+        self.f = f
+        self.fields = fields
+        # Table name -> {string: index}. Dicts keep insertion order, so the keys are the table itself.
+        self.tables = {table: {} for table in fields.values()}
+        self.f.write(f'{{"format":{json.dumps(formatName)},"data":')
+        self.dataWriter = JSONObjectStreamWriter(f, False)
+
+    def intern(self, table, string):
+        strings = self.tables[table]
+        if string not in strings:
+            strings[string] = len(strings)
+        return strings[string]
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            encoded = {}
+            for (key, item) in value.items():
+                table = self.fields.get(key)
+                if table is None:
+                    encoded[key] = self.encode(item)
+                elif isinstance(item, list):
+                    encoded[key] = [self.intern(table, string) for string in item]
+                else:
+                    encoded[key] = self.intern(table, item)
+            return encoded
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        return value
+
+    def write(self, key, value):
+        self.dataWriter.write(key, self.encode(value))
+
+    def close(self):
+        self.dataWriter.close()
+        tables = {table: list(strings) for (table, strings) in self.tables.items()}
+        self.f.write(f',"fields":{json.dumps(self.fields, separators=(",", ":"))},"tables":{json.dumps(tables, ensure_ascii=False, separators=(",", ":"))}}}')
+
+
+def decodeValue(value, lookups):
+    if isinstance(value, dict):
+        decoded = {}
+        for (key, item) in value.items():
+            strings = lookups.get(key)
+            if strings is None:
+                decoded[key] = decodeValue(item, lookups)
+            elif isinstance(item, list):
+                decoded[key] = [strings[index] for index in item]
+            else:
+                decoded[key] = strings[item]
+        return decoded
+    if isinstance(value, list):
+        return [decodeValue(item, lookups) for item in value]
+    return value
+
+def decodeInterned(payload):
+    # Turns a parsed interned payload back into exactly the object the aggregator would have written as plain JSON.
+    if payload.get("format") != formatName:
+        raise ValueError(f"Not an {formatName} payload: {payload.get('format')}")
+    lookups = {field: payload["tables"][table] for (field, table) in payload["fields"].items()}
+    return decodeValue(payload["data"], lookups)
+
+def loadInterned(f):
+    return decodeInterned(json.load(f))
@@ -0,0 +1,27 @@
+import json
+
+# Writes one top-level JSON object to a file a member at a time, so that the aggregators never need to hold every cleaned object in memory. The output is byte for byte what json.dump of the whole dict would have produced, both compact and with indent=2.
+
+class JSONObjectStreamWriter:
+    def __init__(self, f, debug):
+        self.f = f
+        self.debug = debug
+        self.empty = True
+
+    def write(self, key, value):
+        # Everything before this member: the opening brace for the first one, the separator for the rest.
+        if self.debug:
+            self.f.write("{\n  " if self.empty else ",\n  ")
+            # Nested lines just need one more level of indentation. json.dumps escapes newlines inside strings, so every raw newline is a structural one.
+            valueStr = json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            self.f.write(f"{json.dumps(key, ensure_ascii=False)}: {valueStr}")
+        else:
+            self.f.write("{" if self.empty else ",")
+            self.f.write(f"{json.dumps(key, ensure_ascii=False)}:{json.dumps(value, ensure_ascii=False, separators=(',', ':'))}")
+        self.empty = False
+
+    def close(self):
+        if self.empty:
+            self.f.write("{}")
+        else:
+            self.f.write("\n}" if self.debug else "}")
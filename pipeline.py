@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import de_course_downloader
+import de_program_downloader
+import de_course_category_downloader
+import course_aggregator
+import program_aggregator
+import course_category_aggregator
+from de_client import addClientArguments, openClient
+from entity_store import addStoreArguments, openStore, addRefreshArguments, openRefreshTracker, writeChangedIDs
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase
+
+# The scraper's filename isn't a valid identifier, so it can only be imported by name.
+as_ids_scraper = importlib.import_module("a&s_ids_scraper")
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Runs every stage from scraping IDs to the aggregated JSONs in one process. Stages are connected by in-memory queues instead of ID files, so e.g. course categories are crawled while courses are still being downloaded.")
+parser.add_argument('chromedriver_path', type=Path, nargs='?', help="path to a valid chromedriver executable. Not needed with --http", default=None)
+parser.add_argument('cookie', type=str, help="cookie from a valid Degree Explorer session. To obtain this, log into DE with your UofT credentials, then copy the cookie from the Network tab of Chrome Devtools")
+parser.add_argument('row_num', type=int, help="row num of DE timetable into which to add courses before download")
+parser.add_argument('col_num', type=int, help="col num of DE timetable into which to add courses before download")
+parser.add_argument('--cells', type=str, nargs='+', help="additional free cells of the DE timetable to download courses through concurrently. See de_course_downloader.py. default: only row_num,col_num", default=[], metavar='cell')
+parser.add_argument('--c_jsons_dir', type=str, help="path to directory to store downloaded course JSONs. default: ./course_data", default="./course_data", metavar='dir')
+parser.add_argument('--p_jsons_dir', type=str, help="path to directory to store downloaded program JSONs. default: ./program_data", default="./program_data", metavar='dir')
+parser.add_argument('--cc_jsons_dir', type=str, help="path to directory to store downloaded course category JSONs. default: ./course_category_data", default="./course_category_data", metavar='dir')
+parser.add_argument('--c_aggr_file', type=str, help="path to file to write aggregated courses into. default: ./aggregated_courses.json", default="./aggregated_courses.json", metavar='file')
+parser.add_argument('--p_aggr_file', type=str, help="path to file to write aggregated programs into. default: ./aggregated_programs.json", default="./aggregated_programs.json", metavar='file')
+parser.add_argument('--cc_aggr_file', type=str, help="path to file to write aggregated course categories into. default: ./aggregated_course_categories.json", default="./aggregated_course_categories.json", metavar='file')
+parser.add_argument('--workers', type=int, help="max number of course categories to download concurrently. default: 8", default=8, metavar='num')
+parser.add_argument('--aggr_workers', type=int, help="number of processes each of the course and program aggregators cleans JSONs with. default: 1", default=1, metavar='num')
+parser.add_argument('--drivers', type=int, help="number of headless Chrome instances to scrape IDs with. See a&s_ids_scraper.py. default: 1", default=1, metavar='num')
+parser.add_argument('--http', action='store_true', help="scrape IDs with plain HTTP requests instead of through chromedriver. See a&s_ids_scraper.py")
+parser.add_argument('--scrape_workers', type=int, help="max number of subject area pages to fetch concurrently with --http. default: 8", default=8, metavar='num')
+parser.add_argument('--queue_size', type=int, help="max number of IDs waiting between two stages before the earlier one pauses. default: 1000", default=1000, metavar='num')
+addClientArguments(parser)
+addStoreArguments(parser)
+addRefreshArguments(parser)
+addMetricsArguments(parser)
+
+# Put on a queue by each of its producers once they are done.
+endOfStream = None
+
+def drain(q, producers=1):
+    # Yields everything put on q until every producer has marked the end of its stream.
+    while producers > 0:
+        item = q.get()
+        if item is endOfStream:
+            producers -= 1
+        else:
+            yield item
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if not args.http and args.chromedriver_path is None:
+        parser.error("chromedriver_path is required unless --http is given")
+    # The aggregators are handed their own arguments, without --metrics_file or --progress. Everything they record still ends up in this one report, and on this one progress line.
+    startMetrics(args)
+
+    print("Starting pipeline...")
+
+    if not args.store_file:
+        for jsonsDir in [args.c_jsons_dir, args.p_jsons_dir, args.cc_jsons_dir]:
+            Path(jsonsDir).mkdir(exist_ok=True, parents=True)
+    # Shared by every stage, so --changed_ids_file lists changed courses, programs and course categories alike.
+    refresh = openRefreshTracker(args)
+    # Passed on to every aggregator, so they read back from wherever the downloaders wrote to.
+    storeArgs = ["--store_file", args.store_file] if args.store_file else []
+
+    cells = de_course_downloader.parseCells([f"{args.row_num},{args.col_num}"] + args.cells)
+
+    # One pooled session shared by every stage, with room for all of them to have requests in flight at once.
+    client = openClient(args, max(args.pool_size, len(cells) + args.workers + 1))
+
+    # The queues replace course-ids.txt, program-ids.txt and the two course category ID files. They are bounded so that a fast stage can't run arbitrarily far ahead of a slow one.
+    courseIDs = queue.Queue(maxsize=args.queue_size)
+    programIDs = queue.Queue(maxsize=args.queue_size)
+    categoryIDs = queue.Queue(maxsize=args.queue_size)
+    # Set once aggregated_courses.json has been written, which the course category aggregator checks its regexes against.
+    coursesAggregated = threading.Event()
+
+    # Each category only needs to reach the crawl once, however many courses and programs mention it. The crawl would skip repeats anyway, but this keeps them off the queue.
+    seenCategories = set()
+    def onCategory(categoryID):
+        if categoryID not in seenCategories:
+            seenCategories.add(categoryID)
+            categoryIDs.put(categoryID)
+
+    # The stages run at the same time, so their phases overlap, and add up to more than the run's wall time.
+    def scrape():
+        try:
+            with phase("scrape"):
+                if args.http:
+                    return as_ids_scraper.scrapeIDsOverHTTP(courseIDs.put, programIDs.put, args.scrape_workers)
+                return as_ids_scraper.scrapeIDs(args.chromedriver_path, courseIDs.put, programIDs.put, args.drivers)
+        finally:
+            courseIDs.put(endOfStream)
+            programIDs.put(endOfStream)
+
+    def downloadAndAggregateCourses():
+        try:
+            pendingCourseIDs = drain(courseIDs)
+            try:
+                with phase("download courses"):
+                    results = de_course_downloader.downloadCourses(client, pendingCourseIDs, cells, openStore(args.c_jsons_dir, args.store_file, "courses"), refresh, onCategory)
+            finally:
+                categoryIDs.put(endOfStream)
+                # The download can quit early. Keep taking IDs anyway, so the scraper is never stuck waiting on a full queue.
+                for _ in pendingCourseIDs:
+                    pass
+            # Courses don't depend on anything else, so they can be aggregated while categories are still being crawled.
+            course_aggregator.main(course_aggregator.parser.parse_args(["--c_jsons_dir", args.c_jsons_dir, "--c_aggr_file", args.c_aggr_file, "--workers", str(args.aggr_workers)] + storeArgs))
+            return results
+        finally:
+            # Even if this failed, so that the category aggregation isn't left waiting forever.
+            coursesAggregated.set()
+
+    def downloadAndAggregatePrograms():
+        pendingProgramIDs = drain(programIDs)
+        try:
+            with phase("download programs"):
+                results = de_program_downloader.downloadPrograms(client, pendingProgramIDs, openStore(args.p_jsons_dir, args.store_file, "programs"), refresh, onCategory)
+        finally:
+            categoryIDs.put(endOfStream)
+            for _ in pendingProgramIDs:
+                pass
+        program_aggregator.main(program_aggregator.parser.parse_args(["--p_jsons_dir", args.p_jsons_dir, "--p_aggr_file", args.p_aggr_file, "--workers", str(args.aggr_workers)] + storeArgs))
+        return results
+
+    def crawlAndAggregateCategories():
+        # Both downloaders feed the crawl as they find categories. It only ends once both of them have.
+        pendingCategoryIDs = drain(categoryIDs, producers=2)
+        try:
+            with phase("crawl course categories"):
+                results = de_course_category_downloader.crawlCourseCategories(client, pendingCategoryIDs, openStore(args.cc_jsons_dir, args.store_file, "course_categories"), refresh, args.workers)
+        finally:
+            # If the crawl failed, keep taking categories anyway, so the downloaders are never stuck waiting on a full queue.
+            for _ in pendingCategoryIDs:
+                pass
+        # The optimized category regexes are checked against the aggregated courses, so those have to be written first.
+        coursesAggregated.wait()
+        course_category_aggregator.main(course_category_aggregator.parser.parse_args(["--cc_jsons_dir", args.cc_jsons_dir, "--cc_ids_file", args.cc_aggr_file, "--c_aggr_file", args.c_aggr_file] + storeArgs))
+        return results
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        scraping = executor.submit(scrape)
+        courses = executor.submit(downloadAndAggregateCourses)
+        programs = executor.submit(downloadAndAggregatePrograms)
+        categories = executor.submit(crawlAndAggregateCategories)
+
+        (numSubjectAreas, numCourses, numPrograms) = scraping.result()
+        (cAttempted, cSuccesses, cSkipped, cFailures) = courses.result()
+        (pAttempted, pSuccesses, pHarvested, pSkipped, pFailures) = programs.result()
+        (ccSuccesses, ccSkipped, ccFailures) = categories.result()
+
+    # Print status information and exit.
+    print("Finished.")
+    print(f"Examined {numSubjectAreas} subject areas and scraped {numCourses} course(s) and {numPrograms} program(s)")
+    print(f"Attempted to download {cAttempted} course(s): {cSuccesses} succeeded, {len(cSkipped)} skipped, {len(cFailures)} failed. Failures: {cFailures}")
+    print(f"Attempted to download {pAttempted} program(s): {pSuccesses} succeeded, {len(pHarvested)} harvested, {len(pSkipped)} skipped, {len(pFailures)} failed. Failures: {pFailures}")
+    print(f"Crawled {ccSuccesses + len(ccSkipped) + len(ccFailures)} course categories: {ccSuccesses} succeeded, {len(ccSkipped)} skipped, {len(ccFailures)} failed. Failures: {ccFailures}")
+    print(f"{len(refresh.changed)} downloaded course(s), program(s) and course categories were new or changed")
+
+    writeChangedIDs(args, refresh)
+    writeMetricsReport(args)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, timed
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Builds the prerequisite graph of the aggregated courses: which courses each one lists in its prerequisites and which courses list it, both directly and transitively, plus how deep each prerequisite chain goes.")
+parser.add_argument("--c_aggr_file", type=argparse.FileType("r"), help="path to aggregated courses to build the graph from. default: ./aggregated_courses.json", default="./aggregated_courses.json", metavar="file")
+parser.add_argument("--graph_file", type=argparse.FileType("w"), help="path to file to write the prerequisite graph into. default: ./prerequisite_graph.json", default="./prerequisite_graph.json", metavar="file")
+parser.add_argument("--debug", help="include to pretty-print JSON. Useful for debugging.", action="store_true")
+addMetricsArguments(parser)
+
+
+def findComponents(edges):
+    # Tarjan's strongly connected components, with an explicit stack so that long prerequisite chains can't hit the recursion limit. Components come out in reverse topological order, i.e. every component comes after all the ones it has edges into.
+    order = [None] * len(edges)
+    low = [0] * len(edges)
+    onStack = [False] * len(edges)
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(len(edges)):
+        if order[root] is not None:
+            continue
+        # Each entry is a node and the index of the next edge of it to follow.
+        work = [(root, 0)]
+        while work:
+            (node, edgeIndex) = work[-1]
+            if edgeIndex == 0:
+                order[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                onStack[node] = True
+
+            if edgeIndex < len(edges[node]):
+                work[-1] = (node, edgeIndex + 1)
+                successor = edges[node][edgeIndex]
+                if order[successor] is None:
+                    work.append((successor, 0))
+                elif onStack[successor]:
+                    low[node] = min(low[node], order[successor])
+                continue
+
+            # Every edge followed, so node is done.
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == order[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onStack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
+
+def bitsToIndices(bits):
+    # Closures are worked out as int bitsets, since OR-ing whole sets together is far cheaper than merging lists.
+    indices = []
+    while bits:
+        lowestBit = bits & -bits
+        indices.append(lowestBit.bit_length() - 1)
+        bits ^= lowestBit
+    return indices
+
+def buildPrerequisiteGraph(aggregatedCourses):
+    # Every aggregated course, plus every course only ever mentioned in someone's prerequisites.
+    courses = set(aggregatedCourses.keys())
+    for courseObj in aggregatedCourses.values():
+        for prereqObj in courseObj["prerequisites"].values():
+            courses.update(prereqObj.get("courses", []))
+    courses = sorted(courses)
+    courseIndices = {course: i for i, course in enumerate(courses)}
+
+    # An edge goes from a course to every course listed in any of its prerequisites. That includes alternatives, e.g. both courses of "CSC148H1 or CSC111H1", so read the edges as "may be needed for" rather than "always needed for".
+    prerequisites = [set() for _ in courses]
+    for (course, courseObj) in aggregatedCourses.items():
+        for prereqObj in courseObj["prerequisites"].values():
+            prerequisites[courseIndices[course]].update(courseIndices[prereq] for prereq in prereqObj.get("courses", []))
+    prerequisites = [sorted(edges) for edges in prerequisites]
+
+    unlocks = [[] for _ in courses]
+    for (course, edges) in enumerate(prerequisites):
+        for prereq in edges:
+            unlocks[prereq].append(course)
+
+    # Courses in the same strongly connected component all (transitively) need each other, so they share one closure and depth. Going through the components in reverse topological order means every component a component depends on is already done.
+    components = findComponents(prerequisites)
+    componentOf = [0] * len(courses)
+    for (componentIndex, component) in enumerate(components):
+        for member in component:
+            componentOf[member] = componentIndex
+
+    componentClosures = [0] * len(components)
+    componentDepths = [0] * len(components)
+    for (componentIndex, component) in enumerate(components):
+        closure = 0
+        depth = 0
+        for member in component:
+            for prereq in prerequisites[member]:
+                closure |= (1 << prereq) | componentClosures[componentOf[prereq]]
+                if componentOf[prereq] != componentIndex:
+                    depth = max(depth, componentDepths[componentOf[prereq]] + 1)
+        componentClosures[componentIndex] = closure
+        componentDepths[componentIndex] = depth
+
+    # A course isn't listed as its own prerequisite, even if it's part of a cycle. The cycles are reported separately.
+    allPrerequisites = [bitsToIndices(componentClosures[componentOf[course]] & ~(1 << course)) for course in range(len(courses))]
+    allUnlocks = [[] for _ in courses]
+    for (course, closure) in enumerate(allPrerequisites):
+        for prereq in closure:
+            allUnlocks[prereq].append(course)
+
+    # A component of more than one course is a cycle. So is a single course listing itself.
+    cycles = [sorted(component) for component in components if len(component) > 1 or component[0] in prerequisites[component[0]]]
+    cycles.sort()
+
+    # Everything refers to courses by their index in the courses list to keep the file small. Looking up e.g. what CSC148H1 unlocks is then unlocks[courses.index("CSC148H1")], or a dict lookup once the frontend builds the reverse of courses.
+    return {
+        "courses": courses,
+        "prerequisites": prerequisites,
+        "unlocks": unlocks,
+        "allPrerequisites": allPrerequisites,
+        "allUnlocks": allUnlocks,
+        # The length of the longest prerequisite chain below each course. 0 means it has no course prerequisites.
+        "depths": [componentDepths[componentOf[course]] for course in range(len(courses))],
+        "cycles": cycles
+    }
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+
+    print("Starting prerequisite graph building...")
+
+    with phase("read"), timed("jsonParseSeconds"):
+        aggregatedCourses = json.load(args.c_aggr_file)
+
+    with phase("build"):
+        graph = buildPrerequisiteGraph(aggregatedCourses)
+
+    with phase("write"), timed("jsonDumpSeconds"):
+        if (args.debug):
+            json.dump(graph, args.graph_file, ensure_ascii=False, indent=2)
+        else:
+            json.dump(graph, args.graph_file, ensure_ascii=False, separators=(",", ":"))
+
+    # Print diagnostics
+    print("Finished.")
+    print(f"Built the prerequisite graph of {len(graph['courses'])} course(s) with {sum(len(edges) for edges in graph['prerequisites'])} edge(s). The longest prerequisite chain is {max(graph['depths'], default=0)} course(s) deep")
+    for cycle in graph["cycles"]:
+        print(f"\tCycle detected in prerequisites: {', '.join(graph['courses'][course] for course in cycle)}")
+
+    args.c_aggr_file.close()
+    args.graph_file.close()
+    writeMetricsReport(args)
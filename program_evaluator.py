@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import re
+
+from run_metrics import addMetricsArguments, startMetrics, writeMetricsReport, phase, timed
+
+# Checks which programs students have completed, given the courses each one has taken, against aggregated_programs.json and aggregated_course_categories.json. Any number of transcripts are evaluated at once. Every transcript is one bit of a Python int, and every course is the bitset of the transcripts that have it, so that checking a requirement for all of them takes a handful of big integer operations per course rather than a loop over the transcripts.
+#
+# Each requirement evaluates to two bitsets over the transcripts: those that definitely satisfy it, and those that possibly do. The two differ wherever the answer can't be known, e.g. for UNVERIFIABLE requirements, unvalidatable or missing course categories, or courses that couldn't be handed out to NO_REUSE requirements. So every transcript and program comes out as COMPLETE, UNVERIFIABLE or INCOMPLETE.
+#
+# The aggregated requirements don't say everything, so this assumes that:
+#   - a program is complete once all its requirements are satisfied, except those that are only options of a .../REQS/MIN requirement, which count through it instead
+#   - NOTEs are always satisfied
+#   - the courses a requirement uses, as far as GROUPMIN and GROUPMAX requirements are concerned, are all of the student's courses it could use
+#   - requirements listed in a NO_REUSE are satisfied together if handing out the courses greedily, most constrained requirement first, works. If it doesn't, while each one is satisfied by itself, the result is UNVERIFIABLE, since some other way of handing them out might have worked.
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description="Evaluates which programs one or more students have completed, using the aggregated programs and course categories.")
+parser.add_argument("--p_aggr_file", type=argparse.FileType("r"), help="path to aggregated programs to evaluate. default: ./aggregated_programs.json", default="./aggregated_programs.json", metavar="file")
+parser.add_argument("--cc_aggr_file", type=argparse.FileType("r"), help="path to aggregated course categories the programs refer to. default: ./aggregated_course_categories.json", default="./aggregated_course_categories.json", metavar="file")
+transcriptsGroup = parser.add_mutually_exclusive_group(required=True)
+transcriptsGroup.add_argument("--transcripts_file", type=argparse.FileType("r"), help="path to JSON file of transcripts to evaluate, as an object of transcript IDs to lists of course codes.", metavar="file")
+transcriptsGroup.add_argument("--courses", type=str, nargs="+", help="course codes of a single transcript to evaluate, e.g. to see what a planned set of courses would complete. Prints the status of every requirement of the --programs given.", metavar="code")
+parser.add_argument("--programs", type=str, nargs="+", help="codes of the programs to evaluate. default: all of them", default=None, metavar="code")
+parser.add_argument("--results_file", type=argparse.FileType("w"), help="path to file to write the completed and unverifiable programs of every transcript into. default: ./program_completion.json", default="./program_completion.json", metavar="file")
+parser.add_argument("--debug", help="include to pretty-print JSON. Useful for debugging.", action="store_true")
+addMetricsArguments(parser)
+
+# The H or Y of a course code, which makes it a half or a full credit.
+courseWeightRe = re.compile("[A-Z]{3}[A-Z0-9][0-9]{2,3}([HY])")
+
+
+def creditUnits(course):
+    # Credits are counted in half credits, so that they add up as integers.
+    match = courseWeightRe.match(course)
+    if match is None:
+        return 0
+    return 2 if match.group(1) == "Y" else 1
+
+def bitsetFromIndices(indices, size):
+    bits = bytearray((size + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+def indicesFromBitset(bitset):
+    # Through the binary string, which is linear in the size of the bitset, rather than clearing one bit at a time, which isn't.
+    return [i for (i, bit) in enumerate(reversed(bin(bitset)[2:])) if bit == "1"]
+
+def atLeast(weightedBitsets, threshold, everyone):
+    # The transcripts whose total is at least threshold, where each (bitset, weight) adds weight to the total of every transcript in the bitset. The totals are kept bit-sliced, one big integer per binary digit, and added to like a ripple-carry adder working on every transcript at once.
+    if threshold <= 0:
+        return everyone
+    digits = [0] * threshold.bit_length()
+    # Totals that carried out of the top digit are past the threshold for good.
+    overflow = 0
+    for (bitset, weight) in weightedBitsets:
+        for shift in range(weight.bit_length()):
+            if not (weight >> shift) & 1:
+                continue
+            carry = bitset
+            for digit in range(shift, len(digits)):
+                if not carry:
+                    break
+                (digits[digit], carry) = (digits[digit] ^ carry, digits[digit] & carry)
+            overflow |= carry
+    # Compare every total against the threshold, from the top digit down.
+    greater = 0
+    equal = everyone
+    for digit in reversed(range(len(digits))):
+        if (threshold >> digit) & 1:
+            equal &= digits[digit]
+        else:
+            greater |= equal & digits[digit]
+            equal &= ~digits[digit]
+    return greater | equal | overflow
+
+
+class ProgramEvaluator:
+    def __init__(self, aggregatedPrograms, aggregatedCategories, transcripts):
+        # transcripts is a list of lists of course codes.
+        self.programs = aggregatedPrograms
+        self.categories = aggregatedCategories
+        self.transcripts = [set(courses) for courses in transcripts]
+        self.everyone = (1 << len(transcripts)) - 1
+
+        # Course -> bitset of the transcripts that have it. Courses nobody has aren't in here at all.
+        holders = {}
+        for (i, courses) in enumerate(self.transcripts):
+            for course in courses:
+                holders.setdefault(course, []).append(i)
+        self.holders = {course: bitsetFromIndices(indices, len(transcripts)) for (course, indices) in holders.items()}
+
+        # Category -> (the courses anyone has that are in it, whether that is certain). Only the courses somebody has ever matter, so that is all each regex is matched against.
+        self.categoryCourses = {}
+        # (program, requirement) -> (definitely, possibly) bitsets, for the program being evaluated.
+        self.results = {}
+        self.evaluating = set()
+
+    def coursesOfCategory(self, category):
+        if category not in self.categoryCourses:
+            ccObj = self.categories.get(category)
+            if ccObj is None or not ccObj["validatable"]:
+                self.categoryCourses[category] = (frozenset(), False)
+            else:
+                regex = re.compile(ccObj["regex"])
+                self.categoryCourses[category] = (frozenset(course for course in self.holders if regex.match(course)), True)
+        return self.categoryCourses[category]
+
+    def requisiteCourses(self, reqObj):
+        # The courses a requirement lists or takes from its categories, and whether that is all of them.
+        courses = set(reqObj.get("courses", []))
+        certain = True
+        for category in reqObj.get("categories", []):
+            (categoryCourses, categoryCertain) = self.coursesOfCategory(category)
+            courses |= categoryCourses
+            certain = certain and categoryCertain
+        return (courses, certain)
+
+    def weighted(self, courses, constraint):
+        # Courses count one each, credits by the course's weight.
+        weights = ((course, 1 if constraint == "NUM" else creditUnits(course)) for course in sorted(courses))
+        return [(self.holders[course], weight) for (course, weight) in weights if course in self.holders and weight]
+
+    def requirement(self, programCode, reqID):
+        key = (programCode, reqID)
+        if key not in self.results:
+            requirements = self.programs[programCode]["detailAssessments"]
+            # Requirements referring to ones that don't exist, or back to themselves, can't be known.
+            if reqID not in requirements or key in self.evaluating:
+                return (0, self.everyone)
+            self.evaluating.add(key)
+            self.results[key] = self.evaluateRequirement(programCode, requirements[reqID])
+            self.evaluating.discard(key)
+        return self.results[key]
+
+    def evaluateRequirement(self, programCode, reqObj):
+        (_, constraint, kind) = requirementKind(reqObj)
+        try:
+            count = float(reqObj.get("count", 0))
+        except ValueError:
+            return (0, self.everyone)
+
+        if reqObj["type"] == "NOTE":
+            return (self.everyone, self.everyone)
+
+        if kind == "LIST":
+            satisfied = self.everyone
+            for course in reqObj.get("courses", []):
+                satisfied &= self.holders.get(course, 0)
+            return (satisfied, satisfied)
+
+        if kind == "MIN" and constraint == "REQS":
+            dependents = [self.requirement(programCode, dependentReq) for dependentReq in reqObj.get("dependentReqs", [])]
+            if not dependents:
+                return (0, self.everyone)
+            threshold = math.ceil(count - 1e-9)
+            return (atLeast([(definitely, 1) for (definitely, _) in dependents], threshold, self.everyone), atLeast([(possibly, 1) for (_, possibly) in dependents], threshold, self.everyone))
+
+        if kind == "MIN" and constraint in ("NUM", "FCES"):
+            (courses, certain) = self.requisiteCourses(reqObj)
+            satisfied = atLeast(self.weighted(courses, constraint), units(count, constraint), self.everyone)
+            # Courses in unvalidatable categories could only ever add to the total.
+            return (satisfied, satisfied if certain else self.everyone)
+
+        if kind in ("GROUPMIN", "GROUPMAX") and constraint in ("NUM", "FCES"):
+            (groupCourses, groupCertain) = self.requisiteCourses(reqObj)
+            (usedCourses, usedCertain) = (set(), True)
+            for recursReq in reqObj.get("recursReqs", []):
+                (courses, certain) = self.usedCourses(programCode, recursReq, set())
+                usedCourses |= courses
+                usedCertain = usedCertain and certain
+            certain = groupCertain and usedCertain
+            weighted = self.weighted(groupCourses & usedCourses, constraint)
+            if kind == "GROUPMIN":
+                satisfied = atLeast(weighted, units(count, constraint), self.everyone)
+                return (satisfied, satisfied if certain else self.everyone)
+            # Anything unknown could only push the total over the maximum.
+            satisfied = self.everyone & ~atLeast(weighted, math.floor(count * (2 if constraint == "FCES" else 1) + 1e-9) + 1, self.everyone)
+            return (satisfied if certain else 0, satisfied)
+
+        if kind == "NO_REUSE":
+            return self.evaluateNoReuse(programCode, reqObj.get("dependentReqs", []))
+
+        # UNVERIFIABLE, and anything else the aggregator didn't know either.
+        return (0, self.everyone)
+
+    def usedCourses(self, programCode, reqID, seen):
+        # The courses a requirement could use, and whether that is all of them. Requirements made of other requirements use what those do.
+        requirements = self.programs[programCode]["detailAssessments"]
+        if reqID not in requirements or reqID in seen:
+            return (set(), False)
+        seen.add(reqID)
+        reqObj = requirements[reqID]
+        (_, constraint, kind) = requirementKind(reqObj)
+        if reqObj["type"] == "NOTE":
+            return (set(), True)
+        if kind in ("LIST", "GROUPMIN", "GROUPMAX") or (kind == "MIN" and constraint in ("NUM", "FCES")):
+            return self.requisiteCourses(reqObj)
+        if kind == "NO_REUSE" or (kind == "MIN" and constraint == "REQS"):
+            (courses, certain) = (set(), True)
+            for dependentReq in reqObj.get("dependentReqs", []):
+                (dependentCourses, dependentCertain) = self.usedCourses(programCode, dependentReq, seen)
+                courses |= dependentCourses
+                certain = certain and dependentCertain
+            return (courses, certain)
+        return (set(), False)
+
+    def evaluateNoReuse(self, programCode, dependentReqs):
+        dependents = [self.requirement(programCode, dependentReq) for dependentReq in dependentReqs]
+        (allDefinitely, allPossibly) = (self.everyone, self.everyone)
+        for (definitely, possibly) in dependents:
+            allDefinitely &= definitely
+            allPossibly &= possibly
+
+        # What each listed requirement needs out of a transcript: all of some courses, or a number of units from some courses, or nothing it could share. If any of them can't be known, neither can whether they fit together.
+        shares = []
+        for dependentReq in dependentReqs:
+            reqObj = self.programs[programCode]["detailAssessments"].get(dependentReq)
+            # Listing a requirement the program doesn't have. requirement() already made it unknown.
+            if reqObj is None:
+                return (0, allPossibly)
+            (_, constraint, kind) = requirementKind(reqObj)
+            if kind == "LIST":
+                shares.append(("all", set(reqObj.get("courses", [])), 0, constraint))
+            elif kind == "MIN" and constraint in ("NUM", "FCES"):
+                (courses, certain) = self.requisiteCourses(reqObj)
+                if not certain:
+                    return (0, allPossibly)
+                try:
+                    shares.append(("units", courses, units(float(reqObj["count"]), constraint), constraint))
+                except (KeyError, ValueError):
+                    return (0, allPossibly)
+            elif reqObj["type"] == "NOTE" or kind in ("GROUPMIN", "GROUPMAX"):
+                shares.append(("none", set(), 0, constraint))
+            else:
+                return (0, allPossibly)
+
+        # Only transcripts satisfying every listed requirement by itself need the courses handed out. This is the one part done transcript by transcript.
+        satisfied = 0
+        for i in indicesFromBitset(allDefinitely):
+            if handOutCourses(shares, self.transcripts[i]):
+                satisfied |= 1 << i
+        return (satisfied, allPossibly)
+
+    def evaluateProgram(self, programCode):
+        # Returns (definitely, possibly) bitsets of the transcripts completing the program, and the same for each of its requirements.
+        self.results = {}
+        requirements = self.programs[programCode]["detailAssessments"]
+        # Requirements that are options of another count through that one.
+        options = {dependentReq for reqObj in requirements.values() if requirementKind(reqObj)[1] == "REQS" for dependentReq in reqObj.get("dependentReqs", [])}
+        (definitely, possibly) = (self.everyone, self.everyone)
+        for reqID in requirements:
+            if reqID not in options:
+                (reqDefinitely, reqPossibly) = self.requirement(programCode, reqID)
+                definitely &= reqDefinitely
+                possibly &= reqPossibly
+        requirementResults = {reqID: self.requirement(programCode, reqID) for reqID in requirements}
+        return (definitely, possibly, requirementResults)
+
+
+def requirementKind(reqObj):
+    # e.g. "COURSES_CATEGORIES/FCES/MIN" -> ("COURSES_CATEGORIES", "FCES", "MIN"). NOTE and UNVERIFIABLE have neither a constraint nor a kind.
+    return tuple((reqObj["type"].split("/") + ["", ""])[:3])
+
+def units(count, constraint):
+    # Courses are counted as they are, credits in half credits.
+    return math.ceil(count * (2 if constraint == "FCES" else 1) - 1e-9)
+
+def handOutCourses(shares, courses):
+    # Hands out the courses to the requirements sharing them, the one with the fewest courses to pick from first. Each takes what it needs, preferring courses fewer of the others could use, and then smaller ones so as not to overshoot. Returns whether every requirement got enough.
+    available = set(courses)
+    order = sorted(range(len(shares)), key=lambda i: len(shares[i][1] & available))
+    for (position, i) in enumerate(order):
+        (share, candidates, needed, constraint) = shares[i]
+        if share == "all":
+            if not candidates <= available:
+                return False
+            available -= candidates
+        elif share == "units":
+            later = [shares[j][1] for j in order[position + 1:]]
+            got = 0
+            for course in sorted(candidates & available, key=lambda course: (sum(course in other for other in later), creditUnits(course), course)):
+                if got >= needed:
+                    break
+                weight = 1 if constraint == "NUM" else creditUnits(course)
+                if weight:
+                    available.discard(course)
+                    got += weight
+            if got < needed:
+                return False
+    return True
+
+def status(transcript, definitely, possibly):
+    if (definitely >> transcript) & 1:
+        return "COMPLETE"
+    if (possibly >> transcript) & 1:
+        return "UNVERIFIABLE"
+    return "INCOMPLETE"
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    startMetrics(args)
+
+    print("Starting program evaluation...")
+
+    with phase("read"), timed("jsonParseSeconds"):
+        aggregatedPrograms = json.load(args.p_aggr_file)
+        aggregatedCategories = json.load(args.cc_aggr_file)
+        if args.transcripts_file:
+            transcripts = json.load(args.transcripts_file)
+            args.transcripts_file.close()
+        else:
+            transcripts = {"courses": args.courses}
+    transcriptIDs = list(transcripts.keys())
+    programCodes = args.programs if args.programs is not None else list(aggregatedPrograms.keys())
+    unknownPrograms = [programCode for programCode in programCodes if programCode not in aggregatedPrograms]
+    programCodes = [programCode for programCode in programCodes if programCode in aggregatedPrograms]
+
+    with phase("index"):
+        evaluator = ProgramEvaluator(aggregatedPrograms, aggregatedCategories, [[course.strip() for course in transcripts[transcriptID]] for transcriptID in transcriptIDs])
+
+    results = {transcriptID: {"complete": [], "unverifiable": []} for transcriptID in transcriptIDs}
+    with phase("evaluate"):
+        for programCode in programCodes:
+            (definitely, possibly, requirementResults) = evaluator.evaluateProgram(programCode)
+            for i in indicesFromBitset(definitely):
+                results[transcriptIDs[i]]["complete"].append(programCode)
+            for i in indicesFromBitset(possibly & ~definitely):
+                results[transcriptIDs[i]]["unverifiable"].append(programCode)
+
+            # For a single transcript and the programs asked for, say which requirements are (not) done.
+            if args.courses and args.programs:
+                print(f"{programCode} - {aggregatedPrograms[programCode]['title']}: {status(0, definitely, possibly)}")
+                for (reqID, (reqDefinitely, reqPossibly)) in requirementResults.items():
+                    print(f"\t{reqID}: {status(0, reqDefinitely, reqPossibly)} - {aggregatedPrograms[programCode]['detailAssessments'][reqID]['description']}")
+
+    with phase("write"), timed("jsonDumpSeconds"):
+        if (args.debug):
+            json.dump(results, args.results_file, ensure_ascii=False, indent=2)
+        else:
+            json.dump(results, args.results_file, ensure_ascii=False, separators=(",", ":"))
+
+    # Print diagnostics
+    print("Finished.")
+    print(f"Evaluated {len(transcriptIDs)} transcript(s) against {len(programCodes)} program(s)")
+    print(f"\t{sum(len(result['complete']) for result in results.values())} completed and {sum(len(result['unverifiable']) for result in results.values())} unverifiable program(s) in total")
+    if unknownPrograms:
+        print(f"\tSkipped {len(unknownPrograms)} program(s) not in {args.p_aggr_file.name}: {unknownPrograms}")
+
+    args.p_aggr_file.close()
+    args.cc_aggr_file.close()
+    args.results_file.close()
+    writeMetricsReport(args)
@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# resource is Unix only. Without it, the report just has no peak RSS.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Metrics of a run, shared by the scraper, the downloaders and the aggregators. Every script records into the same module-level state, and with --metrics_file writes it out as one JSON report at the end:
+#   {"script": ..., "startedAt": ..., "wallTime": ..., "peakRSSKiB": ...,
+#    "phases": {phase: seconds},
+#    "requests": {endpoint: {"count": ..., "statuses": {status: count}, "bytesReceived": ..., "totalMs": ..., "maxMs": ..., "p50Ms": ..., "p90Ms": ..., "p99Ms": ..., "buckets": {upperBoundMs: count}}},
+#    "counters": {counter: value}}
+# Counters include filesRead/filesWritten (rowsRead/rowsWritten with a SQLite store) and the bytes in them, jsonParseSeconds, jsonDumpSeconds and retries. They only cover this process: with --workers, whatever the aggregators' worker processes do isn't counted.
+# The benchmarks in benchmarks/ read phaseTimes directly.
+
+# Upper bounds, in milliseconds, of the latency histogram buckets. The last one catches everything slower.
+latencyBuckets = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf")]
+
+# Phase name -> total seconds of wall time spent in it so far. Phases entered more than once add up.
+phaseTimes = {}
+# Endpoint -> its latency histogram and totals, as in the report.
+requestMetrics = {}
+# Counter name -> value so far.
+counters = {}
+
+# The downloaders record from many threads at once.
+lock = threading.Lock()
+startTime = time.time()
+startCounter = time.perf_counter()
+
+
+def addMetricsArguments(parser):
+    parser.add_argument('--metrics_file', type=str, help="path to file to write a JSON report of the run's timings, request latencies, bytes transferred, files read and written, JSON parsing time and retries into, once it is done. default: none", default=None, metavar='file')
+    parser.add_argument('--progress', action='store_true', help="include to show a live progress line on stderr with the throughput and, where the total is known, the ETA of each stage. Best with stdout redirected")
+
+def startMetrics(args):
+    progressLine.enabled = args.progress
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with lock:
+            phaseTimes[name] = phaseTimes.get(name, 0) + elapsed
+
+def count(name, amount=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+@contextmanager
+def timed(name):
+    # Adds the seconds spent inside to a counter, e.g. jsonParseSeconds.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(name, time.perf_counter() - start)
+
+def recordRequest(endpoint, seconds, status, bytesReceived=0):
+    # status is the HTTP status, or the name of the exception if there was no response at all.
+    latencyMs = seconds * 1000
+    with lock:
+        metrics = requestMetrics.setdefault(endpoint, {"count": 0, "statuses": {}, "bytesReceived": 0, "totalMs": 0, "maxMs": 0, "buckets": [0] * len(latencyBuckets)})
+        metrics["count"] += 1
+        metrics["statuses"][str(status)] = metrics["statuses"].get(str(status), 0) + 1
+        metrics["bytesReceived"] += bytesReceived
+        metrics["totalMs"] += latencyMs
+        metrics["maxMs"] = max(metrics["maxMs"], latencyMs)
+        metrics["buckets"][next(i for (i, bound) in enumerate(latencyBuckets) if latencyMs <= bound)] += 1
+
+def bucketPercentile(buckets, fraction):
+    # Only as precise as the buckets: the upper bound of the one the percentile falls into.
+    target = fraction * sum(buckets)
+    seen = 0
+    for (bound, bucketCount) in zip(latencyBuckets, buckets):
+        seen += bucketCount
+        if seen >= target and bucketCount:
+            return bound if bound != float("inf") else None
+    return None
+
+def peakRSS():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux but in bytes on macOS.
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRSS // 1024 if sys.platform == "darwin" else maxRSS
+
+def metricsReport():
+    with lock:
+        requests = {}
+        for (endpoint, metrics) in requestMetrics.items():
+            requests[endpoint] = dict(metrics, **{
+                "p50Ms": bucketPercentile(metrics["buckets"], 0.5),
+                "p90Ms": bucketPercentile(metrics["buckets"], 0.9),
+                "p99Ms": bucketPercentile(metrics["buckets"], 0.99),
+                # JSON has no infinity, so the last bucket is keyed "inf".
+                "buckets": {("inf" if bound == float("inf") else str(bound)): bucketCount for (bound, bucketCount) in zip(latencyBuckets, metrics["buckets"])}
+            })
+        return {
+            "script": os.path.basename(sys.argv[0]),
+            "startedAt": startTime,
+            "wallTime": time.perf_counter() - startCounter,
+            "peakRSSKiB": peakRSS(),
+            "phases": dict(phaseTimes),
+            "requests": requests,
+            "counters": dict(counters)
+        }
+
+def writeMetricsReport(args):
+    progressLine.finish()
+    if args.metrics_file:
+        with open(args.metrics_file, "w") as f:
+            json.dump(metricsReport(), f, indent=2)
+
+
+class ProgressLine:
+    # One line on stderr, redrawn in place at most a few times a second, with every stage's progress side by side, e.g.
+    #   courses 1200/7021 (17%) 9.8/s ETA 9m54s | course categories 310 14.2/s
+    def __init__(self):
+        self.enabled = False
+        # Stage -> [done, total or None, start time]
+        self.stages = {}
+        self.lastDrawn = 0
+        self.lock = threading.Lock()
+
+    def start(self, stage, total=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.stages[stage] = [0, total, time.perf_counter()]
+
+    def advance(self, stage, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, None, time.perf_counter()])
+            entry[0] += amount
+            now = time.perf_counter()
+            if now - self.lastDrawn >= 0.25:
+                self.lastDrawn = now
+                self.draw(now)
+
+    def draw(self, now):
+        parts = []
+        for (stage, (done, total, started)) in self.stages.items():
+            rate = done / (now - started) if now > started else 0
+            part = f"{stage} {done}/{total} ({done / total:.0%})" if total else f"{stage} {done}"
+            part += f" {rate:.1f}/s"
+            if total and rate > 0 and done < total:
+                part += f" ETA {formatDuration((total - done) / rate)}"
+            parts.append(part)
+        # Pad over whatever was left of a longer previous line.
+        sys.stderr.write("\r" + " | ".join(parts).ljust(79))
+        sys.stderr.flush()
+
+    def finish(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.stages:
+                self.draw(time.perf_counter())
+                sys.stderr.write("\n")
+                sys.stderr.flush()
+            self.stages = {}
+
+def formatDuration(seconds):
+    (minutes, seconds) = divmod(int(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+progressLine = ProgressLine()